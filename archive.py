@@ -0,0 +1,73 @@
+import tarfile
+import zipfile
+import zlib
+from collections.abc import Callable, Iterator
+from io import BytesIO
+
+import magic
+from fastapi import UploadFile
+
+from image import MAX_SIZE, SNIFF_SIZE
+
+ARCHIVE_TYPES = [
+    'application/zip',
+    'application/x-tar',
+    'application/gzip',
+]
+
+# что бросают tarfile, gzip и zipfile на обрезанных и повреждённых архивах
+ARCHIVE_ERRORS = (tarfile.TarError, zipfile.BadZipFile, zlib.error, EOFError, OSError, NotImplementedError)
+
+class DamagedUpload(UploadFile):
+    """
+    Архив или файл в нём, который не удалось прочитать: в ответе на его
+    месте будет ошибка, остальные снимки анализируются как обычно.
+    """
+    def __init__(self, filename: str | None, error: str):
+        super().__init__(BytesIO(), size=0, filename=filename)
+        self.error = error
+
+def is_archive(file: UploadFile) -> bool:
+    header = file.file.read(SNIFF_SIZE)
+    file.file.seek(0)
+    try:
+        return magic.from_buffer(header, mime=True) in ARCHIVE_TYPES
+    except magic.MagicException:
+        return False
+
+def _member(name: str, size: int, read: Callable[[], bytes]) -> UploadFile:
+    # слишком большие файлы не читаем: process_image отклонит их по размеру
+    try:
+        content = read() if 0 < size <= MAX_SIZE else b''
+    except ARCHIVE_ERRORS:
+        return DamagedUpload(name, 'Invalid archive member')
+    return UploadFile(BytesIO(content), size=size, filename=name)
+
+def iter_archive(file: UploadFile) -> Iterator[UploadFile]:
+    """
+    Файлы zip или tar (в том числе сжатого) по одному, в порядке архива.
+    Если архив повреждён, после прочитанных файлов идёт DamagedUpload с его именем.
+    """
+    try:
+        if zipfile.is_zipfile(file.file):
+            file.file.seek(0)
+            with zipfile.ZipFile(file.file) as archive:
+                for info in archive.infolist():
+                    if not info.is_dir():
+                        yield _member(info.filename, info.file_size, lambda: archive.read(info))
+            return
+
+        file.file.seek(0)
+        with tarfile.open(fileobj=file.file, mode='r:*') as archive:
+            for info in archive:
+                if info.isfile():
+                    yield _member(info.name, info.size, lambda: archive.extractfile(info).read())
+    except ARCHIVE_ERRORS:
+        yield DamagedUpload(file.filename, 'Invalid archive')
+
+def expand_uploads(files: list[UploadFile]) -> Iterator[UploadFile]:
+    for file in files:
+        if is_archive(file):
+            yield from iter_archive(file)
+        else:
+            yield file
@@ -0,0 +1,168 @@
+import logging
+import queue
+import threading
+import time
+from collections import Counter
+from collections.abc import Callable, Sequence
+from concurrent.futures import Future
+from typing import NamedTuple
+
+logger = logging.getLogger(__name__)
+
+class BatchStats(NamedTuple):
+    batches: int
+    items: int
+    mean_batch_size: float
+    batch_sizes: dict[int, int]
+    mean_queue_wait: float
+    max_queue_wait: float
+    queue_depth: int
+    rejected: int
+
+class QueueFull(Exception):
+    """Очередь планировщика заполнена, запрос не принят."""
+    def __init__(self, retry_after: float):
+        super().__init__(f'queue is full, retry after {retry_after:.1f} s')
+        self.retry_after = retry_after
+
+class _Item[T, R](NamedTuple):
+    value: T
+    future: Future[R]
+    enqueued: float
+
+class BatchScheduler[T, R]:
+    """
+    Собирает конкурентные запросы в пачки не больше max_batch_size,
+    ожидая добора пачки не дольше max_wait_ms, и прогоняет каждую пачку
+    одним вызовом run_batch в отдельном потоке.
+    Если задан max_queue_depth, запросы сверх этого числа ожидающих
+    и выполняющихся отклоняются исключением QueueFull.
+    """
+    def __init__(
+        self,
+        run_batch: Callable[[list[T]], Sequence[R]],
+        max_batch_size: int = 8,
+        max_wait_ms: float = 5.0,
+        max_queue_depth: int | None = None,
+    ):
+        if max_batch_size < 1:
+            raise ValueError('max_batch_size must be positive')
+        self.run_batch = run_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.max_queue_depth = max_queue_depth
+
+        self._queue: queue.SimpleQueue[_Item[T, R] | None] = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        self._batch_sizes: Counter[int] = Counter()
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+        self._depth = 0
+        self._rejected = 0
+        self._last_run_time = 0.0
+
+        self._thread = threading.Thread(target=self._worker, name='batch-scheduler', daemon=True)
+        self._thread.start()
+
+    @property
+    def depth(self) -> int:
+        return self._depth
+
+    def full(self) -> bool:
+        return self.max_queue_depth is not None and self._depth >= self.max_queue_depth
+
+    def retry_after(self) -> float:
+        """
+        Оценка времени, за которое очередь разберётся: число пачек
+        в ней на время последней пачки.
+        """
+        batches = -(-self._depth // self.max_batch_size)
+        return batches * self._last_run_time
+
+    def submit(self, value: T, admit: bool = True) -> Future[R]:
+        """
+        Ставит значение в очередь. С admit=False лимит глубины очереди
+        не проверяется: так досылаются части уже принятого запроса.
+        """
+        with self._lock:
+            if admit and self.full():
+                self._rejected += 1
+                raise QueueFull(self.retry_after())
+            self._depth += 1
+        future: Future[R] = Future()
+        self._queue.put(_Item(value, future, time.perf_counter()))
+        return future
+
+    def close(self) -> None:
+        self._queue.put(None)
+        self._thread.join()
+
+    def stats(self) -> BatchStats:
+        with self._lock:
+            batches = self._batch_sizes.total()
+            items = sum(size * count for size, count in self._batch_sizes.items())
+            return BatchStats(
+                batches=batches,
+                items=items,
+                mean_batch_size=items / batches if batches else 0.0,
+                batch_sizes=dict(sorted(self._batch_sizes.items())),
+                mean_queue_wait=self._total_wait / items if items else 0.0,
+                max_queue_wait=self._max_wait,
+                queue_depth=self._depth,
+                rejected=self._rejected,
+            )
+
+    def _collect(self, first: _Item[T, R]) -> tuple[list[_Item[T, R]], bool]:
+        batch = [first]
+        deadline = first.enqueued + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            try:
+                item = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _worker(self) -> None:
+        closed = False
+        while not closed:
+            first = self._queue.get()
+            if first is None:
+                break
+            batch, closed = self._collect(first)
+            cancelled = len(batch)
+            batch = [item for item in batch if item.future.set_running_or_notify_cancel()]
+            cancelled -= len(batch)
+            if cancelled:
+                with self._lock:
+                    self._depth -= cancelled
+            if not batch:
+                continue
+
+            start = time.perf_counter()
+            waits = [start - item.enqueued for item in batch]
+            try:
+                results = self.run_batch([item.value for item in batch])
+            except Exception as e:
+                for item in batch:
+                    item.future.set_exception(e)
+            else:
+                for item, result in zip(batch, results):
+                    item.future.set_result(result)
+
+            self._record(len(batch), waits, time.perf_counter() - start)
+
+    def _record(self, size: int, waits: list[float], run_time: float) -> None:
+        with self._lock:
+            self._depth -= size
+            self._last_run_time = run_time
+            self._batch_sizes[size] += 1
+            self._total_wait += sum(waits)
+            self._max_wait = max(self._max_wait, *waits)
+        logger.debug(
+            'batch size=%d max_queue_wait=%.1fms run_time=%.1fms',
+            size, max(waits) * 1000, run_time * 1000,
+        )
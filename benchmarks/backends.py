@@ -0,0 +1,52 @@
+import copy
+
+import numpy as np
+import torch
+
+from common import measure, print_table
+from model_.arch_model import forward_with_features, load_trained_model
+from model_.backends import attach_backend, check_parity
+from model_.image_transfroms import val_transform
+from schemas import InferenceBackend
+
+MODEL_PATH = 'model_/best_model.pth'
+BATCH_SIZES = [1, 8]
+NUM_IMAGES = 16
+
+def make_images(count: int) -> list[np.ndarray]:
+    # фиксированный набор снимков, одинаковый для всех бэкендов
+    rng = np.random.default_rng(0)
+    y, x = np.mgrid[:512, :512]
+    return [
+        np.clip((x + y) / 4 + rng.normal(0, 20, size=x.shape), 0, 255).astype(np.uint8)
+        for _ in range(count)
+    ]
+
+def main() -> None:
+    model = load_trained_model(MODEL_PATH, torch.device('cpu'))
+    model.requires_grad_(False)
+    imgs = make_images(NUM_IMAGES)
+    tensor = torch.stack([val_transform(img) for img in imgs])
+
+    rows = []
+    for backend in InferenceBackend:
+        try:
+            runner = attach_backend(copy.deepcopy(model), backend)
+        except ImportError as e:
+            print(f'{backend}: skipped ({e.name} is not installed)')
+            continue
+
+        parity = check_parity(runner, imgs) if backend != InferenceBackend.EAGER else None
+        for batch_size in BATCH_SIZES:
+            batch = tensor[:batch_size]
+            with torch.inference_mode():
+                seconds = measure(lambda: forward_with_features(runner, batch))
+            rows.append([
+                backend, batch_size, f'{seconds * 1000:.1f}', f'{batch_size / seconds:.1f}',
+                f'{parity.max_logit_diff:.2e}' if parity else '-',
+                f'{parity.agreement:.0%}' if parity else '-',
+            ])
+    print_table(['backend', 'batch', 'latency, ms', 'images/s', 'max logit diff', 'agreement'], rows)
+
+if __name__ == '__main__':
+    main()
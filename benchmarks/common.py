@@ -0,0 +1,169 @@
+import json
+import multiprocessing
+import os
+import platform
+import signal
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+import uuid
+from collections.abc import Callable
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+
+def measure(fn: Callable[[], object], repeat: int = 5, warmup: int = 1) -> float:
+    """
+    Медианное время вызова fn в секундах.
+    """
+    for _ in range(warmup):
+        fn()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+def reset_peak_rss() -> None:
+    # сбрасывает VmHWM до текущего RSS (Linux); ru_maxrss для этого не годится,
+    # потому что наследуется от родительского процесса через exec
+    with open('/proc/self/clear_refs', 'w') as f:
+        f.write('5')
+
+def peak_rss_mb() -> float:
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1]) / 1024
+    raise RuntimeError('VmHWM is not available')
+
+def run_isolated[**P, R](fn: Callable[P, R], *args: P.args, **kwargs: P.kwargs) -> R:
+    """
+    Выполняет fn в отдельном свежем процессе, чтобы пиковое потребление
+    памяти одного замера не влияло на другие.
+    """
+    # фиксированный порог mmap: крупные буферы не переиспользуют освобождённую
+    # кучу, и прирост пикового RSS отражает реальный пик замера
+    os.environ.setdefault('MALLOC_MMAP_THRESHOLD_', str(128 * 1024))
+    with multiprocessing.get_context('spawn').Pool(1) as pool:
+        return pool.apply(fn, args, kwargs)
+
+def print_table(header: list[str], rows: list[list[object]]) -> None:
+    cells = [header] + [[str(cell) for cell in row] for row in rows]
+    widths = [max(len(row[i]) for row in cells) for i in range(len(header))]
+    for row in cells:
+        print('  '.join(cell.rjust(width) for cell, width in zip(row, widths)))
+
+def file_request(url: str, field: str, filename: str, content: bytes) -> urllib.request.Request:
+    # запрос с файлом в multipart/form-data
+    boundary = uuid.uuid4().hex
+    body = b''.join([
+        f'--{boundary}\r\n'.encode(),
+        f'Content-Disposition: form-data; name="{field}"; filename="{filename}"\r\n\r\n'.encode(),
+        content,
+        f'\r\n--{boundary}--\r\n'.encode(),
+    ])
+    return urllib.request.Request(url, body, {'Content-Type': f'multipart/form-data; boundary={boundary}'})
+
+def post_file(url: str, field: str, filename: str, content: bytes, timeout: float = 120) -> tuple[int, bytes]:
+    """
+    Отправляет файл как multipart/form-data и возвращает код ответа и тело.
+    """
+    request = file_request(url, field, filename, content)
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return response.status, response.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.read()
+
+def start_server(env: dict[str, str], url: str = 'http://127.0.0.1:8000', timeout: float = 300) -> subprocess.Popen:
+    """
+    Запускает main.py с дополнительными переменными окружения и ждёт,
+    пока /readyz подряд ответит готовностью всех воркеров.
+    """
+    process = subprocess.Popen(
+        [sys.executable, 'main.py'], cwd=ROOT, env={**os.environ, **env},
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    # запросы распределяются между воркерами, поэтому одного ответа мало
+    needed = 4 * int(env.get('WORKERS', '1'))
+    ready = 0
+    deadline = time.monotonic() + timeout
+    while ready < needed:
+        if process.poll() is not None or time.monotonic() > deadline:
+            stop_server(process)
+            raise RuntimeError('server failed to start')
+        try:
+            with urllib.request.urlopen(f'{url}/readyz', timeout=5):
+                ready += 1
+        except (urllib.error.URLError, ConnectionError):
+            ready = 0
+            time.sleep(0.5)
+    return process
+
+def stop_server(process: subprocess.Popen) -> None:
+    if process.poll() is None:
+        process.send_signal(signal.SIGINT)
+        try:
+            process.wait(30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+def process_tree_pss_mb(pid: int) -> float:
+    """
+    Суммарный PSS процесса и его потомков (Linux): разделяемые страницы,
+    например отображённые в память веса, делятся между процессами поровну.
+    """
+    total = 0
+    pending = [pid]
+    while pending:
+        current = pending.pop()
+        with open(f'/proc/{current}/smaps_rollup') as f:
+            total += next(int(line.split()[1]) for line in f if line.startswith('Pss:'))
+        for task in os.listdir(f'/proc/{current}/task'):
+            with open(f'/proc/{current}/task/{task}/children') as f:
+                pending.extend(int(child) for child in f.read().split())
+    return total / 1024
+
+def percentile(values: list[float], q: float) -> float:
+    """
+    Перцентиль q (0-100) с линейной интерполяцией.
+    """
+    ordered = sorted(values)
+    if not ordered:
+        return float('nan')
+    position = (len(ordered) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+def result(name: str, value: float, unit: str, better: str = 'lower') -> dict:
+    """
+    Одно измерение для JSON-отчёта; better - направление улучшения,
+    по нему compare.py отличает регрессию от ускорения.
+    """
+    return {'name': name, 'value': value, 'unit': unit, 'better': better}
+
+def save_results(path: str, benchmark: str, results: list[dict], **params: object) -> None:
+    import torch
+
+    report = {
+        'benchmark': benchmark,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'environment': {
+            'python': platform.python_version(),
+            'torch': torch.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'num_threads': torch.get_num_threads(),
+        },
+        'params': params,
+        'results': results,
+    }
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
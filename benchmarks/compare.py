@@ -0,0 +1,55 @@
+"""
+Сравнивает два JSON-отчёта бенчмарков и отмечает регрессии:
+
+    python benchmarks/compare.py baseline.json results.json --threshold 0.1
+
+Код возврата 1, если хотя бы одно измерение ухудшилось больше чем на threshold.
+"""
+import argparse
+import json
+import sys
+
+from common import print_table
+
+def compare(baseline: dict, current: dict, threshold: float) -> tuple[list[list[object]], bool]:
+    before = {r['name']: r for r in baseline['results']}
+    rows = []
+    regressed = False
+    for r in current['results']:
+        old = before.get(r['name'])
+        if old is None or not old['value']:
+            rows.append([r['name'], '-', f'{r["value"]:.4g}', '-', 'new'])
+            continue
+        change = r['value'] / old['value'] - 1
+        # для величин, где лучше больше, ухудшение - это падение
+        worse = change if r['better'] == 'lower' else -change
+        if worse > threshold:
+            status = 'REGRESSION'
+            regressed = True
+        elif worse < -threshold:
+            status = 'improved'
+        else:
+            status = ''
+        rows.append([r['name'], f'{old["value"]:.4g}', f'{r["value"]:.4g}', f'{change:+.1%}', status])
+    return rows, regressed
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('baseline')
+    parser.add_argument('current')
+    parser.add_argument('--threshold', type=float, default=0.1, help='allowed relative slowdown')
+    args = parser.parse_args()
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    if baseline['environment'] != current['environment']:
+        print('warning: results come from different environments', file=sys.stderr)
+
+    rows, regressed = compare(baseline, current, args.threshold)
+    print_table(['benchmark', 'baseline', 'current', 'change', ''], rows)
+    sys.exit(1 if regressed else 0)
+
+if __name__ == '__main__':
+    main()
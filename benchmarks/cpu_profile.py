@@ -0,0 +1,74 @@
+"""
+Выигрыш от каждой оптимизации eager-модели для CPU (CPU_OPTIMIZATIONS)
+по отдельности и вместе: время прогрева (в нём компиляция), задержка
+forward-прохода без карты и анализа с Grad-CAM, расхождение вероятностей
+с моделью без оптимизаций:
+
+    python benchmarks/cpu_profile.py --output cpu_profile.json
+
+torch.compile компилирует DenseNet несколько минут; --skip-compile его пропускает.
+"""
+import argparse
+import copy
+import time
+
+import torch
+
+from common import measure, print_table, result, save_results
+from hotpaths import make_image, make_model
+from model_.arch_model import forward_with_features, run_model_batch
+from model_.backends import attach_backend, bf16_supported
+from model_.image_transfroms import val_transform
+from schemas import CamMethod, CpuOptimization, InferenceBackend
+
+BATCH_SIZES = [1, 8]
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--output', help='save results as JSON')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--skip-compile', action='store_true')
+    args = parser.parse_args()
+
+    profiles = [[], [CpuOptimization.CHANNELS_LAST], [CpuOptimization.BF16], [CpuOptimization.COMPILE], list(CpuOptimization)]
+    if not bf16_supported():
+        print('bf16: CPU does not support bfloat16, the model runs in float32')
+    if args.skip_compile:
+        profiles = [profile for profile in profiles if CpuOptimization.COMPILE not in profile]
+
+    base_model = make_model()
+    img = make_image(1024, 1024)
+    tensor = torch.stack([val_transform(img)] * max(BATCH_SIZES))
+    with torch.inference_mode():
+        expected = base_model(tensor).softmax(1)
+
+    results = []
+    rows = []
+    for profile in profiles:
+        name = ','.join(profile) or 'none'
+        model = attach_backend(copy.deepcopy(base_model), InferenceBackend.EAGER, optimizations=profile)
+        start = time.perf_counter()
+        for batch_size in BATCH_SIZES:
+            run_model_batch([img] * batch_size, model, [CamMethod.GRADCAM] * batch_size, 1024)
+        warmup = time.perf_counter() - start
+        results.append(result(f'warmup/{name}', warmup, 's'))
+        with torch.inference_mode():
+            probs_diff = (forward_with_features(model, tensor)[0].softmax(1) - expected).abs().max().item()
+
+        for batch_size in BATCH_SIZES:
+            batch = tensor[:batch_size]
+            with torch.inference_mode():
+                forward = measure(lambda: forward_with_features(model, batch), repeat=args.repeat)
+            gradcam = measure(lambda: run_model_batch([img] * batch_size, model, [CamMethod.GRADCAM] * batch_size, 1024),
+                              repeat=args.repeat)
+            results.append(result(f'forward/{name}/batch={batch_size}', forward, 's'))
+            results.append(result(f'gradcam/{name}/batch={batch_size}', gradcam, 's'))
+            rows.append([name, batch_size, f'{warmup:.1f}', f'{forward * 1000:.0f}', f'{gradcam * 1000:.0f}',
+                         f'{probs_diff:.1e}'])
+
+    print_table(['optimizations', 'batch', 'warmup, s', 'forward, ms', 'gradcam, ms', 'max probs diff'], rows)
+    if args.output:
+        save_results(args.output, 'cpu_profile', results, repeat=args.repeat)
+
+if __name__ == '__main__':
+    main()
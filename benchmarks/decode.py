@@ -0,0 +1,55 @@
+import time
+from io import BytesIO
+
+import numpy as np
+from fastapi import UploadFile
+from PIL import Image
+
+from common import peak_rss_mb, print_table, reset_peak_rss, run_isolated
+from image import process_image, prepare_image, image_size
+from model_.image_transfroms import val_transform
+
+SIZES = [(1024, 1024), (2500, 3000), (4000, 4000)]
+FORMATS = ['JPEG', 'PNG']
+MAX_SIZES = [0, 1024]
+
+def make_upload(width: int, height: int, format: str) -> bytes:
+    y, x = np.mgrid[:height, :width]
+    pixels = ((x + y) % 256).astype(np.uint8)
+    buf = BytesIO()
+    Image.fromarray(pixels).save(buf, format)
+    return buf.getvalue()
+
+def decode(content: bytes, max_size: int) -> None:
+    upload = UploadFile(BytesIO(content), size=len(content))
+    im = process_image(upload)
+    image_size(im)
+    val_transform(prepare_image(im, max_size))
+
+def run(content: bytes, warmup: bytes, max_size: int) -> tuple[float, float]:
+    decode(warmup, max_size)
+
+    reset_peak_rss()
+    baseline = peak_rss_mb()
+    start = time.perf_counter()
+    decode(content, max_size)
+    seconds = time.perf_counter() - start
+    return seconds, peak_rss_mb() - baseline
+
+def main() -> None:
+    rows = []
+    for width, height in SIZES:
+        for format in FORMATS:
+            # загрузка готовится заранее, чтобы не влиять на пик памяти замера
+            content = make_upload(width, height, format)
+            warmup = make_upload(64, 64, format)
+            for max_size in MAX_SIZES:
+                seconds, peak = run_isolated(run, content, warmup, max_size)
+                rows.append([
+                    f'{width}x{height}', format, max_size or 'none',
+                    f'{seconds * 1000:.0f}', f'{peak:.0f}',
+                ])
+    print_table(['size', 'format', 'max size', 'time, ms', 'peak rss, MiB'], rows)
+
+if __name__ == '__main__':
+    main()
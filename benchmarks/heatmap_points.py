@@ -0,0 +1,50 @@
+"""
+Время построения и размер heatmap_points во всех форматах и, для сравнения,
+heatmap_regions на той же карте:
+
+    python benchmarks/heatmap_points.py
+"""
+import numpy as np
+from pydantic import TypeAdapter
+
+from common import measure, print_table
+from heatmap import apply_threshold, dense_to_sparse, encode_heatmap, extract_regions, make_example_heatmap
+from schemas import HeatmapArray, HeatmapPoint, HeatmapRegion, PointsFormat
+
+SIZES = [(512, 512), (1024, 1024), (2500, 3000)]
+
+adapter = TypeAdapter(list[HeatmapPoint] | HeatmapArray)
+regions_adapter = TypeAdapter(list[HeatmapRegion])
+
+def build(heatmap, format: PointsFormat) -> bytes:
+    if format == PointsFormat.LIST:
+        points = dense_to_sparse(heatmap)
+    else:
+        points = encode_heatmap(heatmap, format)
+    return adapter.dump_json(adapter.validate_python(points))
+
+def build_regions(heatmap) -> bytes:
+    return regions_adapter.dump_json(extract_regions(heatmap))
+
+def example_heatmap(width: int, height: int):
+    # два очага разной силы, как у двусторонней пневмонии
+    left = make_example_heatmap(width, height, width * 0.3, height * 0.5, width / 10)
+    right = 0.7 * make_example_heatmap(width, height, width * 0.7, height * 0.6, width / 12)
+    return apply_threshold(np.maximum(left, right))
+
+def main() -> None:
+    rows = []
+    for width, height in SIZES:
+        heatmap = example_heatmap(width, height)
+        for format in PointsFormat:
+            repeat = 1 if format == PointsFormat.LIST else 5
+            seconds = measure(lambda: build(heatmap, format), repeat=repeat, warmup=0)
+            size = len(build(heatmap, format))
+            rows.append([f'{width}x{height}', format, f'{seconds * 1000:.1f}', f'{size / 1024:.1f}'])
+        seconds = measure(lambda: build_regions(heatmap), repeat=5, warmup=0)
+        size = len(build_regions(heatmap))
+        rows.append([f'{width}x{height}', 'regions', f'{seconds * 1000:.1f}', f'{size / 1024:.1f}'])
+    print_table(['size', 'format', 'time, ms', 'json, KiB'], rows)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,43 @@
+import time
+
+import numpy as np
+import torch
+
+from common import peak_rss_mb, print_table, reset_peak_rss, run_isolated
+from heatmap import apply_threshold, encode_heatmap, render_heatmap
+from image import GrayscaleImage, downscale_image, encode_image, fit_shape
+from model_.cam_and_viz import resize_cam
+from schemas import PointsFormat
+
+SIZES = [(1024, 1024), (2500, 3000), (4000, 4000)]
+MAX_SIZES = [0, 2048, 1024, 512]
+
+def heatmap_pipeline(img: GrayscaleImage[int, int], cam: torch.Tensor, max_size: int) -> None:
+    cam_np = resize_cam(cam, target_size=fit_shape(img.shape, max_size)).numpy()
+    heatmap = apply_threshold(cam_np)
+    encode_image(render_heatmap(downscale_image(img, max_size), heatmap))
+    encode_heatmap(heatmap, PointsFormat.RLE, dimensions=img.shape[::-1])
+
+def run(width: int, height: int, max_size: int) -> tuple[float, float]:
+    rng = np.random.default_rng(0)
+    img = rng.integers(0, 256, size=(height, width), dtype=np.uint8)
+    cam = torch.rand(7, 7)
+    heatmap_pipeline(img[:64, :64], cam, max_size)
+
+    reset_peak_rss()
+    baseline = peak_rss_mb()
+    start = time.perf_counter()
+    heatmap_pipeline(img, cam, max_size)
+    seconds = time.perf_counter() - start
+    return seconds, peak_rss_mb() - baseline
+
+def main() -> None:
+    rows = []
+    for width, height in SIZES:
+        for max_size in MAX_SIZES:
+            seconds, peak = run_isolated(run, width, height, max_size)
+            rows.append([f'{width}x{height}', max_size or 'none', f'{seconds * 1000:.0f}', f'{peak:.0f}'])
+    print_table(['size', 'max size', 'time, ms', 'peak rss, MiB'], rows)
+
+if __name__ == '__main__':
+    main()
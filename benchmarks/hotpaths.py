@@ -0,0 +1,93 @@
+"""
+Микробенчмарки горячих функций анализа по матрице размеров и форматов:
+
+    python benchmarks/hotpaths.py --output results.json
+    python benchmarks/compare.py baseline.json results.json
+"""
+import argparse
+from io import BytesIO
+
+import numpy as np
+import torch
+import torch.nn as nn
+import torchxrayvision as xrv
+from fastapi import UploadFile
+from PIL import Image
+
+from common import measure, print_table, result, save_results
+from heatmap import apply_threshold, dense_to_sparse, render_heatmap
+from image import prepare_image, process_image, save_image
+from model_.arch_model import CLASS_NAMES, run_model_with_features
+from schemas import CamMethod, ImageFormat
+from settings import HEATMAP_MAX_SIZE, HEATMAP_PNG_COMPRESS_LEVEL, HEATMAP_QUALITY
+
+SIZES = [(512, 512), (1024, 1024), (2500, 3000)]
+FORMATS = ['JPEG', 'PNG', 'WEBP']
+
+def make_model():
+    # время работы не зависит от весов, поэтому достаточно случайных
+    torch.manual_seed(0)
+    model = xrv.models.DenseNet(weights=None)
+    model.classifier = nn.Linear(model.classifier.in_features, len(CLASS_NAMES))
+    model.requires_grad_(False)
+    return model.eval()
+
+def make_image(width: int, height: int) -> np.ndarray:
+    # гладкий снимок с шумом: сжимается примерно как настоящий
+    y, x = np.mgrid[:height, :width]
+    rng = np.random.default_rng(0)
+    pixels = 128 + 60 * np.sin(x / 97) * np.cos(y / 131) + rng.normal(0, 8, size=(height, width))
+    return np.clip(pixels, 0, 255).astype(np.uint8)
+
+def encode(pixels: np.ndarray, format: str) -> bytes:
+    buf = BytesIO()
+    Image.fromarray(pixels).save(buf, format)
+    return buf.getvalue()
+
+def decode(content: bytes, max_size: int):
+    im = process_image(UploadFile(BytesIO(content), size=len(content)))
+    return prepare_image(im, max_size)
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--output', help='save results as JSON')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    model = make_model()
+    results = []
+
+    def bench(name: str, fn, repeat: int = args.repeat):
+        seconds = measure(fn, repeat=repeat)
+        results.append(result(name, seconds, 's'))
+
+    for width, height in SIZES:
+        size = f'{width}x{height}'
+        pixels = make_image(width, height)
+        for format in FORMATS:
+            content = encode(pixels, format)
+            bench(f'process_image/{format}/{size}', lambda: decode(content, HEATMAP_MAX_SIZE))
+
+        img = decode(encode(pixels, 'PNG'), HEATMAP_MAX_SIZE)
+        for method in [CamMethod.CAM, CamMethod.GRADCAM]:
+            bench(f'run_model_with_features/{method}/{size}',
+                  lambda: run_model_with_features(img, model, method, HEATMAP_MAX_SIZE))
+
+        _, _, cam = run_model_with_features(img, model, CamMethod.GRADCAM, HEATMAP_MAX_SIZE)
+        if cam is None:
+            # случайные веса могут дать норму, для которой карта не строится
+            cam = make_image(img.shape[1], img.shape[0]).astype(np.float32) / 255
+        heatmap = apply_threshold(cam)
+        overlay = render_heatmap(img, heatmap)
+        bench(f'render_heatmap/{size}', lambda: render_heatmap(img, heatmap))
+        bench(f'dense_to_sparse/{size}', lambda: dense_to_sparse(heatmap), repeat=min(args.repeat, 3))
+        for image_format in ImageFormat:
+            bench(f'save_image/{image_format}/{size}',
+                  lambda: save_image(overlay, image_format, HEATMAP_QUALITY, HEATMAP_PNG_COMPRESS_LEVEL))
+
+    print_table(['benchmark', 'time, ms'], [[r['name'], f'{r["value"] * 1000:.1f}'] for r in results])
+    if args.output:
+        save_results(args.output, 'hotpaths', results, repeat=args.repeat, max_size=HEATMAP_MAX_SIZE)
+
+if __name__ == '__main__':
+    main()
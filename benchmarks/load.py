@@ -0,0 +1,164 @@
+"""
+Нагрузочный тест работающего сервиса:
+
+    python benchmarks/load.py --concurrency 8 --duration 30
+    python benchmarks/load.py --rate 5 --duration 30 --output load.json
+
+С --concurrency клиенты шлют запросы друг за другом (замкнутая модель),
+с --rate запросы отправляются с заданной частотой независимо от ответов
+(открытая модель), и задержка считается от запланированного момента отправки,
+чтобы очередь на стороне клиента не скрывала перегрузку сервера.
+
+С --stream запросы идут с stream=true, и отдельно считается время до первого
+события (диагноза).
+
+Каждый запрос получает уникальный хвост после конца файла, поэтому кэш
+результатов не срабатывает; --same-image меряет как раз попадания в кэш.
+"""
+import argparse
+import itertools
+import os
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from common import file_request, percentile, post_file, print_table, result, save_results
+
+DEFAULT_IMAGE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'xray.jpg')
+
+class Recorder:
+    def __init__(self):
+        self.latencies: list[float] = []
+        self.first_results: list[float] = []
+        self.statuses: Counter[int] = Counter()
+        self._lock = threading.Lock()
+
+    def record(self, status: int, latency: float, first_result: float | None = None):
+        with self._lock:
+            self.statuses[status] += 1
+            if status == 200:
+                self.latencies.append(latency)
+                if first_result is not None:
+                    self.first_results.append(first_result)
+
+class Bodies:
+    """
+    Содержимое файла для очередного запроса. Декодеры игнорируют данные
+    после конца изображения, а хэш у каждого запроса свой.
+    """
+    def __init__(self, content: bytes, unique: bool):
+        self.content = content
+        self.unique = unique
+        # разные запуски не должны попадать в кэш друг друга
+        self._prefix = os.urandom(8).hex()
+        self._counter = itertools.count()
+
+    def next(self) -> bytes:
+        if not self.unique:
+            return self.content
+        return self.content + f'{self._prefix}-{next(self._counter)}'.encode()
+
+def request(url: str, content: bytes, recorder: Recorder, scheduled: float):
+    try:
+        status, _ = post_file(url, 'image', 'xray.jpg', content)
+    except OSError:
+        status = 0
+    recorder.record(status, time.perf_counter() - scheduled)
+
+def stream_request(url: str, content: bytes, recorder: Recorder, scheduled: float):
+    # первая строка потока - событие с диагнозом
+    first_result = None
+    try:
+        with urllib.request.urlopen(file_request(url, 'image', 'xray.jpg', content), timeout=120) as response:
+            response.readline()
+            first_result = time.perf_counter() - scheduled
+            response.read()
+            status = response.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    except OSError:
+        status = 0
+    recorder.record(status, time.perf_counter() - scheduled, first_result)
+
+def closed_loop(url: str, bodies: Bodies, concurrency: int, duration: float, send=request) -> Recorder:
+    recorder = Recorder()
+    deadline = time.perf_counter() + duration
+
+    def client():
+        while time.perf_counter() < deadline:
+            send(url, bodies.next(), recorder, time.perf_counter())
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return recorder
+
+def open_loop(url: str, bodies: Bodies, rate: float, duration: float, max_in_flight: int,
+              send=request) -> Recorder:
+    recorder = Recorder()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_in_flight) as executor:
+        for i in range(int(rate * duration)):
+            scheduled = start + i / rate
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            executor.submit(send, url, bodies.next(), recorder, scheduled)
+    return recorder
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    mode = parser.add_mutually_exclusive_group(required=True)
+    mode.add_argument('--concurrency', type=int, help='number of clients sending requests back to back')
+    mode.add_argument('--rate', type=float, help='requests per second, regardless of responses')
+    parser.add_argument('--duration', type=float, default=30.0)
+    parser.add_argument('--warmup', type=float, default=5.0, help='seconds of load before measuring')
+    parser.add_argument('--url', default='http://127.0.0.1:8000/api/analyze')
+    parser.add_argument('--image', default=DEFAULT_IMAGE)
+    parser.add_argument('--same-image', action='store_true', help='send identical files to hit the result cache')
+    parser.add_argument('--stream', action='store_true', help='request NDJSON events and measure time to the diagnosis')
+    parser.add_argument('--max-in-flight', type=int, default=256, help='client threads for --rate')
+    parser.add_argument('--output', help='save results as JSON')
+    args = parser.parse_args()
+
+    with open(args.image, 'rb') as f:
+        bodies = Bodies(f.read(), unique=not args.same_image)
+    url, send = args.url, request
+    if args.stream:
+        url, send = url + ('&' if '?' in url else '?') + 'stream=true', stream_request
+
+    def run(duration: float) -> tuple[Recorder, float]:
+        start = time.perf_counter()
+        if args.concurrency:
+            recorder = closed_loop(url, bodies, args.concurrency, duration, send)
+        else:
+            recorder = open_loop(url, bodies, args.rate, duration, args.max_in_flight, send)
+        return recorder, time.perf_counter() - start
+
+    if args.warmup:
+        run(args.warmup)
+    recorder, elapsed = run(args.duration)
+
+    mode_name = f'concurrency={args.concurrency}' if args.concurrency else f'rate={args.rate:g}'
+    latencies = recorder.latencies
+    results = [
+        result(f'{mode_name}/throughput', len(latencies) / elapsed, 'req/s', better='higher'),
+        *(result(f'{mode_name}/p{q}', percentile(latencies, q), 's') for q in [50, 95, 99]),
+        *(result(f'{mode_name}/first_result_p{q}', percentile(recorder.first_results, q), 's')
+          for q in [50, 95, 99] if recorder.first_results),
+        result(f'{mode_name}/errors', sum(recorder.statuses.values()) - len(latencies), 'requests'),
+    ]
+
+    print_table(['metric', 'value'], [[r['name'], f'{r["value"]:.3f} {r["unit"]}'] for r in results])
+    print('status codes:', dict(sorted(recorder.statuses.items())))
+    if args.output:
+        save_results(args.output, 'load', results, url=url, duration=args.duration,
+                     concurrency=args.concurrency, rate=args.rate, same_image=args.same_image)
+
+if __name__ == '__main__':
+    main()
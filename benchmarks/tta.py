@@ -0,0 +1,54 @@
+"""
+Задержка анализа в зависимости от числа видов test-time augmentation
+и числа моделей ансамбля:
+
+    python benchmarks/tta.py --output tta.json
+"""
+import argparse
+
+from common import measure, print_table, result, save_results
+from hotpaths import make_image, make_model
+from model_.arch_model import run_model_batch
+from model_.tta import VIEWS
+from schemas import CamMethod
+
+VIEW_COUNTS = [1, 2, 4, len(VIEWS)]
+ENSEMBLE_SIZES = [1, 2, 3]
+BATCH_SIZES = [1, 8]
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--output', help='save results as JSON')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    model = make_model()
+    img = make_image(1024, 1024)
+    results = []
+    rows = []
+
+    def bench(name: str, imgs, method: CamMethod, views: int):
+        seconds = measure(lambda: run_model_batch(imgs, model, [method] * len(imgs), 1024, views=views),
+                          repeat=args.repeat)
+        results.append(result(name, seconds, 's'))
+        return seconds
+
+    for batch_size in BATCH_SIZES:
+        for method in [CamMethod.CAM, CamMethod.GRADCAM]:
+            base = None
+            for views in VIEW_COUNTS:
+                seconds = bench(f'views/{method}/batch={batch_size}/views={views}', [img] * batch_size, method, views)
+                base = base or seconds
+                rows.append([batch_size, method, views, 1, f'{seconds * 1000:.0f}', f'{seconds / base:.2f}x'])
+
+    for members in ENSEMBLE_SIZES:
+        model.ensemble = [make_model() for _ in range(members - 1)]
+        seconds = bench(f'ensemble/{CamMethod.GRADCAM}/members={members}', [img], CamMethod.GRADCAM, 1)
+        rows.append([1, CamMethod.GRADCAM, 1, members, f'{seconds * 1000:.0f}', ''])
+
+    print_table(['batch', 'method', 'views', 'models', 'time, ms', 'vs 1 view'], rows)
+    if args.output:
+        save_results(args.output, 'tta', results, repeat=args.repeat)
+
+if __name__ == '__main__':
+    main()
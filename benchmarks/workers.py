@@ -0,0 +1,63 @@
+import os
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+from common import post_file, print_table, process_tree_pss_mb, start_server, stop_server
+
+URL = 'http://127.0.0.1:8000/api/analyze'
+CPU_COUNT = os.cpu_count() or 1
+WORKER_COUNTS = sorted({1, *(n for n in [2, 4, 8, 16] if n <= CPU_COUNT)})
+DURATION = 20.0
+
+def make_image() -> bytes:
+    y, x = np.mgrid[:1024, :1024]
+    buf = BytesIO()
+    Image.fromarray(((x + y) % 256).astype(np.uint8)).save(buf, 'JPEG')
+    return buf.getvalue()
+
+def load(content: bytes, concurrency: int, duration: float) -> tuple[int, float, list[float]]:
+    """
+    concurrency клиентов шлют запросы друг за другом в течение duration секунд.
+    """
+    deadline = time.perf_counter() + duration
+
+    def client(i: int) -> list[float]:
+        latencies = []
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            status, _ = post_file(URL, 'image', f'{i}.jpg', content)
+            if status == 200:
+                latencies.append(time.perf_counter() - start)
+        return latencies
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        latencies = [t for result in executor.map(client, range(concurrency)) for t in result]
+    return len(latencies), time.perf_counter() - start, latencies
+
+def main() -> None:
+    content = make_image()
+    rows = []
+    for workers in WORKER_COUNTS:
+        threads = max(1, CPU_COUNT // workers)
+        # без кэша результатов каждый запрос проходит через модель
+        server = start_server({'WORKERS': str(workers), 'CACHE_MAX_ENTRIES': '0'})
+        try:
+            load(content, workers, 5.0)
+            count, elapsed, latencies = load(content, 2 * workers, DURATION)
+            memory = process_tree_pss_mb(server.pid)
+        finally:
+            stop_server(server)
+        rows.append([
+            workers, threads, f'{count / elapsed:.1f}',
+            f'{statistics.median(latencies) * 1000:.0f}', f'{memory:.0f}',
+        ])
+    print_table(['workers', 'threads/worker', 'images/s', 'median latency, ms', 'total pss, MiB'], rows)
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,197 @@
-from functools import lru_cache
 import hashlib
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Callable
+from typing import BinaryIO, NamedTuple
 
-# кэш в памяти на 100 запросов
-@lru_cache(maxsize=100)
-def get_cached_result(image_hash: str):
-    return None
+from fastapi import UploadFile
 
-def generate_image_hash(image_file) -> str:
-    content = image_file.file.read()
-    image_file.file.seek(0)
-    return hashlib.md5(content).hexdigest()
+CHUNK_SIZE = 1024 * 1024
+
+class CacheStats(NamedTuple):
+    hits: int
+    disk_hits: int
+    misses: int
+    entries: int
+    nbytes: int
+
+class LRUCache[K, V]:
+    """
+    Кэш в памяти с вытеснением давно не использованных записей
+    по числу записей, суммарному размеру и времени жизни.
+    """
+    def __init__(
+        self,
+        max_entries: int,
+        max_bytes: int | None = None,
+        ttl: float | None = None,
+        sizeof: Callable[[V], int] = sys.getsizeof,
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.sizeof = sizeof
+        self.nbytes = 0
+
+        self._data: OrderedDict[K, tuple[V, int, float]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: K) -> V | None:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            value, _, expires = entry
+            if expires < time.monotonic():
+                self._remove(key)
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def put(self, key: K, value: V) -> None:
+        size = self.sizeof(value)
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+        expires = time.monotonic() + self.ttl if self.ttl is not None else float('inf')
+
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            self._data[key] = (value, size, expires)
+            self.nbytes += size
+
+            while len(self._data) > self.max_entries or (
+                self.max_bytes is not None and self.nbytes > self.max_bytes
+            ):
+                self._remove(next(iter(self._data)))
+
+    def pop(self, key: K) -> V | None:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            self._remove(key)
+            return entry[0]
+
+    def _remove(self, key: K) -> None:
+        _, size, _ = self._data.pop(key)
+        self.nbytes -= size
+
+class DiskCache:
+    """
+    Хранилище строк в SQLite, переживающее перезапуск сервиса.
+    """
+    def __init__(self, path: str, max_entries: int, ttl: float | None = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS results ('
+            'key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL NOT NULL, accessed REAL NOT NULL)'
+        )
+        self._db.execute('CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed)')
+        with self._lock:
+            self._db.execute('DELETE FROM results WHERE expires < ?', (time.time(),))
+
+    def get(self, key: str) -> str | None:
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                'SELECT value FROM results WHERE key = ? AND expires >= ?', (key, now)
+            ).fetchone()
+            if row is None:
+                return None
+            self._db.execute('UPDATE results SET accessed = ? WHERE key = ?', (now, key))
+        return row[0]
+
+    def put(self, key: str, value: str) -> None:
+        now = time.time()
+        expires = now + self.ttl if self.ttl is not None else float('inf')
+        with self._lock:
+            self._db.execute(
+                'INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)', (key, value, expires, now)
+            )
+            self._db.execute(
+                'DELETE FROM results WHERE key IN ('
+                'SELECT key FROM results ORDER BY accessed DESC LIMIT -1 OFFSET ?)',
+                (self.max_entries,),
+            )
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+class ResultCache:
+    """
+    Двухуровневый кэш сериализованных результатов анализа:
+    LRU в памяти и, если задан, SQLite на диске.
+    """
+    def __init__(self, memory: LRUCache[str, str], disk: DiskCache | None = None):
+        self.memory = memory
+        self.disk = disk
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        # get вызывается из нескольких потоков декодирования, а += не атомарен
+        self._counters_lock = threading.Lock()
+
+    def get(self, key: str) -> str | None:
+        value = self.memory.get(key)
+        if value is not None:
+            with self._counters_lock:
+                self.hits += 1
+            return value
+
+        if self.disk is not None:
+            value = self.disk.get(key)
+            if value is not None:
+                with self._counters_lock:
+                    self.disk_hits += 1
+                self.memory.put(key, value)
+                return value
+
+        with self._counters_lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: str, value: str) -> None:
+        self.memory.put(key, value)
+        if self.disk is not None:
+            self.disk.put(key, value)
+
+    def stats(self) -> CacheStats:
+        with self._counters_lock:
+            hits, disk_hits, misses = self.hits, self.disk_hits, self.misses
+        return CacheStats(
+            hits=hits,
+            disk_hits=disk_hits,
+            misses=misses,
+            entries=len(self.memory),
+            nbytes=self.memory.nbytes,
+        )
+
+def hash_file(file: BinaryIO) -> str:
+    # хэшируем поблочно, не копируя файл в память целиком,
+    # и возвращаем указатель туда, где он был
+    position = file.tell()
+    file.seek(0)
+    digest = hashlib.blake2b(digest_size=16)
+    while chunk := file.read(CHUNK_SIZE):
+        digest.update(chunk)
+    file.seek(position)
+    return digest.hexdigest()
+
+def generate_image_hash(image_file: UploadFile) -> str:
+    return hash_file(image_file.file)
+
+def make_cache_key(*parts: object) -> str:
+    return hashlib.blake2b('\0'.join(map(str, parts)).encode(), digest_size=16).hexdigest()
@@ -0,0 +1,68 @@
+import base64
+import hashlib
+import uuid
+
+from fastapi.responses import Response
+
+from cache import LRUCache
+from schemas import AnalysisResult, HeatmapImage, HeatmapResult
+
+HEATMAP_PART_ID = 'heatmap_image'
+
+class HeatmapStore:
+    """
+    Наложения, выданные по ссылке /api/heatmaps/{id}. Идентификатор -
+    хэш содержимого, так что повторный анализ снимка не копит копии.
+    """
+    def __init__(self, max_bytes: int, ttl: float | None = None):
+        # каждое изображение не меньше байта, так что число записей ограничено размером
+        self.images: LRUCache[str, tuple[bytes, str]] = LRUCache(
+            max_bytes, max_bytes, ttl, sizeof=lambda image: len(image[0]),
+        )
+
+    def put(self, data: bytes, mime: str) -> str:
+        image_id = hashlib.blake2b(data, digest_size=16).hexdigest()
+        self.images.put(image_id, (data, mime))
+        return image_id
+
+    def get(self, image_id: str) -> tuple[bytes, str] | None:
+        return self.images.get(image_id)
+
+def detach_image(image: HeatmapImage | None) -> bytes | None:
+    # убирает base64 из карты и возвращает само изображение
+    if image is None or image.base64 is None:
+        return None
+    data = base64.b64decode(image.base64)
+    image.base64 = None
+    return data
+
+def link_heatmap(image: HeatmapImage | None, store: HeatmapStore) -> None:
+    data = detach_image(image)
+    if data is not None:
+        image.url = f'/api/heatmaps/{store.put(data, image.mime)}'
+
+def link_image(result: AnalysisResult | HeatmapResult, store: HeatmapStore) -> AnalysisResult | HeatmapResult:
+    link_heatmap(result.heatmap_image, store)
+    return result
+
+def multipart_response(result: AnalysisResult | HeatmapResult) -> Response:
+    """
+    multipart/mixed: первая часть - результат в JSON, вторая, если карта
+    построена, - наложение с Content-ID, на который ссылается heatmap_image.url.
+    """
+    data = detach_image(result.heatmap_image)
+    if data is not None:
+        result.heatmap_image.url = f'cid:{HEATMAP_PART_ID}'
+
+    boundary = uuid.uuid4().hex
+    parts = [(b'Content-Type: application/json', result.model_dump_json().encode())]
+    if data is not None:
+        headers = f'Content-Type: {result.heatmap_image.mime}\r\nContent-ID: <{HEATMAP_PART_ID}>'
+        parts.append((headers.encode(), data))
+
+    body = b''.join(
+        b'--' + boundary.encode() + b'\r\n' + headers + b'\r\n\r\n' + content + b'\r\n'
+        for headers, content in parts
+    )
+    body += b'--' + boundary.encode() + b'--\r\n'
+    return Response(body, media_type=f'multipart/mixed; boundary={boundary}')
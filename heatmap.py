@@ -1,11 +1,12 @@
+import base64
 from typing import cast
 
 import cv2
 import numpy as np
 from PIL import Image
 
-from image import GrayscaleImage
-from schemas import HeatmapPoint
+from image import GrayscaleImage, fit_shape
+from schemas import HeatmapArray, HeatmapPoint, HeatmapRegion, PointsFormat
 
 type Heatmap[W: int, H: int] = np.ndarray[tuple[H, W], np.dtype[np.float32]]
 
@@ -24,6 +25,22 @@ def render_heatmap[W: int, H: int](
     output = cv2.cvtColor(output_bgr, cv2.COLOR_BGR2RGB)
     return Image.fromarray(output)
 
+def render_layer(
+    heatmap: Heatmap[int, int],
+    max_size: int,
+    alpha: float = 0.5,
+    colormap: int = cv2.COLORMAP_JET,
+) -> Image.Image:
+    """
+    Только раскрашенная карта в RGBA уменьшенного размера, без снимка.
+    Клиент растягивает её до размера снимка и накладывает сам, с той же
+    прозрачностью alpha, что и render_heatmap.
+    """
+    heatmap_u8 = quantize_heatmap(downsample_heatmap(heatmap, max_size))
+    heatmap_rgb = cv2.cvtColor(cv2.applyColorMap(heatmap_u8, colormap), cv2.COLOR_BGR2RGB)
+    opacity = np.full(heatmap_u8.shape + (1,), round(alpha * 255), dtype=np.uint8)
+    return Image.fromarray(np.concatenate([heatmap_rgb, opacity], axis=2), 'RGBA')
+
 def make_example_heatmap[W: int, H: int](
     width: W,
     height: H,
@@ -35,14 +52,108 @@ def make_example_heatmap[W: int, H: int](
     output = np.exp(-((x - center_x) ** 2 + (y - center_y) ** 2) / (2 * sigma ** 2))
     return cast(Heatmap[W, H], output.astype(np.float32))
 
-def dense_to_sparse(heatmap: Heatmap[int, int]) -> list[HeatmapPoint]:
+def dense_to_sparse(
+    heatmap: Heatmap[int, int],
+    dimensions: tuple[int, int] | None = None,
+) -> list[HeatmapPoint]:
+    # точки уменьшенной карты в пикселях снимка размера dimensions (ширина, высота):
+    # каждая точка - центр своей клетки карты
     rows, cols = np.nonzero(heatmap)
     intensities = heatmap[rows, cols]
+    if dimensions is not None:
+        height, width = heatmap.shape
+        cols = ((cols + 0.5) * (dimensions[0] / width)).astype(np.int64)
+        rows = ((rows + 0.5) * (dimensions[1] / height)).astype(np.int64)
     return [
-        HeatmapPoint(x.item(), y.item(), intensity.item())
-        for x, y, intensity in zip(cols, rows, intensities)
+        HeatmapPoint(x, y, intensity)
+        for x, y, intensity in zip(cols.tolist(), rows.tolist(), intensities.tolist())
     ]
 
+def extract_regions(
+    heatmap: Heatmap[int, int],
+    dimensions: tuple[int, int] | None = None,
+    epsilon: float = 0.01,
+) -> list[HeatmapRegion]:
+    """
+    Связные области ненулевой части карты (после apply_threshold), от самой
+    яркой. Считаются на разрешении карты и пересчитываются в координаты
+    снимка размера dimensions (ширина, высота). Контур упрощается с
+    допуском epsilon от его периметра.
+    """
+    height, width = heatmap.shape
+    scale_x, scale_y = (dimensions[0] / width, dimensions[1] / height) if dimensions else (1.0, 1.0)
+    count, labels, stats, centroids = cv2.connectedComponentsWithStats(
+        (heatmap > 0).astype(np.uint8), connectivity=8,
+    )
+    regions = []
+    for label in range(1, count):
+        x, y, w, h, area = stats[label].tolist()
+        # значения и маска только в рамке области, а не по всей карте
+        mask = labels[y:y + h, x:x + w] == label
+        values = heatmap[y:y + h, x:x + w][mask]
+        peak = round(float(values.max()), 4)
+        contours, _ = cv2.findContours(mask.astype(np.uint8), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        contour = max(contours, key=cv2.contourArea)
+        polygon = cv2.approxPolyDP(contour, epsilon * cv2.arcLength(contour, True), True)[:, 0] + (x, y)
+        center_x, center_y = centroids[label].tolist()
+        regions.append(HeatmapRegion(
+            bbox=(round(x * scale_x), round(y * scale_y), max(1, round(w * scale_x)), max(1, round(h * scale_y))),
+            polygon=[(round(px * scale_x), round(py * scale_y)) for px, py in polygon.tolist()],
+            area=round(area * scale_x * scale_y),
+            peak=peak,
+            # среднее не больше максимума и при ошибке округления float32
+            mean=min(round(float(values.mean()), 4), peak),
+            centroid=(round(center_x * scale_x, 1), round(center_y * scale_y, 1)),
+        ))
+    regions.sort(key=lambda region: region.peak, reverse=True)
+    return regions
+
+def downsample_heatmap(heatmap: Heatmap[int, int], max_size: int) -> Heatmap[int, int]:
+    height, width = fit_shape(heatmap.shape, max_size)
+    if (height, width) == heatmap.shape:
+        return heatmap
+    output = cv2.resize(heatmap, (width, height), interpolation=cv2.INTER_AREA)
+    return cast(Heatmap[int, int], output)
+
+def quantize_heatmap(heatmap: Heatmap[int, int]) -> np.ndarray:
+    return np.rint(heatmap * 255).astype(np.uint8)
+
+def run_length_encode(values: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    flat = values.ravel()
+    starts = np.flatnonzero(np.diff(flat, prepend=flat[:1] + 1))
+    lengths = np.diff(starts, append=flat.size)
+    return flat[starts], lengths.astype('<u4')
+
+def encode_heatmap(
+    heatmap: Heatmap[int, int],
+    format: PointsFormat,
+    grid_size: int = 64,
+    dimensions: tuple[int, int] | None = None,
+) -> HeatmapArray:
+    height, width = heatmap.shape
+    runs = None
+    if format == PointsFormat.GRID:
+        array = data = quantize_heatmap(downsample_heatmap(heatmap, grid_size))
+    elif format == PointsFormat.RLE:
+        array = quantize_heatmap(heatmap)
+        data, lengths = run_length_encode(array)
+        runs = base64.b64encode(lengths.tobytes()).decode()
+    elif format == PointsFormat.FLOAT16:
+        array = data = heatmap.astype('<f2')
+    elif format == PointsFormat.UINT8:
+        array = data = quantize_heatmap(heatmap)
+    else:
+        raise ValueError(f'Unsupported heatmap format: {format}')
+
+    return HeatmapArray(
+        encoding=format,
+        dtype=array.dtype.name,
+        shape=array.shape,
+        dimensions=dimensions or (width, height),
+        data=base64.b64encode(data.tobytes()).decode(),
+        runs=runs,
+    )
+
 def apply_threshold[W: int, H: int](
     heatmap: Heatmap[W, H],
     threshold: float = 0.1,
@@ -1,15 +1,23 @@
 import base64
-from typing import cast
+from typing import BinaryIO, cast
 from io import BytesIO
 
+import cv2
 import magic
 import numpy as np
 from fastapi import UploadFile, HTTPException
 from PIL import Image, UnidentifiedImageError
+from pydicom.dataset import Dataset
+from pydicom.multival import MultiValue
+from pydicom.pixels import apply_modality_lut, apply_voi_lut, pixel_array
+
+from schemas import ImageFormat
 
 type GrayscaleImage[W: int, H: int] = np.ndarray[tuple[H, W], np.dtype[np.uint8]]
 
 MAX_SIZE = 20 * 1024 * 1024
+# libmagic достаточно заголовка файла
+SNIFF_SIZE = 8 * 1024
 MIME_TYPES = [
     'image/jpeg',
     'image/png',
@@ -17,32 +25,133 @@ MIME_TYPES = [
     'image/webp',
     'image/bmp',
     'image/tiff',
-    'application/dicom', # todo
+    'application/dicom',
 ]
 
-def process_image(file: UploadFile) -> Image.Image:
+def process_image(file: UploadFile) -> Image.Image | GrayscaleImage[int, int]:
     if file.size is None or file.size == 0 or file.size > MAX_SIZE:
         raise HTTPException(400, 'Invalid file size')
 
-    content = file.file.read()
+    header = file.file.read(SNIFF_SIZE)
+    file.file.seek(0)
     try:
-        mime = magic.from_buffer(content, mime=True)
+        mime = magic.from_buffer(header, mime=True)
     except magic.MagicException:
         mime = None
     if mime not in MIME_TYPES:
         raise HTTPException(400, 'Invalid file type')
 
+    if mime == 'application/dicom':
+        return read_dicom(file.file)
+
     try:
         im = Image.open(file.file)
     except UnidentifiedImageError:
         raise HTTPException(400, 'Invalid image')
     return im
 
-def prepare_image(im: Image.Image) -> GrayscaleImage[int, int]:
-    output = np.array(im.convert('L'))
+def _first(value: object) -> float:
+    # окно может быть задано несколькими значениями, берём основное
+    return float(value[0] if isinstance(value, MultiValue) else value)
+
+def read_dicom(file: BinaryIO) -> GrayscaleImage[int, int]:
+    ds = Dataset()
+    try:
+        # декодируется только первый кадр, остальные данные не читаются
+        pixels = pixel_array(file, index=0, ds_out=ds)
+    except Exception:
+        # pydicom бросает разные исключения на повреждённых файлах
+        raise HTTPException(400, 'Invalid image')
+
+    if pixels.ndim == 3:
+        pixels = pixels @ np.array([0.299, 0.587, 0.114])
+
+    # rescale slope/intercept или Modality LUT, затем VOI LUT или окно
+    values = apply_modality_lut(pixels, ds)
+    windowed = 'WindowCenter' in ds and 'WindowWidth' in ds
+    if 'VOILUTSequence' in ds:
+        values = apply_voi_lut(values, ds)
+        windowed = False
+    values = values.astype(np.float32, copy=False)
+
+    if windowed:
+        center, width = _first(ds.WindowCenter), _first(ds.WindowWidth)
+        low, high = center - width / 2, center + width / 2
+    else:
+        low, high = float(values.min()), float(values.max())
+
+    scale = 255 / max(high - low, 1e-6)
+    output = np.clip((values - low) * scale, 0, 255).astype(np.uint8)
+    if ds.get('PhotometricInterpretation') == 'MONOCHROME1':
+        np.subtract(255, output, out=output)
     return cast(GrayscaleImage[int, int], output)
 
-def encode_image(im: Image.Image) -> str:
+def image_size(im: Image.Image | GrayscaleImage[int, int]) -> tuple[int, int]:
+    # (ширина, высота) исходного снимка, до уменьшения в prepare_image
+    if isinstance(im, np.ndarray):
+        return im.shape[1], im.shape[0]
+    return im.size
+
+def prepare_image(
+    im: Image.Image | GrayscaleImage[int, int],
+    max_size: int | None = None,
+) -> GrayscaleImage[int, int]:
+    if isinstance(im, np.ndarray):
+        return downscale_image(im, max_size)
+
+    if max_size:
+        # JPEG сразу декодируется в оттенках серого с уменьшением в 2-8 раз
+        im.draft('L', (max_size, max_size))
+    if im.mode != 'L':
+        im = im.convert('L')
+    if max_size and max(im.size) >= 2 * max_size:
+        # уменьшаем целым коэффициентом до копирования в numpy
+        im = im.reduce(max(im.size) // max_size)
+    output = downscale_image(np.array(im), max_size)
+    return cast(GrayscaleImage[int, int], output)
+
+def fit_shape(shape: tuple[int, int], max_size: int | None) -> tuple[int, int]:
+    # форма (высота, ширина), вписанная в квадрат max_size с сохранением пропорций
+    height, width = shape
+    if not max_size or max(height, width) <= max_size:
+        return height, width
+    scale = max_size / max(height, width)
+    return max(1, round(height * scale)), max(1, round(width * scale))
+
+def downscale_image(img: GrayscaleImage[int, int], max_size: int | None) -> GrayscaleImage[int, int]:
+    height, width = fit_shape(img.shape, max_size)
+    if (height, width) == img.shape:
+        return img
+    output = cv2.resize(img, (width, height), interpolation=cv2.INTER_AREA)
+    return cast(GrayscaleImage[int, int], output)
+
+IMAGE_MIME_TYPES = {
+    ImageFormat.PNG: 'image/png',
+    ImageFormat.WEBP: 'image/webp',
+    ImageFormat.JPEG: 'image/jpeg',
+}
+
+def save_image(
+    im: Image.Image,
+    format: ImageFormat = ImageFormat.PNG,
+    quality: int = 85,
+    compress_level: int = 6,
+) -> bytes:
+    # quality - для JPEG и WebP, compress_level (0-9) - для PNG
     buf = BytesIO()
-    im.save(buf, 'png')
-    return base64.b64encode(buf.getvalue()).decode()
+    if format == ImageFormat.PNG:
+        im.save(buf, 'png', compress_level=compress_level)
+    elif format == ImageFormat.WEBP:
+        # method=0 кодирует в разы быстрее значения по умолчанию почти без потери в размере
+        im.save(buf, 'webp', quality=quality, method=0)
+    else:
+        im.save(buf, 'jpeg', quality=quality)
+    return buf.getvalue()
+
+def encode_image(
+    im: Image.Image,
+    format: ImageFormat = ImageFormat.PNG,
+    quality: int = 85,
+    compress_level: int = 6,
+) -> str:
+    return base64.b64encode(save_image(im, format, quality, compress_level)).decode()
@@ -0,0 +1,292 @@
+"""
+Пакетный анализ снимков из командной строки, без HTTP-сервера.
+
+    python infer.py images/ --output results.jsonl --heatmaps heatmaps/
+
+Снимки декодируются в пуле процессов, модель получает их пачками.
+Результаты дописываются в выходной файл по мере готовности, а пути
+обработанных снимков в файл контрольной точки, поэтому прерванный запуск
+можно продолжить той же командой.
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+from collections import deque
+from collections.abc import Iterable, Iterator
+from concurrent.futures import Executor, ProcessPoolExecutor
+from itertools import batched
+from pathlib import Path
+from typing import NamedTuple, Protocol
+
+from fastapi import HTTPException, UploadFile
+
+from image import GrayscaleImage, process_image, prepare_image, image_size, save_image
+from heatmap import apply_threshold, render_heatmap
+from cache import hash_file
+from schemas import CamMethod, HeatmapMode, ImageFormat, InferenceBackend
+from settings import (
+    MODEL_PATH, MODEL_CACHE_DIR, ENSEMBLE_PATHS, TTA_VIEWS, MAX_BATCH_SIZE, CAM_METHOD, INFERENCE_BACKEND, HEATMAP_MAX_SIZE,
+    HEATMAP_FORMAT, HEATMAP_QUALITY, HEATMAP_PNG_COMPRESS_LEVEL,
+)
+# torchxrayvision imports 'model' module internally, so we have no choice but to rename our module
+from model_.arch_model import CLASS_NAMES, DEVICE, load_ensemble, prepare_model_for_viz_and_predict, run_model_batch
+from model_.backends import attach_backend
+
+class Decoded(NamedTuple):
+    path: str
+    img: GrayscaleImage[int, int] | None
+    dimensions: tuple[int, int] | None
+    error: str | None
+
+def find_images(inputs: Iterable[str], pattern: str = '*') -> Iterator[str]:
+    """
+    Раскрывает входные пути: каталоги обходятся рекурсивно, файлы вида
+    @list.txt содержат по пути на строку, остальные пути берутся как есть.
+    """
+    for item in inputs:
+        if item.startswith('@'):
+            with open(item[1:]) as f:
+                yield from (line.strip() for line in f if line.strip())
+        elif os.path.isdir(item):
+            for path in sorted(Path(item).rglob(pattern)):
+                if path.is_file() and not path.name.startswith('.'):
+                    yield str(path)
+        else:
+            yield item
+
+def decode_file(path: str, max_size: int | None) -> Decoded:
+    try:
+        with open(path, 'rb') as f:
+            upload = UploadFile(f, size=os.fstat(f.fileno()).st_size, filename=path)
+            im = process_image(upload)
+            return Decoded(path, prepare_image(im, max_size), image_size(im), None)
+    except HTTPException as e:
+        return Decoded(path, None, None, e.detail)
+    except OSError as e:
+        return Decoded(path, None, None, e.strerror or str(e))
+    except Exception as e:
+        # например, DecompressionBombError: ошибка только этого файла, а не всего прогона
+        return Decoded(path, None, None, str(e))
+
+def iter_decoded(
+    paths: Iterable[str],
+    executor: Executor,
+    max_size: int | None,
+    prefetch: int,
+) -> Iterator[Decoded]:
+    """
+    Декодирует снимки в executor, держа впереди не больше prefetch штук:
+    пока модель обрабатывает пачку, пул готовит следующие, но память
+    не растет с размером каталога. Порядок входа сохраняется.
+    """
+    queue = deque()
+    for path in paths:
+        queue.append(executor.submit(decode_file, path, max_size))
+        if len(queue) >= prefetch:
+            yield queue.popleft().result()
+    while queue:
+        yield queue.popleft().result()
+
+class Checkpoint:
+    """Список обработанных снимков, дописываемый после каждой пачки."""
+    def __init__(self, path: str):
+        self.path = path
+        self.done: set[str] = set()
+        if os.path.exists(path):
+            with open(path) as f:
+                self.done = {line.rstrip('\n') for line in f if line.strip()}
+        self.file = open(path, 'a')
+
+    def add(self, paths: Iterable[str]):
+        self.file.writelines(path + '\n' for path in paths)
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        self.file.close()
+
+class ResultWriter(Protocol):
+    def write(self, records: list[dict]): ...
+    def close(self): ...
+
+class JsonlWriter:
+    def __init__(self, path: str):
+        self.file = open(path, 'a')
+
+    def write(self, records: list[dict]):
+        self.file.writelines(json.dumps(record) + '\n' for record in records)
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+class ParquetWriter:
+    """
+    Пишет по группе строк на пачку. Дописывать в готовый Parquet-файл нельзя,
+    поэтому продолжение запуска пишет следующий файл: results.1.parquet и т. д.
+    """
+    def __init__(self, path: str):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self.pa = pa
+        self.schema = pa.schema([
+            ('path', pa.string()),
+            ('diagnosis', pa.string()),
+            *((f'probability_{name}', pa.float64()) for name in CLASS_NAMES),
+            ('heatmap', pa.string()),
+            ('error', pa.string()),
+        ])
+        self.writer = pq.ParquetWriter(next_free_path(path), self.schema)
+
+    def write(self, records: list[dict]):
+        rows = [
+            {
+                **{k: v for k, v in record.items() if k != 'probabilities'},
+                **{f'probability_{name}': p for name, p in (record['probabilities'] or {}).items()},
+            }
+            for record in records
+        ]
+        self.writer.write_table(self.pa.Table.from_pylist(rows, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+def next_free_path(path: str) -> str:
+    base, ext = os.path.splitext(path)
+    candidate, n = path, 0
+    while os.path.exists(candidate):
+        n += 1
+        candidate = f'{base}.{n}{ext}'
+    return candidate
+
+def heatmap_path(heatmap_dir: str, path: str, image_format: ImageFormat = ImageFormat.PNG) -> str:
+    digest = hashlib.blake2b(path.encode(), digest_size=8).hexdigest()
+    return os.path.join(heatmap_dir, f'{Path(path).stem}-{digest}.{image_format}')
+
+def infer_batch(
+    batch: list[Decoded],
+    model,
+    cam: CamMethod,
+    max_size: int | None,
+    heatmap_dir: str | None,
+    image_format: ImageFormat = ImageFormat.PNG,
+    views: int = 1,
+) -> list[dict]:
+    records = [
+        {'path': item.path, 'diagnosis': None, 'probabilities': None, 'heatmap': None, 'error': item.error}
+        for item in batch
+    ]
+    ok = [i for i, item in enumerate(batch) if item.error is None]
+    if not ok:
+        return records
+
+    # без каталога для карт хватает forward-прохода, карты не строятся
+    heatmap = HeatmapMode.EAGER if heatmap_dir is not None else HeatmapMode.NONE
+    outputs = run_model_batch([batch[i].img for i in ok], model, [cam] * len(ok), max_size, views=views,
+                              heatmaps=[heatmap] * len(ok))
+    for i, (pred, probs, cam_map) in zip(ok, outputs):
+        records[i].update(diagnosis=pred, probabilities=probs)
+        if heatmap_dir is not None and cam_map is not None:
+            records[i]['heatmap'] = heatmap_path(heatmap_dir, batch[i].path, image_format)
+            overlay = render_heatmap(batch[i].img, apply_threshold(cam_map))
+            with open(records[i]['heatmap'], 'wb') as f:
+                f.write(save_image(overlay, image_format, HEATMAP_QUALITY, HEATMAP_PNG_COMPRESS_LEVEL))
+    return records
+
+def run_inference(
+    paths: Iterable[str],
+    model,
+    writer: ResultWriter,
+    checkpoint: Checkpoint,
+    executor: Executor,
+    cam: CamMethod = CamMethod.GRADCAM,
+    batch_size: int = 8,
+    prefetch: int = 64,
+    max_size: int | None = None,
+    heatmap_dir: str | None = None,
+    image_format: ImageFormat = ImageFormat.PNG,
+    views: int = 1,
+    report_every: float = 10.0,
+) -> int:
+    """
+    Прогоняет снимки, пропуская отмеченные в контрольной точке,
+    и возвращает число обработанных за этот запуск.
+    """
+    if heatmap_dir is not None:
+        os.makedirs(heatmap_dir, exist_ok=True)
+
+    todo = (path for path in paths if path not in checkpoint.done)
+    decoded = iter_decoded(todo, executor, max_size, prefetch)
+
+    count = 0
+    start_time = last_report = time.perf_counter()
+    for batch in batched(decoded, batch_size):
+        records = infer_batch(list(batch), model, cam, max_size, heatmap_dir, image_format, views)
+        writer.write(records)
+        checkpoint.add(record['path'] for record in records)
+        count += len(records)
+
+        now = time.perf_counter()
+        if now - last_report >= report_every:
+            print(f'{count} images, {count / (now - start_time):.1f} images/s', file=sys.stderr)
+            last_report = now
+
+    elapsed = time.perf_counter() - start_time
+    print(f'{count} images in {elapsed:.1f} s, {count / max(elapsed, 1e-9):.1f} images/s', file=sys.stderr)
+    return count
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description='Batch X-ray analysis without the HTTP server')
+    parser.add_argument('inputs', nargs='+', help='image files, directories or @file lists')
+    parser.add_argument('--output', '-o', default='results.jsonl', help='.jsonl or .parquet file')
+    parser.add_argument('--checkpoint', help='list of finished images, defaults to OUTPUT.done')
+    parser.add_argument('--heatmaps', help='directory for heatmap overlay images')
+    parser.add_argument('--heatmap-format', type=ImageFormat, default=HEATMAP_FORMAT)
+    parser.add_argument('--pattern', default='*', help='file name pattern for directories')
+    parser.add_argument('--model', default=MODEL_PATH)
+    parser.add_argument('--ensemble', nargs='*', default=ENSEMBLE_PATHS, help='extra checkpoints to average with')
+    parser.add_argument('--views', type=int, default=TTA_VIEWS, help='test-time augmentation views, 1-8')
+    parser.add_argument('--cam', type=CamMethod, default=CAM_METHOD)
+    parser.add_argument('--backend', type=InferenceBackend, default=INFERENCE_BACKEND)
+    parser.add_argument('--batch-size', type=int, default=MAX_BATCH_SIZE)
+    parser.add_argument('--workers', type=int, default=max(1, (os.cpu_count() or 1) - 1))
+    parser.add_argument('--prefetch', type=int, default=None, help='decoded images kept ahead, defaults to 4 batches')
+    parser.add_argument('--max-size', type=int, default=HEATMAP_MAX_SIZE)
+    args = parser.parse_args(argv)
+
+    model = prepare_model_for_viz_and_predict(args.model, DEVICE)
+    load_ensemble(model, args.ensemble, DEVICE)
+    with open(args.model, 'rb') as f:
+        attach_backend(model, args.backend, MODEL_CACHE_DIR or None, hash_file(f))
+    checkpoint = Checkpoint(args.checkpoint or args.output + '.done')
+    if args.output.endswith('.parquet'):
+        writer: ResultWriter = ParquetWriter(args.output)
+    else:
+        writer = JsonlWriter(args.output)
+
+    try:
+        with ProcessPoolExecutor(args.workers) as executor:
+            run_inference(
+                find_images(args.inputs, args.pattern),
+                model,
+                writer,
+                checkpoint,
+                executor,
+                cam=args.cam,
+                batch_size=args.batch_size,
+                prefetch=args.prefetch or 4 * args.batch_size,
+                max_size=args.max_size,
+                heatmap_dir=args.heatmaps,
+                image_format=args.heatmap_format,
+                views=args.views,
+            )
+    finally:
+        writer.close()
+        checkpoint.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,237 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+from collections.abc import Callable
+from typing import NamedTuple
+
+from batching import QueueFull
+from schemas import JobState, JobStatus
+
+logger = logging.getLogger(__name__)
+
+# через сколько секунд советовать повторить запрос при переполненной очереди
+RETRY_AFTER = 10.0
+
+class Job(NamedTuple):
+    id: str
+    params: dict
+    # (имя файла, содержимое) в порядке загрузки
+    files: list[tuple[str | None, bytes]]
+    attempts: int
+
+class JobQueue:
+    """
+    Очередь заданий в SQLite: задания и их файлы переживают перезапуск,
+    а несколько процессов сервера могут брать задания из одного файла.
+    Взятое задание держит аренду на lease секунд, которую продлевает
+    взявший его процесс. Задание с истёкшей арендой считается упавшим
+    вместе с процессом и возвращается в очередь, пока у него остаются
+    попытки. Готовые задания хранятся ttl секунд.
+    """
+    def __init__(
+        self,
+        path: str,
+        max_queued: int = 1000,
+        ttl: float = 24 * 60 * 60,
+        lease: float = 30.0,
+        max_attempts: int = 3,
+    ):
+        self.max_queued = max_queued
+        self.ttl = ttl
+        self.lease = lease
+        self.max_attempts = max_attempts
+
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition()
+        self._stopped = threading.Event()
+        self._threads: list[threading.Thread] = []
+        # задания, которые выполняет этот процесс и чью аренду он продлевает
+        self._running: set[str] = set()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        # другой процесс может держать запись, пока берёт задание
+        self._db.execute('PRAGMA busy_timeout=5000')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS jobs ('
+            'id TEXT PRIMARY KEY, state TEXT NOT NULL, priority INTEGER NOT NULL, params TEXT NOT NULL, '
+            'result TEXT, error TEXT, attempts INTEGER NOT NULL DEFAULT 0, created REAL NOT NULL, '
+            'started REAL, finished REAL, lease_until REAL, expires REAL)'
+        )
+        self._db.execute('CREATE INDEX IF NOT EXISTS jobs_queue ON jobs (state, priority DESC, created)')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS job_files ('
+            'job_id TEXT NOT NULL, idx INTEGER NOT NULL, filename TEXT, content BLOB NOT NULL, '
+            'PRIMARY KEY (job_id, idx))'
+        )
+        self.maintain()
+
+    def submit(self, files: list[tuple[str | None, bytes]], params: dict, priority: int = 0) -> str:
+        """
+        Сохраняет задание с его файлами и возвращает идентификатор.
+        QueueFull, если в очереди уже max_queued заданий.
+        """
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            self._db.execute('BEGIN IMMEDIATE')
+            try:
+                queued, = self._db.execute(
+                    'SELECT COUNT(*) FROM jobs WHERE state = ?', (JobState.QUEUED,)
+                ).fetchone()
+                if queued >= self.max_queued:
+                    raise QueueFull(RETRY_AFTER)
+                self._db.execute(
+                    'INSERT INTO jobs (id, state, priority, params, created) VALUES (?, ?, ?, ?, ?)',
+                    (job_id, JobState.QUEUED, priority, json.dumps(params), time.time()),
+                )
+                self._db.executemany(
+                    'INSERT INTO job_files VALUES (?, ?, ?, ?)',
+                    [(job_id, i, filename, content) for i, (filename, content) in enumerate(files)],
+                )
+            except BaseException:
+                self._db.execute('ROLLBACK')
+                raise
+            self._db.execute('COMMIT')
+        with self._wakeup:
+            self._wakeup.notify()
+        return job_id
+
+    def get(self, job_id: str) -> JobStatus | None:
+        with self._lock:
+            row = self._db.execute(
+                'SELECT state, priority, attempts, created, started, finished, result, error '
+                'FROM jobs WHERE id = ? AND (expires IS NULL OR expires >= ?)',
+                (job_id, time.time()),
+            ).fetchone()
+        if row is None:
+            return None
+        state, priority, attempts, created, started, finished, result, error = row
+        return JobStatus(
+            id=job_id,
+            state=state,
+            priority=priority,
+            attempts=attempts,
+            created_at=created,
+            started_at=started,
+            finished_at=finished,
+            result=json.loads(result) if result is not None else None,
+            error=error,
+        )
+
+    def claim(self) -> Job | None:
+        """
+        Берёт задание с наибольшим приоритетом, из равных - самое старое.
+        Выбор и смена состояния - один запрос, поэтому два процесса не
+        возьмут одно задание.
+        """
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                'UPDATE jobs SET state = ?, started = ?, attempts = attempts + 1, lease_until = ? '
+                'WHERE id = (SELECT id FROM jobs WHERE state = ? ORDER BY priority DESC, created LIMIT 1) '
+                'RETURNING id, params, attempts',
+                (JobState.RUNNING, now, now + self.lease, JobState.QUEUED),
+            ).fetchone()
+            if row is None:
+                return None
+            job_id, params, attempts = row
+            files = self._db.execute(
+                'SELECT filename, content FROM job_files WHERE job_id = ? ORDER BY idx', (job_id,)
+            ).fetchall()
+            self._running.add(job_id)
+        return Job(job_id, json.loads(params), files, attempts)
+
+    def complete(self, job_id: str, result: str) -> None:
+        # result - уже сериализованный JSON
+        self._finish(job_id, JobState.DONE, result, None)
+
+    def fail(self, job_id: str, error: str) -> None:
+        self._finish(job_id, JobState.FAILED, None, error)
+
+    def _finish(self, job_id: str, state: JobState, result: str | None, error: str | None) -> None:
+        now = time.time()
+        with self._lock:
+            self._running.discard(job_id)
+            self._db.execute(
+                'UPDATE jobs SET state = ?, result = ?, error = ?, finished = ?, lease_until = NULL, expires = ? '
+                'WHERE id = ?',
+                (state, result, error, now, now + self.ttl, job_id),
+            )
+            # файлы после завершения больше не нужны
+            self._db.execute('DELETE FROM job_files WHERE job_id = ?', (job_id,))
+
+    def maintain(self) -> None:
+        """
+        Продлевает аренду своих заданий, возвращает в очередь задания с
+        истёкшей арендой (или отмечает их упавшими, если попытки кончились)
+        и удаляет устаревшие готовые задания.
+        """
+        now = time.time()
+        with self._lock:
+            self._db.executemany(
+                'UPDATE jobs SET lease_until = ? WHERE id = ?', [(now + self.lease, job_id) for job_id in self._running]
+            )
+            requeued = self._db.execute(
+                'UPDATE jobs SET state = ?, lease_until = NULL '
+                'WHERE state = ? AND lease_until < ? AND attempts < ?',
+                (JobState.QUEUED, JobState.RUNNING, now, self.max_attempts),
+            ).rowcount
+            self._db.execute(
+                'UPDATE jobs SET state = ?, error = ?, finished = ?, lease_until = NULL, expires = ? '
+                'WHERE state = ? AND lease_until < ?',
+                (JobState.FAILED, 'Job was interrupted too many times', now, now + self.ttl, JobState.RUNNING, now),
+            )
+            self._db.execute(
+                'DELETE FROM job_files WHERE job_id IN (SELECT id FROM jobs WHERE expires < ? OR state = ?)',
+                (now, JobState.FAILED),
+            )
+            self._db.execute('DELETE FROM jobs WHERE expires < ?', (now,))
+        if requeued:
+            logger.warning('Requeued %d interrupted jobs', requeued)
+            with self._wakeup:
+                self._wakeup.notify_all()
+
+    def start(self, handler: Callable[[Job], str], workers: int = 1, poll_interval: float = 1.0) -> None:
+        """
+        Запускает workers потоков, которые выполняют задания через handler
+        (он возвращает результат в JSON), и поток обслуживания очереди.
+        Задания, добавленные другими процессами, подхватываются не позже
+        чем через poll_interval секунд.
+        """
+        def work():
+            while not self._stopped.is_set():
+                job = self.claim()
+                if job is None:
+                    with self._wakeup:
+                        self._wakeup.wait(poll_interval)
+                    continue
+                try:
+                    result = handler(job)
+                except Exception as e:
+                    logger.exception('Job %s failed', job.id)
+                    self.fail(job.id, str(e))
+                else:
+                    self.complete(job.id, result)
+
+        def maintain():
+            # аренда продлевается несколько раз за срок, чтобы пережить задержки
+            while not self._stopped.wait(self.lease / 3):
+                self.maintain()
+
+        self._threads = [
+            threading.Thread(target=work, name=f'job-worker-{i}', daemon=True) for i in range(workers)
+        ]
+        self._threads.append(threading.Thread(target=maintain, name='job-maintenance', daemon=True))
+        for thread in self._threads:
+            thread.start()
+
+    def close(self) -> None:
+        self._stopped.set()
+        with self._wakeup:
+            self._wakeup.notify_all()
+        for thread in self._threads:
+            thread.join()
+        with self._lock:
+            self._db.close()
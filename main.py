@@ -1,49 +1,449 @@
 import time
+START_TIME = time.perf_counter()
+
+import copy
+import functools
+import logging
+import os
+import tempfile
+import threading
+import zipfile
+from collections.abc import AsyncIterator, Callable, Sequence
+from contextlib import AbstractContextManager, asynccontextmanager, contextmanager, nullcontext
+from io import BytesIO
+from typing import TYPE_CHECKING
 
 import uvicorn
-from fastapi import FastAPI, UploadFile
+from fastapi import Depends, FastAPI, HTTPException, UploadFile
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
+from pydantic import TypeAdapter
+
+from schemas import (
+    AnalysisEvent, AnalysisResult, BatchItem, CamMethod, Diagnosis, HeatmapMode, HeatmapResult, ImageDelivery, ImageFormat,
+    JobStatus, OverlayMode, PointsFormat, StreamEvent,
+)
+from archive import expand_uploads
+from batching import QueueFull
+from cache import DiskCache, LRUCache, ResultCache, hash_file, make_cache_key
+from delivery import HeatmapStore, link_heatmap, link_image, multipart_response
+from image import MAX_SIZE
+from jobs import Job, JobQueue
+from metrics import metrics_app
+from settings import (
+    MODEL_PATH, MODEL_DIR, MODEL_VERSION, MODEL_CACHE_DIR, ENSEMBLE_PATHS, TTA_VIEWS, WORKERS, NUM_THREADS, INTEROP_THREADS,
+    MAX_BATCH_SIZE, MAX_BATCH_WAIT_MS, MAX_QUEUE_DEPTH, DECODE_THREADS, RENDER_THREADS, BATCH_WINDOW, CAM_METHOD, INFERENCE_BACKEND, CPU_OPTIMIZATIONS, HEATMAP_MAX_SIZE, HEATMAP_GRID_SIZE,
+    HEATMAP_FORMAT, HEATMAP_QUALITY, HEATMAP_PNG_COMPRESS_LEVEL, HEATMAP_LAYER_SIZE, HEATMAP_URL_MAX_BYTES, HEATMAP_URL_TTL,
+    FEATURE_CACHE_BYTES, FEATURE_CACHE_TTL,
+    JOBS_PATH, JOB_WORKERS, JOB_MAX_QUEUED, JOB_TTL, JOB_LEASE, JOB_MAX_ATTEMPTS, JOB_MAX_BYTES,
+    CACHE_MAX_ENTRIES, CACHE_MAX_BYTES, CACHE_TTL, CACHE_PATH, CACHE_DISK_MAX_ENTRIES,
+    PROFILE_RATE, PROFILE_DIR,
+)
+
+if TYPE_CHECKING:
+    from pipeline import AnalysisPipeline
+
+logger = logging.getLogger(__name__)
+
+cache = ResultCache(
+    LRUCache(CACHE_MAX_ENTRIES, CACHE_MAX_BYTES, CACHE_TTL),
+    DiskCache(CACHE_PATH, CACHE_DISK_MAX_ENTRIES, CACHE_TTL) if CACHE_PATH else None,
+)
+heatmaps = HeatmapStore(HEATMAP_URL_MAX_BYTES, HEATMAP_URL_TTL)
+pipeline: 'AnalysisPipeline | None' = None
+# открывается при запуске сервера, а не при импорте main
+jobs: JobQueue | None = None
+load_error: Exception | None = None
+startup_times = {'server imports': time.perf_counter() - START_TIME}
+
+@contextmanager
+def timed(stage: str):
+    start = time.perf_counter()
+    yield
+    startup_times[stage] = time.perf_counter() - start
+
+def build_model(
+    path: str,
+    stage: Callable[[str], AbstractContextManager] = lambda _: nullcontext(),
+    ensemble_paths: Sequence[str] = (),
+):
+    """
+    Загружает чекпоинт с ансамблем из ensemble_paths и бэкендом и возвращает
+    модель и хэш, от которого зависят результаты. stage замеряет этапы загрузки.
+    """
+    # torchxrayvision imports 'model' module internally, so we have no choice but to rename our module
+    from model_.arch_model import DEVICE, load_ensemble, prepare_model_for_viz_and_predict
+    from model_.backends import FEATURE_LAYER, attach_backend
+
+    with stage('model hash'):
+        with open(path, 'rb') as f:
+            weights_hash = hash_file(f)
+        # результаты зависят от всех чекпоинтов ансамбля
+        model_hash = weights_hash
+        for ensemble_path in ensemble_paths:
+            with open(ensemble_path, 'rb') as f:
+                model_hash = make_cache_key(model_hash, hash_file(f))
+        # и от бэкенда: экспортированные модели считают чуть иначе, INT8 - заметно,
+        # как и bf16 среди оптимизаций для CPU; карты - ещё и от слоя признаков
+        model_hash = make_cache_key(model_hash, INFERENCE_BACKEND, FEATURE_LAYER, *sorted(set(CPU_OPTIMIZATIONS)))
+    with stage('model'):
+        model = prepare_model_for_viz_and_predict(path, DEVICE)
+        load_ensemble(model, ensemble_paths, DEVICE)
+    with stage('backend'):
+        attach_backend(model, INFERENCE_BACKEND, MODEL_CACHE_DIR or None, weights_hash, CPU_OPTIMIZATIONS)
+    return model, model_hash
+
+@functools.cache
+def set_thread_counts() -> None:
+    """
+    Задаёт число потоков один раз на процесс: число inter-op потоков PyTorch
+    нельзя менять после того, как он начал параллельную работу, например
+    при повторном запуске приложения в том же процессе.
+    """
+    import cv2
+    import torch
+
+    # при нескольких воркерах потоки делятся между ними, иначе
+    # внутриоперационный параллелизм и процессы конкурируют за ядра
+    torch.set_num_threads(NUM_THREADS)
+    cv2.setNumThreads(NUM_THREADS)
+    try:
+        torch.set_num_interop_threads(INTEROP_THREADS)
+    except RuntimeError as e:
+        logger.warning('Inter-op threads are left as is: %s', e)
 
-from image import process_image, prepare_image, encode_image
-from heatmap import make_example_heatmap, apply_threshold, render_heatmap, dense_to_sparse
-from schemas import AnalysisResult, Diagnosis, HeatmapImage
-# torchxrayvision imports 'model' module internally, so we have no choice but to rename our module
-from model_.arch_model import prepare_model_for_viz_and_predict, run_model_with_features, DEVICE
+def load_model():
+    """
+    Загружает модель в фоне, пока сервер уже отвечает на /healthz и /readyz.
+    torch и модель импортируются здесь же, а не при импорте main.
+    """
+    global pipeline, load_error
+    try:
+        with timed('model imports'):
+            from pipeline import AnalysisPipeline
+            import model_.arch_model
+        set_thread_counts()
+        # ENSEMBLE_PATHS дополняют только начальную версию, загруженные позже идут без них
+        model, model_hash = build_model(MODEL_PATH, timed, ENSEMBLE_PATHS)
 
-app = FastAPI()
-model, hooks = prepare_model_for_viz_and_predict('model_/best_model.pth')
+        loaded = AnalysisPipeline(
+            model,
+            model_hash,
+            cache,
+            max_batch_size=MAX_BATCH_SIZE,
+            max_wait_ms=MAX_BATCH_WAIT_MS,
+            max_size=HEATMAP_MAX_SIZE,
+            grid_size=HEATMAP_GRID_SIZE,
+            max_queue_depth=MAX_QUEUE_DEPTH or None,
+            decode_threads=DECODE_THREADS,
+            render_threads=RENDER_THREADS,
+            profile_rate=PROFILE_RATE,
+            profile_dir=PROFILE_DIR,
+            image_format=HEATMAP_FORMAT,
+            image_quality=HEATMAP_QUALITY,
+            png_compress_level=HEATMAP_PNG_COMPRESS_LEVEL,
+            layer_size=HEATMAP_LAYER_SIZE,
+            views=TTA_VIEWS,
+            version=MODEL_VERSION,
+            feature_cache_bytes=FEATURE_CACHE_BYTES,
+            feature_cache_ttl=FEATURE_CACHE_TTL,
+        )
+        with timed('warmup'):
+            loaded.warmup(model)
+        pipeline = loaded
+        if jobs is not None:
+            jobs.start(run_job, JOB_WORKERS)
+    except Exception as e:
+        load_error = e
+        logger.exception('Failed to load the model')
+        return
+
+    startup_times['total'] = time.perf_counter() - START_TIME
+    logger.info('Startup: %s', ', '.join(f'{stage} {seconds:.2f} s' for stage, seconds in startup_times.items()))
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global jobs
+    # задания, принятые до загрузки модели, ждут в очереди
+    jobs = JobQueue(JOBS_PATH, JOB_MAX_QUEUED, JOB_TTL, JOB_LEASE, JOB_MAX_ATTEMPTS)
+    threading.Thread(target=load_model, name='model-loader', daemon=True).start()
+    yield
+    # дожидается выполняемых заданий; невзятые останутся в базе до следующего запуска
+    queue, jobs = jobs, None
+    queue.close()
+
+def get_pipeline() -> 'AnalysisPipeline':
+    if pipeline is None:
+        raise HTTPException(503, 'Model is not loaded yet', headers={'Retry-After': '1'})
+    return pipeline
+
+app = FastAPI(lifespan=lifespan)
+
+@app.get('/healthz')
+async def healthz():
+    if load_error is not None:
+        return JSONResponse({'status': 'error', 'detail': str(load_error)}, status_code=500)
+    return {'status': 'ok'}
+
+@app.get('/readyz')
+async def readyz():
+    if pipeline is None:
+        return JSONResponse({'status': 'loading'}, status_code=503)
+    return {'status': 'ready', 'startup_times': startup_times}
 
 @app.post('/api/analyze')
-def analyze(image: UploadFile) -> AnalysisResult:
-    start_time = time.time()
-
-    im = process_image(image)
-    img = prepare_image(im)
-    pred, probs, cam = run_model_with_features(img, model, hooks)
-    if cam is not None:
-        heatmap = apply_threshold(cam)
-        b64 = encode_image(render_heatmap(img, heatmap))
-        viz = HeatmapImage(
-            base64=b64,
-            mime='image/png',
-            dimensions=im.size,
+async def analyze(
+    image: UploadFile,
+    cam: CamMethod = CAM_METHOD,
+    points: PointsFormat = PointsFormat.LIST,
+    stages: bool = False,
+    format: ImageFormat | None = None,
+    overlay: OverlayMode = OverlayMode.BLEND,
+    delivery: ImageDelivery = ImageDelivery.INLINE,
+    version: str | None = None,
+    stream: bool = False,
+    heatmap: HeatmapMode = HeatmapMode.EAGER,
+    regions: bool = False,
+) -> AnalysisResult:
+    if stream:
+        if delivery == ImageDelivery.MULTIPART:
+            raise HTTPException(400, 'Multipart delivery cannot be streamed')
+        events = await get_pipeline().analyze_stream(image, cam, points, format, overlay, version, heatmap, regions)
+        return StreamingResponse(event_lines(events, stages, delivery), media_type='application/x-ndjson')
+
+    result = await get_pipeline().analyze_async(image, cam, points, format, overlay, version, heatmap, regions)
+    if not stages:
+        result.stage_times = None
+    if delivery == ImageDelivery.URL:
+        return link_image(result, heatmaps)
+    if delivery == ImageDelivery.MULTIPART:
+        return multipart_response(result)
+    return result
+
+async def event_lines(
+    events: AsyncIterator[AnalysisEvent],
+    stages: bool,
+    delivery: ImageDelivery,
+) -> AsyncIterator[str]:
+    try:
+        async for event in events:
+            if not stages:
+                event.stage_times = None
+            if delivery == ImageDelivery.URL:
+                link_heatmap(event.heatmap_image, heatmaps)
+            yield event.model_dump_json(exclude_none=True) + '\n'
+    except Exception as e:
+        # статус уже отправлен, поэтому ошибка приходит последним событием
+        logger.exception('Streamed analysis failed')
+        error = AnalysisEvent(event=StreamEvent.ERROR, detail=getattr(e, 'detail', str(e)))
+        yield error.model_dump_json(exclude_none=True) + '\n'
+
+@app.post('/api/analyze/batch', response_model=list[BatchItem])
+def analyze_batch(
+    images: list[UploadFile],
+    cam: CamMethod = CAM_METHOD,
+    points: PointsFormat = PointsFormat.LIST,
+    stream: bool = False,
+    stages: bool = False,
+    format: ImageFormat | None = None,
+    overlay: OverlayMode = OverlayMode.BLEND,
+    delivery: ImageDelivery = ImageDelivery.INLINE,
+    version: str | None = None,
+    heatmap: HeatmapMode = HeatmapMode.EAGER,
+    regions: bool = False,
+):
+    if delivery == ImageDelivery.MULTIPART:
+        raise HTTPException(400, 'Multipart delivery is only supported for single images')
+    pipeline = get_pipeline()
+    pipeline.check_admission()
+    items = pipeline.analyze_many(
+        expand_uploads(images), cam, points, BATCH_WINDOW, format, overlay, version, heatmap, regions,
+    )
+    if not stages:
+        items = map(without_stage_times, items)
+    if delivery == ImageDelivery.URL:
+        items = map(with_image_link, items)
+    if stream:
+        return StreamingResponse(
+            (item.model_dump_json() + '\n' for item in items),
+            media_type='application/x-ndjson',
         )
-        points = dense_to_sparse(heatmap)
-    else:
-        viz = None
-        points = None
-
-    return AnalysisResult(
-        diagnosis=pred,
-        probabilities=probs,
-        heatmap_image=viz,
-        heatmap_points=points,
-        base_model_name=model.weights,
-        processing_time=time.time() - start_time,
-        processing_device=DEVICE.type,
+    return sorted(items, key=lambda item: item.index)
+
+def without_stage_times(item: BatchItem) -> BatchItem:
+    if item.result is not None:
+        item.result.stage_times = None
+    return item
+
+def with_image_link(item: BatchItem) -> BatchItem:
+    if item.result is not None:
+        link_image(item.result, heatmaps)
+    return item
+
+@app.get('/api/analyze/{result_id}/heatmap')
+async def analyze_heatmap(
+    result_id: str,
+    diagnosis: Diagnosis | None = None,
+    cam: CamMethod = CAM_METHOD,
+    points: PointsFormat = PointsFormat.LIST,
+    stages: bool = False,
+    format: ImageFormat | None = None,
+    overlay: OverlayMode = OverlayMode.BLEND,
+    delivery: ImageDelivery = ImageDelivery.INLINE,
+    regions: bool = False,
+) -> HeatmapResult:
+    """
+    Карта для результата, полученного с heatmap=lazy, для класса diagnosis
+    (по умолчанию предсказанного) по признакам, сохранённым при анализе.
+    """
+    result = await get_pipeline().heatmap_async(result_id, diagnosis, cam, points, format, overlay, regions)
+    if not stages:
+        result.stage_times = None
+    if delivery == ImageDelivery.URL:
+        return link_image(result, heatmaps)
+    if delivery == ImageDelivery.MULTIPART:
+        return multipart_response(result)
+    return result
+
+batch_items = TypeAdapter(list[BatchItem])
+
+def get_jobs() -> JobQueue:
+    if jobs is None:
+        raise HTTPException(503, 'Job queue is not available', headers={'Retry-After': '1'})
+    return jobs
+
+def run_job(job: Job) -> str:
+    # задание выполняется так же, как /api/analyze/batch
+    params = job.params
+    uploads = [UploadFile(BytesIO(content), size=len(content), filename=filename) for filename, content in job.files]
+    items = pipeline.analyze_many(
+        expand_uploads(uploads), CamMethod(params['cam']), PointsFormat(params['points']), BATCH_WINDOW,
+        ImageFormat(params['format']) if params['format'] else None, OverlayMode(params['overlay']),
+        params['version'], HeatmapMode(params['heatmap']), params['regions'],
     )
+    if not params['stages']:
+        items = map(without_stage_times, items)
+    return batch_items.dump_json(sorted(items, key=lambda item: item.index)).decode()
+
+@app.post('/api/jobs', status_code=202)
+def create_job(
+    images: list[UploadFile],
+    cam: CamMethod = CAM_METHOD,
+    points: PointsFormat = PointsFormat.LIST,
+    stages: bool = False,
+    format: ImageFormat | None = None,
+    overlay: OverlayMode = OverlayMode.BLEND,
+    version: str | None = None,
+    heatmap: HeatmapMode = HeatmapMode.EAGER,
+    regions: bool = False,
+    priority: int = 0,
+) -> JobStatus:
+    """
+    Сохраняет снимки (как для /api/analyze/batch) в очередь заданий и сразу
+    возвращает задание; результат забирается через GET /api/jobs/{id}.
+    Задания с большим priority выполняются раньше.
+    """
+    queue = get_jobs()
+    # файлы хранятся в базе до выполнения, поэтому размер проверяется до чтения
+    if any(image.size is None or image.size == 0 or image.size > MAX_SIZE for image in images):
+        raise HTTPException(400, 'Invalid file size')
+    if sum(image.size for image in images) > JOB_MAX_BYTES:
+        raise HTTPException(413, 'Job is too large')
+    files = [(image.filename, image.file.read()) for image in images]
+    params = {
+        'cam': cam, 'points': points, 'stages': stages, 'format': format, 'overlay': overlay,
+        'version': version, 'heatmap': heatmap, 'regions': regions,
+    }
+    try:
+        job_id = queue.submit(files, params, priority)
+    except QueueFull as e:
+        raise HTTPException(503, 'Job queue is full', headers={'Retry-After': str(int(e.retry_after))})
+    return queue.get(job_id)
+
+@app.get('/api/jobs/{job_id}')
+def job_status(job_id: str) -> JobStatus:
+    status = get_jobs().get(job_id)
+    if status is None:
+        raise HTTPException(404, 'Job not found or expired')
+    return status
 
+@app.get('/api/heatmaps/{image_id}')
+async def heatmap_image(image_id: str) -> Response:
+    image = heatmaps.get(image_id)
+    if image is None:
+        raise HTTPException(404, 'Heatmap image not found or expired')
+    data, mime = image
+    # содержимое по идентификатору не меняется
+    return Response(data, media_type=mime, headers={'Cache-Control': f'private, max-age={int(HEATMAP_URL_TTL)}'})
+
+@app.get('/api/models')
+async def models() -> dict:
+    return get_pipeline().registry.status()
+
+@app.post('/api/models/{version}', status_code=202)
+def load_version(version: str, activate: bool = False) -> dict:
+    """
+    Загружает {MODEL_DIR}/{version}.pth в фоне и, если activate, переключает
+    на неё трафик, как только она прогреется.
+    """
+    pipeline = get_pipeline()
+    path = os.path.join(MODEL_DIR, f'{version}.pth')
+    if os.path.basename(version) != version or version.startswith('.') or not os.path.isfile(path):
+        raise HTTPException(404, f'Model version not found: {version}')
+    try:
+        pipeline.load_version(version, lambda: build_model(path), activate)
+    except ValueError as e:
+        raise HTTPException(409, str(e))
+    return {'status': 'loading'}
+
+@app.post('/api/models/{version}/activate')
+async def activate_version(version: str) -> dict:
+    registry = get_pipeline().registry
+    try:
+        registry.activate(version)
+    except KeyError:
+        raise HTTPException(404, f'Model version is not loaded: {version}')
+    return registry.status()
+
+@app.delete('/api/models/{version}')
+async def unload_version(version: str) -> dict:
+    registry = get_pipeline().registry
+    try:
+        registry.remove(version)
+    except KeyError:
+        raise HTTPException(404, f'Model version is not loaded: {version}')
+    except ValueError as e:
+        raise HTTPException(409, str(e))
+    return registry.status()
+
+@app.get('/api/stats/batching')
+async def batching_stats() -> dict:
+    return get_pipeline().scheduler.stats()._asdict()
+
+@app.get('/api/stats/cache')
+async def cache_stats() -> dict:
+    return cache.stats()._asdict()
+
+app.mount('/metrics', metrics_app())
 app.mount('/', StaticFiles(directory='web', html=True))
 
 if __name__ == '__main__':
-    uvicorn.run(app, host='0.0.0.0', port=8000)
+    log_config = copy.deepcopy(uvicorn.config.LOGGING_CONFIG)
+    log_config['root'] = {'handlers': ['default'], 'level': 'INFO'}
+
+    if WORKERS > 1:
+        if not zipfile.is_zipfile(MODEL_PATH):
+            from model_.arch_model import convert_to_mmap_format
+            with open(MODEL_PATH, 'rb') as f:
+                name = f'{hash_file(f)}-weights.pth'
+            # имя версии и каталог версий берутся от исходного чекпоинта, а не от копии
+            os.environ['MODEL_VERSION'] = MODEL_VERSION
+            os.environ['MODEL_DIR'] = MODEL_DIR
+            os.environ['MODEL_PATH'] = convert_to_mmap_format(
+                MODEL_PATH, os.path.join(MODEL_CACHE_DIR or tempfile.gettempdir(), name),
+            )
+        # воркеры отображают в память один файл весов и делят его страницы
+        # через page cache, так что веса в памяти присутствуют один раз
+        uvicorn.run('main:app', host='0.0.0.0', port=8000, workers=WORKERS, log_config=log_config)
+    else:
+        uvicorn.run(app, host='0.0.0.0', port=8000, log_config=log_config)
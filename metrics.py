@@ -0,0 +1,64 @@
+import os
+import time
+from contextlib import contextmanager
+
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, make_asgi_app, multiprocess
+
+# этапы длятся от долей миллисекунды (хэш, кэш) до секунд (модель на CPU)
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+STAGE_SECONDS = Histogram(
+    'xray_stage_seconds',
+    'Time spent in each stage of an analysis request',
+    ['stage', 'diagnosis', 'device'],
+    buckets=BUCKETS,
+)
+REQUEST_SECONDS = Histogram(
+    'xray_request_seconds',
+    'Total time of an analysis request',
+    ['diagnosis', 'device', 'cached'],
+    buckets=BUCKETS,
+)
+FIRST_RESULT_SECONDS = Histogram(
+    'xray_first_result_seconds',
+    'Time until the diagnosis of a streamed analysis request is sent',
+    ['diagnosis', 'device'],
+    buckets=BUCKETS,
+)
+REJECTED = Counter('xray_rejected_requests', 'Requests rejected because of a full inference queue')
+QUEUE_DEPTH = Gauge('xray_queue_depth', 'Images waiting for or running in the model', multiprocess_mode='livesum')
+
+def metrics_app():
+    """
+    ASGI-приложение для /metrics. При нескольких воркерах метрики
+    собираются из PROMETHEUS_MULTIPROC_DIR по всем процессам.
+    """
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return make_asgi_app(registry)
+    return make_asgi_app()
+
+class StageTimer:
+    """
+    Время этапов одного запроса. Этапы модели общие для всей пачки
+    и добавляются каждому запросу в ней целиком.
+    """
+    def __init__(self):
+        self.times: dict[str, float] = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name: str, seconds: float):
+        self.times[name] = self.times.get(name, 0.0) + seconds
+
+    def observe(self, diagnosis: str, device: str, total: float, cached: bool = False):
+        for name, seconds in self.times.items():
+            STAGE_SECONDS.labels(name, diagnosis, device).observe(seconds)
+        REQUEST_SECONDS.labels(diagnosis, device, str(cached).lower()).observe(total)
@@ -1,14 +1,22 @@
+import os
+import time
+import zipfile
+from collections.abc import Callable, Iterable
+from typing import NamedTuple
+
+import numpy as np
 import torch
 import torch.nn as nn
 import torchxrayvision as xrv
 import torch.nn.functional as F
 from PIL import Image
 
-from image import GrayscaleImage
-from schemas import Diagnosis
-from .cam_and_viz import compute_gradcam, show_imgs, resize_cam
+from image import GrayscaleImage, fit_shape
+from schemas import CamMethod, CpuOptimization, Diagnosis, HeatmapMode, InferenceBackend
+from .backends import attach_backend, feature_split
+from .cam_and_viz import compute_cam, compute_gradcam, compute_gradcam_pp, normalize_cam, resize_cam
 from .image_transfroms import val_transform  
-from .hooks import ActivationHook, GradientHook
+from .tta import make_views, merge_cams
 
 DEVICE = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 CLASS_NAMES = [Diagnosis.BACTERIAL, Diagnosis.NORMAL, Diagnosis.VIRAL]
@@ -16,12 +24,39 @@ CLASS_NAMES = [Diagnosis.BACTERIAL, Diagnosis.NORMAL, Diagnosis.VIRAL]
 # suppress warning
 xrv.utils.warning_log['norm_check'] = True
 
+
+def load_state_dict(weights_path: str, device: torch.device = DEVICE):
+    try:
+        # файл отображается в память: страницы весов читаются по мере
+        # обращения и разделяются между процессами через page cache
+        return torch.load(weights_path, map_location=device, mmap=True, weights_only=True)
+    except RuntimeError:
+        # mmap поддерживается только zip-форматом torch.save
+        return torch.load(weights_path, map_location=device, weights_only=True)
+
+
+def convert_to_mmap_format(weights_path: str, output_path: str) -> str:
+    """
+    Пересохраняет веса в zip-формате torch.save, если они в старом формате,
+    чтобы процессы сервера могли отобразить один файл в память.
+    """
+    if zipfile.is_zipfile(weights_path):
+        return weights_path
+    if not os.path.exists(output_path):
+        torch.save(torch.load(weights_path, map_location="cpu", weights_only=True), output_path)
+    return output_path
+
+
 def load_trained_model(weights_path: str = "best_model.pth",
                        device: torch.device = DEVICE):
     """
     Создаёт такую же архитектуру CheXNet, как при обучении, и загружает веса.
+    Предобученные веса CheXpert всё равно перезаписываются весами из
+    weights_path, поэтому архитектура создаётся без них, а имя базовой
+    модели проставляется вручную.
     """
-    model = xrv.models.DenseNet(weights="densenet121-res224-chex")
+    model = xrv.models.DenseNet(weights=None)
+    model.weights = "densenet121-res224-chex"
 
     in_feats = model.classifier.in_features
     model.classifier = nn.Linear(in_feats, len(CLASS_NAMES))
@@ -29,8 +64,8 @@ def load_trained_model(weights_path: str = "best_model.pth",
     model.op_threshs = None
     model.pathologies = CLASS_NAMES
 
-    state_dict = torch.load(weights_path, map_location=device)
-    model.load_state_dict(state_dict)
+    # assign=True оставляет загруженные тензоры как есть, без копирования
+    model.load_state_dict(load_state_dict(weights_path, device), assign=True)
 
     model.to(device)
     model.eval()
@@ -38,48 +73,247 @@ def load_trained_model(weights_path: str = "best_model.pth",
 
 
 def prepare_model_for_viz_and_predict(weights_path: str = "best_model.pth",
-                          device: torch.device = DEVICE):
+                          device: torch.device = DEVICE,
+                          backend: InferenceBackend = InferenceBackend.EAGER,
+                          optimizations: Iterable[CpuOptimization] = ()):
     """
-    Загружает модель и вешает forward-хуки на выбранный слой.
+    Загружает модель и замораживает веса: для Grad-CAM нужны только
+    градиенты по активациям, а не по параметрам.
     """
     model = load_trained_model(weights_path, device)
+    model.requires_grad_(False)
+    return attach_backend(model, backend, optimizations=optimizations)
+
+
+def load_ensemble(model, weights_paths: list[str], device: torch.device = DEVICE):
+    """
+    Подключает к модели дополнительные чекпоинты той же архитектуры:
+    run_model_batch усредняет их вероятности и карты с основной моделью.
+    Бэкенд (см. backends.py) используется только основной моделью.
+    """
+    model.ensemble = [prepare_model_for_viz_and_predict(path, device) for path in weights_paths]
+    return model
 
-    hooks = {
-        "denseblock4": ActivationHook(model.features.denseblock4),
-        "denseblock4_grad": GradientHook(model.features.denseblock4)
-    }
 
-    return model, hooks
+class ImageFeatures(NamedTuple):
+    """
+    Карты признаков одного снимка (по тензору (views, C, h, w) на модель
+    ансамбля), по которым compute_cams строит карту позже, без forward-прохода.
+    """
+    feature_maps: list[torch.Tensor]
+    input_size: tuple[int, int]
+    views: int
 
+    @property
+    def nbytes(self) -> int:
+        return sum(fm.numel() * fm.element_size() for fm in self.feature_maps)
 
-def run_model_with_features(img: GrayscaleImage,
-                                model,
-                                hooks: dict,
-                                device: torch.device = DEVICE):
-    tensor = val_transform(img)
-    tensor = tensor.unsqueeze(0).to(device)       
-    
-    model.zero_grad()
 
-    logits = model(tensor)              
-    probs = F.softmax(logits, dim=1)
-    class_probs = dict(zip(CLASS_NAMES, probs[0].tolist()))
+def head_features(model, feature_maps: torch.Tensor) -> torch.Tensor:
+    # слои после FEATURE_LAYER (финальный BatchNorm) и ReLU: карты, которые видит классификатор
+    return F.relu(model.features[feature_split(model):](feature_maps))
+
+
+def classify(model, feature_maps: torch.Tensor) -> torch.Tensor:
+    # голова модели: от выхода FEATURE_LAYER до логитов
+    return model.classifier(F.adaptive_avg_pool2d(head_features(model, feature_maps), (1, 1)).flatten(1))
+
+
+def forward_with_features(model,
+                          tensor: torch.Tensor,
+                          requires_grad: bool = False):
+    """
+    Forward-проход, возвращающий вместе с логитами выход слоя FEATURE_LAYER
+    (до финальных BatchNorm и ReLU, чтобы градиенты Grad-CAM проходили через них).
+    В отличие от хуков, активации не сохраняются в модели, поэтому
+    параллельные вызовы на одной модели не мешают друг другу.
+    При requires_grad граф строится только от карт признаков до логитов.
+    Если к модели подключён бэкенд (см. backends.py), признаки считает он.
+    """
+    backend = getattr(model, "backend", None)
+    with torch.no_grad():
+        if backend is None:
+            feature_maps = model.features[:feature_split(model)](tensor)
+        else:
+            logits, feature_maps = backend(tensor)
+            if not requires_grad:
+                return logits, feature_maps
+    feature_maps.requires_grad_(requires_grad)
+
+    with torch.set_grad_enabled(requires_grad):
+        logits = classify(model, feature_maps)
+
+    return logits, feature_maps
+
+
+def compute_cams(members: list,
+                 feature_maps: list[torch.Tensor],
+                 classes: list[int],
+                 methods: list[CamMethod],
+                 target_sizes: list[tuple[int, int]],
+                 views: int = 1,
+                 input_size: tuple[int, int] = (224, 224),
+                 timings: dict[str, float] | None = None) -> list[np.ndarray]:
+    """
+    Карты для снимков по их картам признаков: feature_maps - по тензору на
+    модель ансамбля, виды каждого снимка идут подряд. Для i-го снимка карта
+    строится для класса classes[i] методом methods[i] и масштабируется до
+    target_sizes[i]. Градиенты считаются заново только от признаков до
+    логитов, поэтому ни forward-проход, ни сохранённый граф не нужны.
+    """
+    if timings is None:
+        timings = {}
+
+    def rows(selected: list[int]) -> list[int]:
+        # строки пачки со всеми видами выбранных снимков
+        return [i * views + v for i in selected for v in range(views)]
+
+    # примеры в пачке независимы (BatchNorm в режиме eval), поэтому градиент
+    # суммы оценок по каждому примеру совпадает с градиентом его собственной оценки
+    with_grad = [i for i, method in enumerate(methods) if method != CamMethod.CAM]
+    start = time.perf_counter()
+    if with_grad:
+        grad_rows = rows(with_grad)
+        grad_classes = [classes[i] for i in with_grad for _ in range(views)]
+        # копия превращает тензоры из inference_mode в обычные, от которых можно брать градиент
+        inputs = [fm.clone().requires_grad_() for fm in feature_maps]
+        with torch.enable_grad():
+            scores = sum(classify(member, x)[grad_rows, grad_classes].sum() for member, x in zip(members, inputs))
+            gradients = torch.autograd.grad(scores, inputs)
+        timings["backward"] = time.perf_counter() - start
+        start = time.perf_counter()
+
+    cams = [None] * len(classes)
+    with torch.no_grad():
+        for method in set(methods):
+            selected = [i for i, m in enumerate(methods) if m == method]
+            selected_rows = rows(selected)
+            member_cams = []
+            for m, member in enumerate(members):
+                if method == CamMethod.CAM:
+                    selected_classes = [classes[i] for i in selected for _ in range(views)]
+                    class_weights = member.classifier.weight.detach()[selected_classes]
+                    # CAM взвешивает те карты, которые видит классификатор
+                    member_cams.append(compute_cam(head_features(member, feature_maps[m][selected_rows]),
+                                                   class_weights))
+                elif method == CamMethod.GRADCAM:
+                    member_cams.append(compute_gradcam(feature_maps[m][selected_rows], gradients[m][selected_rows]))
+                else:
+                    member_cams.append(compute_gradcam_pp(feature_maps[m][selected_rows], gradients[m][selected_rows]))
+
+            batch_cam = member_cams[0]
+            if len(members) > 1:
+                batch_cam = normalize_cam(torch.stack(member_cams).mean(dim=0))
+            if views > 1:
+                batch_cam = merge_cams(batch_cam, views, input_size)
 
-    pred_idx = int(probs.argmax())
-    pred_class = CLASS_NAMES[pred_idx]
+            for i, cam in zip(selected, batch_cam):
+                cams[i] = resize_cam(cam, target_size=target_sizes[i]).cpu().numpy()
+    timings["cam"] = time.perf_counter() - start
+    return cams
 
-    if pred_class != Diagnosis.NORMAL:
-        score = logits[0, pred_idx]
-        score.backward()
 
-        feature_maps = hooks["denseblock4"].output
-        gradients    = hooks["denseblock4_grad"].grad
+def run_model_batch(imgs: list[GrayscaleImage],
+                    model,
+                    methods: list[CamMethod] | None = None,
+                    max_size: int | None = None,
+                    device: torch.device = DEVICE,
+                    timings: dict[str, float] | None = None,
+                    views: int = 1,
+                    on_forward: Callable[[list[tuple[Diagnosis, dict[Diagnosis, float]]]], None] | None = None,
+                    heatmaps: list[HeatmapMode] | None = None,
+                    features: dict[int, ImageFeatures] | None = None):
+    """
+    Прогоняет пачку снимков одним forward-проходом и строит карты для
+    патологий (compute_cams) выбранным для каждого снимка методом,
+    масштабируя их до размера снимка, вписанного в max_size.
+    С views > 1 каждый снимок прогоняется в нескольких видах (см. tta.py),
+    а с ансамблем (load_ensemble) - каждой моделью ансамбля; вероятности
+    и карты усредняются. Все виды идут в той же пачке.
+    heatmaps задаёт для каждого снимка, строить ли карту сразу (eager, по
+    умолчанию); для lazy вместо карты в features кладутся его признаки.
+    В timings, если он передан, записывается время этапов пачки в секундах.
+    on_forward получает диагнозы и вероятности сразу после forward-прохода,
+    до построения карт.
+    """
+    if methods is None:
+        methods = [CamMethod.GRADCAM] * len(imgs)
+    if heatmaps is None:
+        heatmaps = [HeatmapMode.EAGER] * len(imgs)
+    if timings is None:
+        timings = {}
+    members = [model, *getattr(model, "ensemble", [])]
+
+    start = time.perf_counter()
+    tensor = torch.stack([val_transform(img) for img in imgs]).to(device)
+    if views > 1:
+        tensor = make_views(tensor, views)
+    input_size = tuple(tensor.shape[-2:])
+    timings["transform"] = time.perf_counter() - start
 
-        cam = compute_gradcam(feature_maps, gradients)
+    # градиенты нужны только от признаков до логитов, их считает compute_cams,
+    # поэтому сам forward-проход обходится без autograd
+    with torch.inference_mode():
+        start = time.perf_counter()
+        outputs = [forward_with_features(member, tensor) for member in members]
+        probs = torch.stack([F.softmax(logits, dim=1) for logits, _ in outputs])
+        # среднее по моделям ансамбля и по видам каждого снимка
+        probs = probs.mean(dim=0).unflatten(0, (len(imgs), views)).mean(dim=1)
+        pred_idx = probs.argmax(dim=1).tolist()
+        predictions = [(CLASS_NAMES[idx], dict(zip(CLASS_NAMES, p.tolist()))) for idx, p in zip(pred_idx, probs)]
+        timings["forward"] = time.perf_counter() - start
+    if on_forward is not None:
+        on_forward(predictions)
 
-        cam_resized = resize_cam(cam, target_size=img.shape)
-        cam_np = cam_resized.detach().cpu().numpy()
+    feature_maps = [fm for _, fm in outputs]
+    if features is not None:
+        for i, mode in enumerate(heatmaps):
+            if mode == HeatmapMode.LAZY:
+                # копия, чтобы запись не держала в памяти признаки всей пачки
+                features[i] = ImageFeatures(
+                    [fm[i * views:(i + 1) * views].clone() for fm in feature_maps], input_size, views,
+                )
 
-        return pred_class, class_probs, cam_np
-    return pred_class, class_probs, None
+    pathological = [i for i, idx in enumerate(pred_idx)
+                    if CLASS_NAMES[idx] != Diagnosis.NORMAL and heatmaps[i] == HeatmapMode.EAGER]
+    cams = {}
+    if pathological:
+        if len(pathological) < len(imgs):
+            selected_rows = [i * views + v for i in pathological for v in range(views)]
+            feature_maps = [fm[selected_rows] for fm in feature_maps]
+        batch_cams = compute_cams(
+            members, feature_maps,
+            [pred_idx[i] for i in pathological],
+            [methods[i] for i in pathological],
+            [fit_shape(imgs[i].shape, max_size) for i in pathological],
+            views, input_size, timings,
+        )
+        cams = dict(zip(pathological, batch_cams))
 
+    return [(pred, probs, cams.get(i)) for i, (pred, probs) in enumerate(predictions)]
+
+
+def cam_from_features(model,
+                      features: ImageFeatures,
+                      diagnosis: Diagnosis,
+                      method: CamMethod = CamMethod.GRADCAM,
+                      target_size: tuple[int, int] = (224, 224),
+                      timings: dict[str, float] | None = None) -> np.ndarray:
+    """
+    Карта для любого класса по признакам, сохранённым run_model_batch.
+    Модель должна быть той же, что посчитала признаки.
+    """
+    members = [model, *getattr(model, "ensemble", [])]
+    return compute_cams(
+        members, features.feature_maps, [CLASS_NAMES.index(diagnosis)], [method], [target_size],
+        features.views, features.input_size, timings,
+    )[0]
+
+
+def run_model_with_features(img: GrayscaleImage,
+                                model,
+                                method: CamMethod = CamMethod.GRADCAM,
+                                max_size: int | None = None,
+                                device: torch.device = DEVICE,
+                                views: int = 1):
+    return run_model_batch([img], model, [method], max_size, device, views=views)[0]
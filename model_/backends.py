@@ -0,0 +1,200 @@
+import copy
+import logging
+import os
+import tempfile
+from collections.abc import Iterable
+from typing import NamedTuple
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from image import GrayscaleImage
+from schemas import CpuOptimization, InferenceBackend
+from .image_transfroms import val_transform
+
+logger = logging.getLogger(__name__)
+
+
+FEATURE_LAYER = "denseblock4"
+
+
+def feature_split(model) -> int:
+    # индекс в model.features сразу после FEATURE_LAYER
+    return list(model.features._modules).index(FEATURE_LAYER) + 1
+
+
+class FeaturesModel(nn.Module):
+    """
+    Граф для экспорта: возвращает логиты и выход denseblock4 (до финальных
+    BatchNorm и ReLU) вторым выходом, как forward_with_features.
+    """
+    def __init__(self, model):
+        super().__init__()
+        split = feature_split(model)
+        self.body = model.features[:split]
+        self.head = model.features[split:]
+        self.classifier = model.classifier
+
+    def forward(self, x: torch.Tensor):
+        feature_maps = self.body(x)
+        out = F.adaptive_avg_pool2d(F.relu(self.head(feature_maps)), (1, 1)).flatten(1)
+        return self.classifier(out), feature_maps
+
+
+def example_input(batch_size: int = 2) -> torch.Tensor:
+    return torch.zeros(batch_size, 1, 224, 224)
+
+
+def export_torchscript(model, path: str):
+    with torch.no_grad():
+        traced = torch.jit.trace(FeaturesModel(model).eval(), example_input())
+    torch.jit.save(torch.jit.freeze(traced), path)
+
+
+def export_onnx(model, path: str, quantize: bool = False):
+    """
+    Экспортирует модель в ONNX с динамическим размером пачки. С quantize
+    веса свёрток и классификатора динамически квантуются в INT8.
+    """
+    with torch.no_grad():
+        torch.onnx.export(
+            FeaturesModel(model).eval(),
+            (example_input(),),
+            path,
+            input_names=["image"],
+            output_names=["logits", "features"],
+            dynamic_axes={name: {0: "batch"} for name in ["image", "logits", "features"]},
+            dynamo=False,
+        )
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        quantize_dynamic(path, path, weight_type=QuantType.QUInt8)
+
+
+class TorchScriptRunner:
+    def __init__(self, path: str):
+        self.module = torch.jit.optimize_for_inference(torch.jit.load(path, map_location="cpu"))
+
+    def __call__(self, tensor: torch.Tensor):
+        logits, feature_maps = self.module(tensor.cpu())
+        return logits.to(tensor.device), feature_maps.to(tensor.device)
+
+
+class OnnxRunner:
+    def __init__(self, path: str):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = torch.get_num_threads()
+        self.session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+
+    def __call__(self, tensor: torch.Tensor):
+        logits, feature_maps = self.session.run(None, {"image": tensor.cpu().numpy()})
+        return (torch.from_numpy(logits).to(tensor.device),
+                torch.from_numpy(feature_maps).to(tensor.device))
+
+
+def bf16_supported() -> bool:
+    # без AVX512-BF16 или AMX bfloat16 на CPU только эмулируется и медленнее float32
+    return torch.backends.mkldnn.is_available() and torch.ops.mkldnn._is_mkldnn_bf16_supported()
+
+
+class EagerRunner:
+    """
+    Eager-модель с оптимизациями для CPU: веса и входы в формате channels_last,
+    свёртки в bfloat16 под autocast и граф, скомпилированный torch.compile.
+    Признаки возвращаются в float32, так что голова и Grad-CAM считаются
+    как без оптимизаций. Компиляция происходит при первых вызовах, поэтому
+    модель нужно прогреть до приёма запросов.
+    Для channels_last веса копируются: общая модель (и её отображённые
+    в память веса, которые делят воркеры) не меняется, но каждый процесс
+    держит свою копию весов.
+    """
+    def __init__(self, model, optimizations: set[CpuOptimization]):
+        module = FeaturesModel(model).eval()
+        self.channels_last = CpuOptimization.CHANNELS_LAST in optimizations
+        if self.channels_last:
+            module = copy.deepcopy(module).to(memory_format=torch.channels_last)
+        self.bf16 = CpuOptimization.BF16 in optimizations
+        if self.bf16 and not bf16_supported():
+            logger.warning("CPU does not support bfloat16, running the model in float32")
+            self.bf16 = False
+        if CpuOptimization.COMPILE in optimizations:
+            # с dynamic размер пачки не вызывает перекомпиляцию
+            module = torch.compile(module, dynamic=True)
+        self.module = module
+
+    def __call__(self, tensor: torch.Tensor):
+        if self.channels_last:
+            tensor = tensor.contiguous(memory_format=torch.channels_last)
+        with torch.autocast(tensor.device.type, dtype=torch.bfloat16, enabled=self.bf16):
+            logits, feature_maps = self.module(tensor)
+        return logits.float(), feature_maps.float()
+
+
+def attach_backend(model,
+                   backend: InferenceBackend,
+                   cache_dir: str | None = None,
+                   key: str = "",
+                   optimizations: Iterable[CpuOptimization] = ()):
+    """
+    Экспортирует модель и подключает выбранный бэкенд: forward_with_features
+    берёт из него логиты и карты признаков, а классификатор для Grad-CAM
+    по-прежнему считается в PyTorch. Бэкенды работают на CPU.
+    Если задан cache_dir, экспорт сохраняется там под именем из key
+    (например, хэша весов) и при следующих запусках не повторяется.
+    optimizations (см. EagerRunner) применимы только к eager-бэкенду.
+    """
+    model.backend = None
+    optimizations = set(optimizations)
+    if backend == InferenceBackend.EAGER:
+        if optimizations:
+            model.backend = EagerRunner(model, optimizations)
+        return model
+    if optimizations:
+        raise ValueError(f"CPU optimizations are not supported by the {backend} backend")
+
+    ext = "pt" if backend == InferenceBackend.TORCHSCRIPT else "onnx"
+    # слой признаков в имени: экспорт с другим вторым выходом не подхватится
+    name = f"{key}-{FEATURE_LAYER}-{backend}.{ext}" if key else f"{backend}.{ext}"
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(cache_dir or tmp, name)
+        if not os.path.exists(path):
+            # экспорт пишется во временный файл, чтобы в кэше не оказался недописанный
+            partial = f"{path}.{os.getpid()}.tmp"
+            if backend == InferenceBackend.TORCHSCRIPT:
+                export_torchscript(model, partial)
+            else:
+                export_onnx(model, partial, quantize=backend == InferenceBackend.ONNX_INT8)
+            os.replace(partial, path)
+
+        if backend == InferenceBackend.TORCHSCRIPT:
+            model.backend = TorchScriptRunner(path)
+        else:
+            model.backend = OnnxRunner(path)
+    return model
+
+
+class Parity(NamedTuple):
+    max_logit_diff: float
+    max_feature_diff: float
+    agreement: float
+
+
+def check_parity(model, imgs: list[GrayscaleImage]) -> Parity:
+    """
+    Сравнивает выходы подключённого бэкенда с eager-моделью на одних снимках:
+    наибольшие расхождения логитов и карт признаков и долю совпавших диагнозов.
+    """
+    tensor = torch.stack([val_transform(img) for img in imgs]).to(next(model.parameters()).device)
+    with torch.inference_mode():
+        logits, feature_maps = FeaturesModel(model)(tensor)
+        backend_logits, backend_feature_maps = model.backend(tensor)
+
+    return Parity(
+        max_logit_diff=(logits - backend_logits).abs().max().item(),
+        max_feature_diff=(feature_maps - backend_feature_maps).abs().max().item(),
+        agreement=(logits.argmax(1) == backend_logits.argmax(1)).float().mean().item(),
+    )
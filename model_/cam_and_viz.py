@@ -1,24 +1,60 @@
 import torch
 import torch.nn.functional as F
-import matplotlib.pyplot as plt
 import numpy as np
 from PIL import Image
 
 
+def normalize_cam(cam: torch.Tensor):
+    """
+    Отсекает отрицательные значения и нормирует каждую карту пачки к [0, 1].
+    """
+    cam = F.relu(cam)
+
+    cam_max = cam.amax(dim=(1, 2), keepdim=True)
+    cam = cam / cam_max.clamp_min(torch.finfo(cam.dtype).tiny)
+
+    return cam
+
+
+def compute_cam(feature_maps: torch.Tensor,
+                class_weights: torch.Tensor):
+    """
+    Классический CAM: взвешивает карты признаков весами линейного
+    классификатора для предсказанного класса. Не требует backward-прохода.
+    """
+    cam = (class_weights[:, :, None, None] * feature_maps).sum(dim=1)
+    return normalize_cam(cam)
+
+
 def compute_gradcam(feature_maps: torch.Tensor,
                     gradients: torch.Tensor):
-    
-    weights = gradients.mean(dim=(0, 2, 3))
+    """
+    Grad-CAM для пачки: возвращает карту (N, H, W), по одной на пример.
+    """
+    weights = gradients.mean(dim=(2, 3))
 
-    cam = (weights[None, :, None, None] * feature_maps).sum(dim=1)
-    cam = cam.squeeze(0)
+    cam = (weights[:, :, None, None] * feature_maps).sum(dim=1)
+    return normalize_cam(cam)
 
-    cam = F.relu(cam)
 
-    if cam.max() > 0:
-        cam = cam / cam.max()
+def compute_gradcam_pp(feature_maps: torch.Tensor,
+                       gradients: torch.Tensor):
+    """
+    Grad-CAM++: веса каналов учитывают вклад каждой позиции карты,
+    а не только средний градиент.
+    """
+    grads_2 = gradients ** 2
+    grads_3 = grads_2 * gradients
+    sum_activations = feature_maps.sum(dim=(2, 3), keepdim=True)
+
+    denominator = 2 * grads_2 + sum_activations * grads_3
+    denominator = torch.where(denominator != 0, denominator, torch.ones_like(denominator))
+    alpha = grads_2 / denominator
 
-    return cam
+    weights = (alpha * F.relu(gradients)).sum(dim=(2, 3))
+
+    cam = (weights[:, :, None, None] * feature_maps).sum(dim=1)
+    return normalize_cam(cam)
 
 
 def resize_cam(cam: torch.Tensor, target_size: tuple[int, int]):
@@ -39,7 +75,9 @@ def show_imgs(image_path: str,
                  cam_resized: torch.Tensor,
                  pred_class: str,
                  alpha: float = 0.4):
-    
+    # matplotlib нужен только для отладки, сервер его не загружает
+    import matplotlib.pyplot as plt
+
     img = Image.open(image_path).convert("RGB")
     img_np = np.array(img)
 
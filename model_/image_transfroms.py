@@ -1,7 +1,17 @@
+import torch
 from torchvision.transforms import transforms
 
+from image import GrayscaleImage
+
+
+def to_tensor(img: GrayscaleImage) -> torch.Tensor:
+    # то же, что transforms.ToTensor для uint8, но без промежуточных копий:
+    # from_numpy разделяет память с массивом, а деление выполняется на месте
+    return torch.from_numpy(img).unsqueeze(0).to(torch.float32).div_(255)
+
+
 val_transform = transforms.Compose([
-    transforms.ToTensor(),
+    to_tensor,
     transforms.Resize((224, 224)),
     transforms.Normalize(mean=[0.5],
                          std=[0.5]),
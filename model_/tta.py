@@ -0,0 +1,67 @@
+import torch
+import torch.nn.functional as F
+
+from .cam_and_viz import normalize_cam
+
+# виды для test-time augmentation: (отражение по горизонтали, доля центральной вырезки);
+# первый вид - сам снимок, остальные добавляются по порядку
+VIEWS = [
+    (False, 1.0),
+    (True, 1.0),
+    (False, 0.9),
+    (True, 0.9),
+    (False, 0.8),
+    (True, 0.8),
+    (False, 0.7),
+    (True, 0.7),
+]
+
+
+def _crop_size(size: int, scale: float) -> int:
+    return max(1, round(size * scale))
+
+
+def make_views(tensor: torch.Tensor, count: int) -> torch.Tensor:
+    """
+    Пачка (N, C, H, W) -> (N * count, C, H, W): виды одного снимка идут подряд.
+    Вырезка растягивается обратно до H x W, как будто снимок приблизили.
+    """
+    if not 1 <= count <= len(VIEWS):
+        raise ValueError(f"View count must be between 1 and {len(VIEWS)}, got {count}")
+
+    height, width = tensor.shape[-2:]
+    views = []
+    for flip, scale in VIEWS[:count]:
+        view = tensor
+        if scale != 1.0:
+            crop_h, crop_w = _crop_size(height, scale), _crop_size(width, scale)
+            top, left = (height - crop_h) // 2, (width - crop_w) // 2
+            view = F.interpolate(view[..., top:top + crop_h, left:left + crop_w],
+                                 size=(height, width), mode="bilinear", align_corners=False)
+        if flip:
+            view = view.flip(-1)
+        views.append(view)
+    return torch.stack(views, dim=1).flatten(0, 1)
+
+
+def merge_cams(cams: torch.Tensor, count: int, size: tuple[int, int]) -> torch.Tensor:
+    """
+    Карты видов (N * count, h, w) -> (N, *size): каждая карта возвращается
+    в кадр исходного снимка (отражается обратно и уменьшается до своей вырезки),
+    и карты усредняются по тем видам, которые покрывают каждую точку.
+    """
+    height, width = size
+    cams = cams.unflatten(0, (-1, count))
+    total = cams.new_zeros(cams.shape[0], height, width)
+    coverage = cams.new_zeros(1, height, width)
+    for i, (flip, scale) in enumerate(VIEWS[:count]):
+        crop_h, crop_w = _crop_size(height, scale), _crop_size(width, scale)
+        top, left = (height - crop_h) // 2, (width - crop_w) // 2
+        cam = F.interpolate(cams[:, i, None], size=(crop_h, crop_w),
+                            mode="bilinear", align_corners=False)[:, 0]
+        if flip:
+            cam = cam.flip(-1)
+        total[:, top:top + crop_h, left:left + crop_w] += cam
+        coverage[:, top:top + crop_h, left:left + crop_w] += 1
+    # первый вид покрывает весь кадр, так что деления на ноль нет
+    return normalize_cam(total / coverage)
@@ -0,0 +1,628 @@
+import asyncio
+import cProfile
+import math
+import os
+import random
+import time
+import uuid
+from collections.abc import AsyncIterator, Callable, Iterable, Iterator
+from concurrent.futures import ALL_COMPLETED, FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from io import BytesIO
+from typing import NamedTuple
+
+import numpy as np
+import torch
+from fastapi import HTTPException, UploadFile
+
+from archive import DamagedUpload
+from image import MAX_SIZE, IMAGE_MIME_TYPES, GrayscaleImage, process_image, prepare_image, image_size, encode_image
+from heatmap import apply_threshold, render_heatmap, render_layer, dense_to_sparse, encode_heatmap, extract_regions
+from schemas import (
+    AnalysisEvent, AnalysisResult, BatchItem, CamMethod, Diagnosis, HeatmapImage, HeatmapMode, HeatmapResult, ImageFormat,
+    OverlayMode, PointsFormat, StreamEvent,
+)
+from batching import BatchScheduler, QueueFull
+from cache import LRUCache, ResultCache, generate_image_hash, make_cache_key
+from metrics import FIRST_RESULT_SECONDS, QUEUE_DEPTH, REJECTED, StageTimer
+from registry import ModelRegistry, ModelVersion, new_version
+from model_.arch_model import ImageFeatures, cam_from_features, run_model_batch, DEVICE
+
+class Pending(NamedTuple):
+    key: str
+    img: GrayscaleImage[int, int]
+    dimensions: tuple[int, int]
+    points: PointsFormat
+    image_format: ImageFormat
+    overlay: OverlayMode
+    heatmap: HeatmapMode
+    regions: bool
+    version: ModelVersion
+    # диагноз и вероятности сразу после forward-прохода, до карты
+    early: Future
+    future: Future
+    start_time: float
+    submitted_at: float
+    timer: StageTimer
+
+class FeatureEntry(NamedTuple):
+    # всё, что нужно, чтобы построить карту для heatmap=lazy позже
+    version: ModelVersion
+    features: ImageFeatures
+    img: GrayscaleImage[int, int]
+    dimensions: tuple[int, int]
+    diagnosis: Diagnosis
+
+    @property
+    def nbytes(self) -> int:
+        return self.features.nbytes + self.img.nbytes
+
+def overloaded(retry_after: float) -> HTTPException:
+    REJECTED.inc()
+    return HTTPException(
+        503, 'Server is overloaded', headers={'Retry-After': str(max(1, math.ceil(retry_after)))},
+    )
+
+class AnalysisPipeline:
+    """
+    Этапы анализа снимка: декодирование, поиск в кэше, модель через
+    планировщик пачек и построение тепловой карты.
+    Асинхронный analyze_async выполняет декодирование и отрисовку в своих
+    пулах потоков, а модель в потоке планировщика, не занимая event loop.
+    Версии модели хранит registry: переданная модель - начальная активная.
+    Признаки снимков с heatmap=lazy хранятся в features не больше
+    feature_cache_bytes байт и feature_cache_ttl секунд.
+    """
+    def __init__(
+        self,
+        model,
+        model_hash: str,
+        cache: ResultCache,
+        max_batch_size: int = 8,
+        max_wait_ms: float = 5.0,
+        max_size: int | None = None,
+        grid_size: int = 64,
+        max_queue_depth: int | None = None,
+        decode_threads: int = 2,
+        render_threads: int = 2,
+        profile_rate: float = 0.0,
+        profile_dir: str = 'profiles',
+        image_format: ImageFormat = ImageFormat.PNG,
+        image_quality: int = 85,
+        png_compress_level: int = 6,
+        layer_size: int = 256,
+        views: int = 1,
+        version: str = 'default',
+        feature_cache_bytes: int = 256 * 1024 * 1024,
+        feature_cache_ttl: float | None = 5 * 60,
+    ):
+        self.registry = ModelRegistry(new_version(version, model, model_hash))
+        self.cache = cache
+        self.max_size = max_size
+        self.grid_size = grid_size
+        self.scheduler = BatchScheduler(self._run_batch, max_batch_size, max_wait_ms, max_queue_depth)
+        self.decode_executor = ThreadPoolExecutor(decode_threads, thread_name_prefix='decode')
+        self.render_executor = ThreadPoolExecutor(render_threads, thread_name_prefix='render')
+        self.profile_rate = profile_rate
+        self.profile_dir = profile_dir
+        self.image_format = image_format
+        self.image_quality = image_quality
+        self.png_compress_level = png_compress_level
+        self.layer_size = layer_size
+        self.views = views
+        # запись не меньше байта, так что число записей ограничено размером
+        self.features: LRUCache[str, FeatureEntry] = LRUCache(
+            feature_cache_bytes, feature_cache_bytes, feature_cache_ttl, sizeof=lambda entry: entry.nbytes,
+        )
+
+    def _run_batch(self, items: list[tuple[GrayscaleImage, CamMethod, ModelVersion, Future, HeatmapMode]]):
+        """
+        Прогоняет пачку, группируя снимки по версии модели: во время
+        переключения в одной пачке могут оказаться старая и новая версии.
+        Диагнозы отдаются в early-future каждого снимка сразу после forward.
+        Для heatmap=lazy вместе с результатом возвращаются признаки снимка.
+        """
+        started = time.perf_counter()
+        groups: dict[int, list[int]] = {}
+        for i, (_, _, version, _, _) in enumerate(items):
+            groups.setdefault(id(version.model), []).append(i)
+
+        results = [None] * len(items)
+        try:
+            for indices in groups.values():
+                imgs = [items[i][0] for i in indices]
+                methods = [items[i][1] for i in indices]
+                heatmaps = [items[i][4] for i in indices]
+                timings: dict[str, float] = {}
+                features: dict[int, ImageFeatures] = {}
+
+                def on_forward(predictions, indices=indices):
+                    for i, prediction in zip(indices, predictions):
+                        items[i][3].set_result(prediction)
+
+                outputs = run_model_batch(
+                    imgs, items[indices[0]][2].model, methods, self.max_size,
+                    timings=timings, views=self.views, on_forward=on_forward,
+                    heatmaps=heatmaps, features=features,
+                )
+                for j, (i, output) in enumerate(zip(indices, outputs)):
+                    results[i] = (output, timings, started, features.get(j))
+        except Exception as e:
+            for item in items:
+                if not item[3].done():
+                    item[3].set_exception(e)
+            raise
+        return results
+
+    def warmup(self, model, batch_size: int | None = None) -> None:
+        """
+        Прогоняет модель на случайных снимках по одному и полной пачкой,
+        чтобы первые запросы не платили за ленивую инициализацию.
+        """
+        img = np.random.default_rng(0).integers(0, 256, size=(512, 512), dtype=np.uint8)
+        for size in sorted({1, batch_size or self.scheduler.max_batch_size}):
+            run_model_batch([img] * size, model, [CamMethod.GRADCAM] * size, self.max_size, views=self.views)
+
+    def load_version(
+        self,
+        name: str,
+        build: Callable[[], tuple[object, str]],
+        activate: bool = False,
+    ) -> Future[ModelVersion]:
+        """
+        Загружает и прогревает версию в фоне; build возвращает модель и хэш её весов.
+        """
+        def load() -> ModelVersion:
+            model, model_hash = build()
+            self.warmup(model)
+            return new_version(name, model, model_hash)
+
+        return self.registry.load(name, load, activate)
+
+    def check_admission(self):
+        if self.scheduler.full():
+            raise overloaded(self.scheduler.retry_after())
+
+    def submit(
+        self,
+        image: UploadFile,
+        cam: CamMethod,
+        points: PointsFormat,
+        admit: bool = True,
+        timer: StageTimer | None = None,
+        inline: bool = False,
+        image_format: ImageFormat | None = None,
+        overlay: OverlayMode = OverlayMode.BLEND,
+        version: str | None = None,
+        heatmap: HeatmapMode = HeatmapMode.EAGER,
+        regions: bool = False,
+    ) -> AnalysisResult | Pending:
+        """
+        Декодирует снимок и ставит его в очередь модели или возвращает
+        результат из кэша. С inline модель выполняется сразу в этом потоке.
+        version выбирает загруженную версию модели вместо активной.
+        """
+        start_time = time.time()
+        timer = timer or StageTimer()
+        image_format = image_format or self.image_format
+        try:
+            model_version = self.registry.get(version)
+        except KeyError:
+            raise HTTPException(404, f'Unknown model version: {version}')
+        if overlay == OverlayMode.LAYER and image_format == ImageFormat.JPEG:
+            raise HTTPException(400, 'JPEG has no transparency, use png or webp for the heatmap layer')
+        if admit:
+            # отклоняем до декодирования, чтобы не тратить на запрос время
+            self.check_admission()
+
+        with timer.stage('decode'):
+            im = process_image(image)
+            dimensions = image_size(im)
+        with timer.stage('cache'):
+            key = make_cache_key(
+                generate_image_hash(image), model_version.model_hash, self.views, cam, points, self.max_size, self.grid_size,
+                image_format, self.image_quality, self.png_compress_level, overlay, self.layer_size, heatmap, regions,
+            )
+            # с lazy ключ служит идентификатором результата, и готовый результат
+            # годится, только пока признаки для его карты ещё хранятся
+            if heatmap == HeatmapMode.LAZY and self.features.get(key) is None:
+                cached = None
+            else:
+                cached = self.cache.get(key)
+        if cached is not None:
+            result = AnalysisResult.model_validate_json(cached)
+            result.processing_time = time.time() - start_time
+            result.model_version = model_version.name
+            result.stage_times = timer.times
+            timer.observe(result.diagnosis, result.processing_device, result.processing_time, cached=True)
+            return result
+
+        with timer.stage('prepare'):
+            img = prepare_image(im, self.max_size)
+
+        submitted_at = time.perf_counter()
+        early = Future()
+        if inline:
+            future = Future()
+            future.set_result(self._run_batch([(img, cam, model_version, early, heatmap)])[0])
+        else:
+            try:
+                future = self.scheduler.submit((img, cam, model_version, early, heatmap), admit)
+            except QueueFull as e:
+                raise overloaded(e.retry_after)
+            QUEUE_DEPTH.set(self.scheduler.depth)
+        return Pending(
+            key, img, dimensions, points, image_format, overlay, heatmap, regions, model_version, early, future,
+            start_time, submitted_at, timer,
+        )
+
+    def finish(self, pending: Pending) -> AnalysisResult:
+        for event, value in self.finish_steps(pending):
+            if event == StreamEvent.DONE:
+                return value
+        raise AssertionError('finish_steps ended without a result')
+
+    def finish_steps(self, pending: Pending) -> Iterator[tuple[StreamEvent, object]]:
+        """
+        Достраивает результат после модели по шагам: изображение карты,
+        её точки и области (если карта есть) и, последним, готовый AnalysisResult.
+        """
+        (pred, probs, cam_map), timings, started, features = pending.future.result()
+        QUEUE_DEPTH.set(self.scheduler.depth)
+        timer = pending.timer
+        timer.add('queue', started - pending.submitted_at)
+        timer.times.update(timings)
+        parts = {}
+        if cam_map is not None:
+            for event, value in self.render_steps(
+                cam_map, pending.img, pending.dimensions, pending.points, pending.image_format, pending.overlay,
+                pending.regions, timer,
+            ):
+                parts[event] = value
+                yield event, value
+
+        result_id = None
+        if features is not None:
+            result_id = pending.key
+            self.features.put(result_id, FeatureEntry(pending.version, features, pending.img, pending.dimensions, pred))
+
+        result = AnalysisResult(
+            diagnosis=pred,
+            probabilities=probs,
+            heatmap_image=parts.get(StreamEvent.HEATMAP_IMAGE),
+            heatmap_points=parts.get(StreamEvent.HEATMAP_POINTS),
+            heatmap_regions=parts.get(StreamEvent.HEATMAP_REGIONS),
+            base_model_name=pending.version.model.weights,
+            model_version=pending.version.name,
+            processing_time=time.time() - pending.start_time,
+            processing_device=DEVICE.type,
+            result_id=result_id,
+        )
+        with timer.stage('cache'):
+            self.cache.put(pending.key, result.model_dump_json())
+        result.stage_times = timer.times
+        timer.observe(pred, DEVICE.type, time.time() - pending.start_time)
+        yield StreamEvent.DONE, result
+
+    def render_steps(
+        self,
+        cam_map: np.ndarray,
+        img: GrayscaleImage,
+        dimensions: tuple[int, int],
+        points: PointsFormat,
+        image_format: ImageFormat,
+        overlay: OverlayMode,
+        regions: bool,
+        timer: StageTimer,
+    ) -> Iterator[tuple[StreamEvent, object]]:
+        # изображение карты, затем её точки и, если нужно, области
+        with timer.stage('render'):
+            heatmap = apply_threshold(cam_map)
+            if overlay == OverlayMode.LAYER:
+                rendered = render_layer(heatmap, self.layer_size)
+            else:
+                rendered = render_heatmap(img, heatmap)
+        with timer.stage('encode'):
+            b64 = encode_image(rendered, image_format, self.image_quality, self.png_compress_level)
+        yield StreamEvent.HEATMAP_IMAGE, HeatmapImage(
+            base64=b64,
+            mime=IMAGE_MIME_TYPES[image_format],
+            dimensions=dimensions,
+        )
+        with timer.stage('points'):
+            if points == PointsFormat.LIST:
+                heatmap_points = dense_to_sparse(heatmap, dimensions)
+            else:
+                heatmap_points = encode_heatmap(heatmap, points, self.grid_size, dimensions)
+        yield StreamEvent.HEATMAP_POINTS, heatmap_points
+        if regions:
+            with timer.stage('regions'):
+                heatmap_regions = extract_regions(heatmap, dimensions)
+            yield StreamEvent.HEATMAP_REGIONS, heatmap_regions
+
+    def heatmap(
+        self,
+        result_id: str,
+        diagnosis: Diagnosis | None,
+        cam: CamMethod,
+        points: PointsFormat,
+        image_format: ImageFormat | None = None,
+        overlay: OverlayMode = OverlayMode.BLEND,
+        regions: bool = False,
+    ) -> HeatmapResult:
+        """
+        Карта для результата, полученного с heatmap=lazy, по сохранённым
+        признакам: для класса diagnosis (по умолчанию предсказанного) без
+        повторного forward-прохода.
+        """
+        start_time = time.time()
+        image_format = image_format or self.image_format
+        if overlay == OverlayMode.LAYER and image_format == ImageFormat.JPEG:
+            raise HTTPException(400, 'JPEG has no transparency, use png or webp for the heatmap layer')
+        entry = self.features.get(result_id)
+        if entry is None:
+            raise HTTPException(404, 'Result not found or expired, analyze the image again with heatmap=lazy')
+        diagnosis = diagnosis or entry.diagnosis
+
+        timer = StageTimer()
+        timings: dict[str, float] = {}
+        cam_map = cam_from_features(entry.version.model, entry.features, diagnosis, cam, entry.img.shape, timings)
+        timer.times.update(timings)
+        steps = dict(self.render_steps(
+            cam_map, entry.img, entry.dimensions, points, image_format, overlay, regions, timer,
+        ))
+        return HeatmapResult(
+            result_id=result_id,
+            diagnosis=diagnosis,
+            heatmap_image=steps[StreamEvent.HEATMAP_IMAGE],
+            heatmap_points=steps[StreamEvent.HEATMAP_POINTS],
+            heatmap_regions=steps.get(StreamEvent.HEATMAP_REGIONS),
+            processing_time=time.time() - start_time,
+            stage_times=timer.times,
+        )
+
+    async def heatmap_async(
+        self,
+        result_id: str,
+        diagnosis: Diagnosis | None,
+        cam: CamMethod,
+        points: PointsFormat,
+        image_format: ImageFormat | None = None,
+        overlay: OverlayMode = OverlayMode.BLEND,
+        regions: bool = False,
+    ) -> HeatmapResult:
+        return await asyncio.get_running_loop().run_in_executor(
+            self.render_executor, self.heatmap, result_id, diagnosis, cam, points, image_format, overlay, regions,
+        )
+
+    def analyze(
+        self,
+        image: UploadFile,
+        cam: CamMethod,
+        points: PointsFormat,
+        inline: bool = False,
+        image_format: ImageFormat | None = None,
+        overlay: OverlayMode = OverlayMode.BLEND,
+        version: str | None = None,
+        heatmap: HeatmapMode = HeatmapMode.EAGER,
+        regions: bool = False,
+    ) -> AnalysisResult:
+        submitted = self.submit(
+            image, cam, points, inline=inline, image_format=image_format, overlay=overlay, version=version,
+            heatmap=heatmap, regions=regions,
+        )
+        if isinstance(submitted, AnalysisResult):
+            return submitted
+        return self.finish(submitted)
+
+    def analyze_profiled(
+        self,
+        image: UploadFile,
+        cam: CamMethod,
+        points: PointsFormat,
+        image_format: ImageFormat | None = None,
+        overlay: OverlayMode = OverlayMode.BLEND,
+        version: str | None = None,
+        heatmap: HeatmapMode = HeatmapMode.EAGER,
+        regions: bool = False,
+    ) -> AnalysisResult:
+        """
+        Анализирует снимок целиком в текущем потоке, минуя планировщик пачек,
+        под cProfile и профайлером PyTorch и сохраняет оба профиля
+        (.prof и трассу .json для chrome://tracing) в profile_dir.
+        """
+        os.makedirs(self.profile_dir, exist_ok=True)
+        path = os.path.join(self.profile_dir, f'{time.strftime("%Y%m%d-%H%M%S")}-{uuid.uuid4().hex[:8]}')
+
+        profiler = cProfile.Profile()
+        with torch.profiler.profile(activities=[torch.profiler.ProfilerActivity.CPU]) as torch_profiler:
+            with profiler:
+                result = self.analyze(
+                    image, cam, points, inline=True, image_format=image_format, overlay=overlay, version=version,
+                    heatmap=heatmap, regions=regions,
+                )
+        profiler.dump_stats(path + '.prof')
+        torch_profiler.export_chrome_trace(path + '.json')
+        return result
+
+    async def analyze_async(
+        self,
+        image: UploadFile,
+        cam: CamMethod,
+        points: PointsFormat,
+        image_format: ImageFormat | None = None,
+        overlay: OverlayMode = OverlayMode.BLEND,
+        version: str | None = None,
+        heatmap: HeatmapMode = HeatmapMode.EAGER,
+        regions: bool = False,
+    ) -> AnalysisResult:
+        upload, timer = await self._read(image)
+        loop = asyncio.get_running_loop()
+        if self.profile_rate and random.random() < self.profile_rate:
+            return await loop.run_in_executor(
+                self.render_executor, self.analyze_profiled, upload, cam, points, image_format, overlay, version, heatmap,
+                regions,
+            )
+
+        submitted = await loop.run_in_executor(
+            self.decode_executor,
+            lambda: self.submit(
+                upload, cam, points, timer=timer, image_format=image_format, overlay=overlay, version=version,
+                heatmap=heatmap, regions=regions,
+            ),
+        )
+        if isinstance(submitted, AnalysisResult):
+            return submitted
+        await asyncio.wrap_future(submitted.future)
+        return await loop.run_in_executor(self.render_executor, self.finish, submitted)
+
+    async def analyze_stream(
+        self,
+        image: UploadFile,
+        cam: CamMethod,
+        points: PointsFormat,
+        image_format: ImageFormat | None = None,
+        overlay: OverlayMode = OverlayMode.BLEND,
+        version: str | None = None,
+        heatmap: HeatmapMode = HeatmapMode.EAGER,
+        regions: bool = False,
+    ) -> AsyncIterator[AnalysisEvent]:
+        """
+        Как analyze_async, но результат приходит частями: диагноз сразу
+        после forward-прохода, затем изображение и точки карты. Ошибки до
+        постановки в очередь выбрасываются здесь, а не из итератора.
+        """
+        upload, timer = await self._read(image)
+        submitted = await asyncio.get_running_loop().run_in_executor(
+            self.decode_executor,
+            lambda: self.submit(
+                upload, cam, points, timer=timer, image_format=image_format, overlay=overlay, version=version,
+                heatmap=heatmap, regions=regions,
+            ),
+        )
+        return self._events(submitted)
+
+    async def _events(self, submitted: AnalysisResult | Pending) -> AsyncIterator[AnalysisEvent]:
+        if isinstance(submitted, AnalysisResult):
+            for event in result_events(submitted):
+                yield event
+            return
+
+        pred, probs = await asyncio.wrap_future(submitted.early)
+        first = time.time() - submitted.start_time
+        FIRST_RESULT_SECONDS.labels(pred, DEVICE.type).observe(first)
+        yield AnalysisEvent(
+            event=StreamEvent.DIAGNOSIS,
+            diagnosis=pred,
+            probabilities=probs,
+            base_model_name=submitted.version.model.weights,
+            model_version=submitted.version.name,
+            processing_device=DEVICE.type,
+            time_to_first_result=first,
+        )
+
+        await asyncio.wrap_future(submitted.future)
+        loop = asyncio.get_running_loop()
+        # каждый шаг отрисовки выполняется в пуле, между шагами отдаём готовое
+        steps = self.finish_steps(submitted)
+        while (step := await loop.run_in_executor(self.render_executor, next, steps, None)) is not None:
+            event, value = step
+            if event == StreamEvent.DONE:
+                yield AnalysisEvent(
+                    event=event, processing_time=value.processing_time, stage_times=value.stage_times,
+                    result_id=value.result_id,
+                )
+            else:
+                # копия: результат с этой картой ещё попадёт в кэш, а получатель может её изменить
+                value = value.model_copy() if isinstance(value, HeatmapImage) else value
+                yield AnalysisEvent(event=event, **{event.value: value})
+
+    async def _read(self, image: UploadFile) -> tuple[UploadFile, StageTimer]:
+        # читаем загрузку в память в event loop, декодирование уже в пуле
+        if image.size is not None and image.size > MAX_SIZE:
+            raise HTTPException(400, 'Invalid file size')
+        self.check_admission()
+
+        timer = StageTimer()
+        with timer.stage('read'):
+            content = await image.read()
+        return UploadFile(BytesIO(content), size=len(content), filename=image.filename), timer
+
+    def analyze_many(
+        self,
+        images: Iterable[UploadFile],
+        cam: CamMethod,
+        points: PointsFormat,
+        window: int = 32,
+        image_format: ImageFormat | None = None,
+        overlay: OverlayMode = OverlayMode.BLEND,
+        version: str | None = None,
+        heatmap: HeatmapMode = HeatmapMode.EAGER,
+        regions: bool = False,
+    ) -> Iterator[BatchItem]:
+        """
+        Анализирует снимки, держа в работе не больше window штук, чтобы
+        планировщик мог собирать пачки. Результаты выдаются по мере
+        готовности, порядок восстанавливается по BatchItem.index.
+        """
+        pending: dict[Future, tuple[int, str | None, Pending]] = {}
+
+        def drain(return_when: str) -> Iterator[BatchItem]:
+            done, _ = wait(pending, return_when=return_when)
+            for future in done:
+                index, filename, submitted = pending.pop(future)
+                try:
+                    result = self.finish(submitted)
+                except Exception as e:
+                    yield BatchItem(index=index, filename=filename, error=str(e))
+                else:
+                    yield BatchItem(index=index, filename=filename, result=result)
+
+        for index, image in enumerate(images):
+            if isinstance(image, DamagedUpload):
+                yield BatchItem(index=index, filename=image.filename, error=image.error)
+                continue
+            try:
+                # запрос целиком уже принят, его снимки не отклоняются по одному
+                submitted = self.submit(
+                    image, cam, points, admit=False, image_format=image_format, overlay=overlay, version=version,
+                    heatmap=heatmap, regions=regions,
+                )
+            except HTTPException as e:
+                yield BatchItem(index=index, filename=image.filename, error=e.detail)
+                continue
+            except Exception as e:
+                # например, обрезанный JPEG: ошибка только этого снимка
+                yield BatchItem(index=index, filename=image.filename, error=str(e))
+                continue
+
+            if isinstance(submitted, AnalysisResult):
+                yield BatchItem(index=index, filename=image.filename, result=submitted)
+                continue
+
+            pending[submitted.future] = (index, image.filename, submitted)
+            if len(pending) >= window:
+                yield from drain(FIRST_COMPLETED)
+
+        if pending:
+            yield from drain(ALL_COMPLETED)
+
+def result_events(result: AnalysisResult) -> Iterator[AnalysisEvent]:
+    # готовый результат, например из кэша, в виде событий потока
+    yield AnalysisEvent(
+        event=StreamEvent.DIAGNOSIS,
+        diagnosis=result.diagnosis,
+        probabilities=result.probabilities,
+        base_model_name=result.base_model_name,
+        model_version=result.model_version,
+        processing_device=result.processing_device,
+        time_to_first_result=result.processing_time,
+    )
+    if result.heatmap_image is not None:
+        yield AnalysisEvent(event=StreamEvent.HEATMAP_IMAGE, heatmap_image=result.heatmap_image)
+        yield AnalysisEvent(event=StreamEvent.HEATMAP_POINTS, heatmap_points=result.heatmap_points)
+    if result.heatmap_regions is not None:
+        yield AnalysisEvent(event=StreamEvent.HEATMAP_REGIONS, heatmap_regions=result.heatmap_regions)
+    yield AnalysisEvent(
+        event=StreamEvent.DONE, processing_time=result.processing_time, stage_times=result.stage_times,
+        result_id=result.result_id,
+    )
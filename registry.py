@@ -0,0 +1,101 @@
+import logging
+import threading
+import time
+from collections.abc import Callable
+from concurrent.futures import Future
+from typing import Any, NamedTuple
+
+logger = logging.getLogger(__name__)
+
+class ModelVersion(NamedTuple):
+    name: str
+    model: Any
+    model_hash: str
+    loaded_at: float
+
+class ModelRegistry:
+    """
+    Загруженные версии модели и активная среди них. Запрос берёт версию
+    один раз при постановке в очередь, поэтому после переключения уже
+    принятые запросы досчитываются старой версией, а новые идут в новую.
+    """
+    def __init__(self, initial: ModelVersion):
+        self._versions = {initial.name: initial}
+        self._active = initial
+        self._loading: set[str] = set()
+        self._errors: dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def active(self) -> ModelVersion:
+        return self._active
+
+    def get(self, name: str | None = None) -> ModelVersion:
+        """Версия по имени или активная; KeyError, если такой не загружено."""
+        if name is None:
+            return self._active
+        return self._versions[name]
+
+    def add(self, version: ModelVersion, activate: bool = False) -> None:
+        with self._lock:
+            self._versions[version.name] = version
+            self._errors.pop(version.name, None)
+            if activate:
+                self._active = version
+        logger.info('Model version %s loaded%s', version.name, ' and activated' if activate else '')
+
+    def activate(self, name: str) -> ModelVersion:
+        with self._lock:
+            # одно присваивание: запросы видят либо старую версию, либо новую
+            self._active = self._versions[name]
+        logger.info('Model version %s activated', name)
+        return self._active
+
+    def remove(self, name: str) -> None:
+        with self._lock:
+            if self._active.name == name:
+                raise ValueError(f'Model version {name} is active')
+            del self._versions[name]
+
+    def load(self, name: str, build: Callable[[], ModelVersion], activate: bool = False) -> Future[ModelVersion]:
+        """
+        Загружает версию в фоновом потоке, не мешая обслуживанию запросов.
+        ValueError, если версия с таким именем уже загружена или загружается.
+        """
+        with self._lock:
+            if name in self._versions or name in self._loading:
+                raise ValueError(f'Model version {name} already exists')
+            self._loading.add(name)
+
+        future: Future[ModelVersion] = Future()
+
+        def run():
+            try:
+                version = build()
+            except Exception as e:
+                logger.exception('Failed to load model version %s', name)
+                with self._lock:
+                    self._loading.discard(name)
+                    self._errors[name] = str(e)
+                future.set_exception(e)
+                return
+            with self._lock:
+                self._loading.discard(name)
+            self.add(version, activate)
+            future.set_result(version)
+
+        threading.Thread(target=run, name=f'model-loader-{name}', daemon=True).start()
+        return future
+
+    def status(self) -> dict:
+        with self._lock:
+            versions = {
+                name: {'state': 'ready', 'model_hash': version.model_hash, 'loaded_at': version.loaded_at}
+                for name, version in self._versions.items()
+            }
+            versions |= {name: {'state': 'loading'} for name in self._loading}
+            versions |= {name: {'state': 'failed', 'error': error} for name, error in self._errors.items()}
+            return {'active': self._active.name, 'versions': versions}
+
+def new_version(name: str, model: Any, model_hash: str) -> ModelVersion:
+    return ModelVersion(name, model, model_hash, time.time())
@@ -10,8 +10,56 @@ class Diagnosis(StrEnum):
     VIRAL = 'viral_pneumonia'
     BACTERIAL = 'bacterial_pneumonia'
 
+class CamMethod(StrEnum):
+    GRADCAM = 'gradcam'
+    GRADCAM_PP = 'gradcam++'
+    CAM = 'cam'
+
+class InferenceBackend(StrEnum):
+    EAGER = 'eager'
+    TORCHSCRIPT = 'torchscript'
+    ONNX = 'onnx'
+    ONNX_INT8 = 'onnx-int8'
+
+class CpuOptimization(StrEnum):
+    COMPILE = 'compile'
+    CHANNELS_LAST = 'channels-last'
+    BF16 = 'bf16'
+
+class PointsFormat(StrEnum):
+    LIST = 'list'
+    GRID = 'grid'
+    RLE = 'rle'
+    FLOAT16 = 'float16'
+    UINT8 = 'uint8'
+
+class ImageFormat(StrEnum):
+    PNG = 'png'
+    WEBP = 'webp'
+    JPEG = 'jpeg'
+
+class OverlayMode(StrEnum):
+    # blend - карта, наложенная на снимок; layer - только карта в RGBA уменьшенного размера
+    BLEND = 'blend'
+    LAYER = 'layer'
+
+class HeatmapMode(StrEnum):
+    # none - без карты; lazy - карта строится по запросу /api/analyze/{id}/heatmap
+    # из сохранённых признаков; eager - карта сразу в ответе
+    NONE = 'none'
+    LAZY = 'lazy'
+    EAGER = 'eager'
+
+class ImageDelivery(StrEnum):
+    INLINE = 'inline'
+    URL = 'url'
+    MULTIPART = 'multipart'
+
 class HeatmapImage(BaseModel):
-    base64: str
+    # при выдаче inline изображение лежит в base64, иначе url указывает
+    # на /api/heatmaps/{id} или на часть multipart-ответа (cid:)
+    base64: str | None = None
+    url: str | None = None
     mime: str
     dimensions: tuple[int, int]
 
@@ -20,11 +68,103 @@ class HeatmapPoint(NamedTuple):
     y: int
     intensity: NormFloat
 
+class HeatmapArray(BaseModel):
+    # data - base64 массива little-endian с формой shape (высота, ширина);
+    # для rle это значения серий, а runs - их длины в uint32;
+    # dimensions - размер исходного снимка (ширина, высота)
+    encoding: PointsFormat
+    dtype: str
+    shape: tuple[int, int]
+    dimensions: tuple[int, int]
+    data: str
+    runs: str | None = None
+
+class HeatmapRegion(BaseModel):
+    # связная область карты выше порога в координатах исходного снимка:
+    # bbox - (x, y, ширина, высота), polygon - упрощённый внешний контур,
+    # area - площадь в пикселях, peak и mean - наибольшая и средняя интенсивность
+    bbox: tuple[int, int, int, int]
+    polygon: list[tuple[int, int]]
+    area: int
+    peak: NormFloat
+    mean: NormFloat
+    centroid: tuple[float, float]
+
 class AnalysisResult(BaseModel):
     diagnosis: Diagnosis
     probabilities: dict[Diagnosis, NormFloat]
     heatmap_image: HeatmapImage | None
-    heatmap_points: list[HeatmapPoint] | None
+    heatmap_points: list[HeatmapPoint] | HeatmapArray | None
+    # только по запросу с regions=true
+    heatmap_regions: list[HeatmapRegion] | None = None
     base_model_name: str
+    # версия модели из реестра, которая выполнила анализ
+    model_version: str | None = None
     processing_time: float
     processing_device: str
+    # время этапов в секундах, только по запросу с stages=true
+    stage_times: dict[str, float] | None = None
+    # с heatmap=lazy - идентификатор для /api/analyze/{id}/heatmap
+    result_id: str | None = None
+
+class HeatmapResult(BaseModel):
+    # карта, построенная по запросу для класса diagnosis
+    result_id: str
+    diagnosis: Diagnosis
+    heatmap_image: HeatmapImage
+    heatmap_points: list[HeatmapPoint] | HeatmapArray
+    heatmap_regions: list[HeatmapRegion] | None = None
+    processing_time: float
+    stage_times: dict[str, float] | None = None
+
+class StreamEvent(StrEnum):
+    DIAGNOSIS = 'diagnosis'
+    HEATMAP_IMAGE = 'heatmap_image'
+    HEATMAP_POINTS = 'heatmap_points'
+    HEATMAP_REGIONS = 'heatmap_regions'
+    DONE = 'done'
+    ERROR = 'error'
+
+class AnalysisEvent(BaseModel):
+    # одна строка потока /api/analyze?stream=true; заполнены только поля своего события:
+    # diagnosis - диагноз, вероятности и время до него, heatmap_* - части карты,
+    # done - общее время и result_id для heatmap=lazy, error - текст ошибки
+    event: StreamEvent
+    diagnosis: Diagnosis | None = None
+    probabilities: dict[Diagnosis, NormFloat] | None = None
+    base_model_name: str | None = None
+    model_version: str | None = None
+    processing_device: str | None = None
+    time_to_first_result: float | None = None
+    heatmap_image: HeatmapImage | None = None
+    heatmap_points: list[HeatmapPoint] | HeatmapArray | None = None
+    heatmap_regions: list[HeatmapRegion] | None = None
+    processing_time: float | None = None
+    stage_times: dict[str, float] | None = None
+    result_id: str | None = None
+    detail: str | None = None
+
+class BatchItem(BaseModel):
+    index: int
+    filename: str | None
+    result: AnalysisResult | None = None
+    error: str | None = None
+
+class JobState(StrEnum):
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
+class JobStatus(BaseModel):
+    # задание /api/jobs; result - как ответ /api/analyze/batch, когда state=done,
+    # error - почему задание целиком не выполнено
+    id: str
+    state: JobState
+    priority: int
+    attempts: int
+    created_at: float
+    started_at: float | None = None
+    finished_at: float | None = None
+    result: list[BatchItem] | None = None
+    error: str | None = None
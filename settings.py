@@ -0,0 +1,74 @@
+import os
+
+from schemas import CamMethod, CpuOptimization, ImageFormat, InferenceBackend
+
+# параметры развёртывания задаются через переменные окружения
+MODEL_PATH = os.environ.get('MODEL_PATH', 'model_/best_model.pth')
+# имя начальной версии и каталог, из которого загружаются новые версии ({MODEL_DIR}/{версия}.pth)
+MODEL_VERSION = os.environ.get('MODEL_VERSION', os.path.splitext(os.path.basename(MODEL_PATH))[0])
+MODEL_DIR = os.environ.get('MODEL_DIR', os.path.dirname(MODEL_PATH))
+# число процессов сервера; потоки PyTorch и OpenCV делятся между ними поровну
+WORKERS = int(os.environ.get('WORKERS', '1'))
+NUM_THREADS = int(os.environ.get('NUM_THREADS', str(max(1, (os.cpu_count() or 1) // WORKERS))))
+# потоки для параллельного запуска независимых операторов; сервер распараллеливает
+# запросы сам, а графы модели последовательны, так что одного хватает
+INTEROP_THREADS = int(os.environ.get('INTEROP_THREADS', '1'))
+# дополнительные чекпоинты для ансамбля через os.pathsep и число видов
+# test-time augmentation (1-8); вероятности и карты усредняются
+ENSEMBLE_PATHS = [path for path in os.environ.get('ENSEMBLE_PATHS', '').split(os.pathsep) if path]
+TTA_VIEWS = int(os.environ.get('TTA_VIEWS', '1'))
+MAX_BATCH_SIZE = int(os.environ.get('MAX_BATCH_SIZE', '8'))
+MAX_BATCH_WAIT_MS = float(os.environ.get('MAX_BATCH_WAIT_MS', '5'))
+# сколько снимков может ждать модель; запросы сверх этого получают 503, 0 - без ограничения
+MAX_QUEUE_DEPTH = int(os.environ.get('MAX_QUEUE_DEPTH', str(8 * MAX_BATCH_SIZE)))
+# пулы потоков для декодирования снимков и отрисовки тепловых карт
+DECODE_THREADS = int(os.environ.get('DECODE_THREADS', str(NUM_THREADS)))
+RENDER_THREADS = int(os.environ.get('RENDER_THREADS', str(NUM_THREADS)))
+# доля запросов, для которых сохраняются профили cProfile и PyTorch, и каталог для них
+PROFILE_RATE = float(os.environ.get('PROFILE_RATE', '0'))
+PROFILE_DIR = os.environ.get('PROFILE_DIR', 'profiles')
+# сколько снимков одного запроса /api/analyze/batch обрабатывается одновременно
+BATCH_WINDOW = int(os.environ.get('BATCH_WINDOW', str(4 * MAX_BATCH_SIZE)))
+CAM_METHOD = CamMethod(os.environ.get('CAM_METHOD', CamMethod.GRADCAM))
+# граф, на котором выполняется модель: eager PyTorch или экспортированный при запуске
+INFERENCE_BACKEND = InferenceBackend(os.environ.get('INFERENCE_BACKEND', InferenceBackend.EAGER))
+# оптимизации eager-модели для CPU через запятую: compile, channels-last, bf16
+CPU_OPTIMIZATIONS = [CpuOptimization(name) for name in os.environ.get('CPU_OPTIMIZATIONS', '').split(',') if name]
+# каталог для экспортированных бэкендов, чтобы не экспортировать модель при каждом запуске
+MODEL_CACHE_DIR = os.environ.get('MODEL_CACHE_DIR', '')
+# наибольшая сторона тепловой карты и наложения; 0 - размер исходного снимка
+HEATMAP_MAX_SIZE = int(os.environ.get('HEATMAP_MAX_SIZE', '1024'))
+# формат наложения по умолчанию, качество JPEG и WebP и степень сжатия PNG (0-9);
+# уровень 1 сжимает в разы быстрее уровня 6 по умолчанию при почти том же размере
+HEATMAP_FORMAT = ImageFormat(os.environ.get('HEATMAP_FORMAT', ImageFormat.PNG))
+HEATMAP_QUALITY = int(os.environ.get('HEATMAP_QUALITY', '85'))
+HEATMAP_PNG_COMPRESS_LEVEL = int(os.environ.get('HEATMAP_PNG_COMPRESS_LEVEL', '1'))
+# наибольшая сторона карты в режиме overlay=layer; клиент растягивает её сам
+HEATMAP_LAYER_SIZE = int(os.environ.get('HEATMAP_LAYER_SIZE', '256'))
+# сколько наложений, выданных по ссылке, хранится для /api/heatmaps/{id} и сколько секунд
+HEATMAP_URL_MAX_BYTES = int(os.environ.get('HEATMAP_URL_MAX_BYTES', str(256 * 1024 * 1024)))
+HEATMAP_URL_TTL = float(os.environ.get('HEATMAP_URL_TTL', str(10 * 60)))
+# сколько байт признаков снимков с heatmap=lazy хранится для /api/analyze/{id}/heatmap и сколько секунд
+FEATURE_CACHE_BYTES = int(os.environ.get('FEATURE_CACHE_BYTES', str(256 * 1024 * 1024)))
+FEATURE_CACHE_TTL = float(os.environ.get('FEATURE_CACHE_TTL', str(5 * 60)))
+# сторона сетки для heatmap_points в формате grid
+HEATMAP_GRID_SIZE = int(os.environ.get('HEATMAP_GRID_SIZE', '64'))
+
+# очередь заданий /api/jobs в SQLite: файл, число потоков, выполняющих задания,
+# сколько заданий может ждать, сколько секунд хранятся готовые, аренда задания
+# в секундах (после неё задание упавшего процесса берётся снова), число попыток
+# и наибольший суммарный размер файлов задания
+JOBS_PATH = os.environ.get('JOBS_PATH', 'jobs.sqlite3')
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', '1'))
+JOB_MAX_QUEUED = int(os.environ.get('JOB_MAX_QUEUED', '1000'))
+JOB_TTL = float(os.environ.get('JOB_TTL', str(24 * 60 * 60)))
+JOB_LEASE = float(os.environ.get('JOB_LEASE', '30'))
+JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', '3'))
+JOB_MAX_BYTES = int(os.environ.get('JOB_MAX_BYTES', str(200 * 1024 * 1024)))
+
+# кэш результатов: в памяти и, если задан CACHE_PATH, в SQLite на диске
+CACHE_MAX_ENTRIES = int(os.environ.get('CACHE_MAX_ENTRIES', '1000'))
+CACHE_MAX_BYTES = int(os.environ.get('CACHE_MAX_BYTES', str(256 * 1024 * 1024)))
+CACHE_TTL = float(os.environ.get('CACHE_TTL', str(24 * 60 * 60)))
+CACHE_PATH = os.environ.get('CACHE_PATH', '')
+CACHE_DISK_MAX_ENTRIES = int(os.environ.get('CACHE_DISK_MAX_ENTRIES', '100000'))
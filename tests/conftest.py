@@ -0,0 +1,41 @@
+import sys
+import os
+
+import numpy as np
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope='session')
+def model():
+  import torch
+  import torch.nn as nn
+  import torchxrayvision as xrv
+  from model_.arch_model import CLASS_NAMES
+  from schemas import Diagnosis
+
+  # архитектура как в load_trained_model, но со случайными весами:
+  # best_model.pth хранится в Git LFS и в тестах может отсутствовать
+  torch.manual_seed(0)
+  model = xrv.models.DenseNet(weights=None)
+  model.classifier = nn.Linear(model.classifier.in_features, len(CLASS_NAMES))
+  model.op_threshs = None
+  model.pathologies = CLASS_NAMES
+  model.weights = 'densenet121-res224-chex'
+
+  # смещаем классификатор от нормы, чтобы Grad-CAM считался для всех снимков
+  with torch.no_grad():
+    model.classifier.bias[CLASS_NAMES.index(Diagnosis.NORMAL)] = -1e3
+
+  model.eval()
+  return model
+
+
+@pytest.fixture
+def xrays():
+  rng = np.random.default_rng(0)
+  return [
+    rng.integers(0, 256, size=shape, dtype=np.uint8)
+    for shape in [(300, 250), (256, 256), (200, 320)]
+  ]
@@ -0,0 +1,161 @@
+import copy
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+import torch
+
+from model_.arch_model import (
+  CLASS_NAMES, cam_from_features, convert_to_mmap_format, load_trained_model, run_model_batch, run_model_with_features,
+)
+from schemas import CamMethod, Diagnosis, HeatmapMode
+
+
+def assert_same_result(expected, actual, atol=1e-5):
+  pred, probs, cam = expected
+  a_pred, a_probs, a_cam = actual
+  assert pred == a_pred
+  for name in CLASS_NAMES:
+    assert probs[name] == pytest.approx(a_probs[name], abs=atol)
+  if cam is None:
+    assert a_cam is None
+  else:
+    np.testing.assert_allclose(cam, a_cam, atol=1e-4)
+
+
+class TestRunModelBatch:
+  def test_batch_matches_single(self, model, xrays):
+    single = [run_model_with_features(img, model) for img in xrays]
+    batched = run_model_batch(xrays, model)
+
+    for expected, actual in zip(single, batched):
+      assert expected[2] is not None
+      assert_same_result(expected, actual)
+
+  def test_cam_matches_image_size(self, model, xrays):
+    for img, (pred, probs, cam) in zip(xrays, run_model_batch(xrays, model)):
+      assert pred != Diagnosis.NORMAL
+      assert cam.shape == img.shape
+      assert cam.min() >= 0 and cam.max() <= 1
+      assert sum(probs.values()) == pytest.approx(1)
+
+  def test_cam_size_is_capped(self, model, xrays):
+    for img, (pred, probs, cam) in zip(xrays, run_model_batch(xrays, model, max_size=100)):
+      assert max(cam.shape) == 100
+      assert cam.shape[0] / cam.shape[1] == pytest.approx(img.shape[0] / img.shape[1], rel=0.02)
+
+  def test_normal_has_no_cam(self, model, xrays):
+    normal_model = copy.deepcopy(model)
+    with torch.no_grad():
+      normal_model.classifier.bias.zero_()
+      normal_model.classifier.bias[CLASS_NAMES.index(Diagnosis.NORMAL)] = 1e3
+
+    for pred, probs, cam in run_model_batch(xrays, normal_model):
+      assert pred == Diagnosis.NORMAL
+      assert cam is None
+
+  def test_model_state_untouched(self, model, xrays):
+    run_model_batch(xrays, model)
+
+    assert all(p.grad is None for p in model.parameters())
+
+
+class TestConcurrency:
+  def test_parallel_matches_serial(self, model):
+    rng = np.random.default_rng(1)
+    imgs = [
+      rng.integers(0, 256, size=(224 + 16 * i, 224 + 8 * i), dtype=np.uint8)
+      for i in range(8)
+    ]
+    serial = [run_model_with_features(img, model) for img in imgs]
+
+    with ThreadPoolExecutor(max_workers=len(imgs)) as executor:
+      parallel = list(executor.map(lambda img: run_model_with_features(img, model), imgs))
+
+    for expected, actual in zip(serial, parallel):
+      assert_same_result(expected, actual)
+
+
+class TestCamMethods:
+  def test_cam_agrees_with_gradcam(self, model, xrays):
+    # Grad-CAM берёт выход denseblock4 и градиенты через финальные BatchNorm
+    # и ReLU, CAM - карты после них: карты похожи, но не совпадают
+    gradcam = run_model_batch(xrays, model, [CamMethod.GRADCAM] * len(xrays))
+    cam = run_model_batch(xrays, model, [CamMethod.CAM] * len(xrays))
+
+    for (pred, probs, expected), (cam_pred, cam_probs, actual) in zip(gradcam, cam):
+      assert (cam_pred, cam_probs) == (pred, probs)
+      assert np.corrcoef(expected.ravel(), actual.ravel())[0, 1] > 0.8
+      assert np.abs(expected - actual).max() > 1e-3
+
+  def test_gradcam_pp(self, model, xrays):
+    results = run_model_batch(xrays, model, [CamMethod.GRADCAM_PP] * len(xrays))
+    gradcam = run_model_batch(xrays, model, [CamMethod.GRADCAM] * len(xrays))
+
+    for img, (pred, probs, cam), (_, _, gradcam_map) in zip(xrays, results, gradcam):
+      assert cam.shape == img.shape
+      assert cam.min() >= 0 and cam.max() <= 1
+      assert np.abs(cam - gradcam_map).max() > 1e-3
+
+  def test_mixed_methods_match_single(self, model, xrays):
+    methods = [CamMethod.CAM, CamMethod.GRADCAM, CamMethod.GRADCAM_PP]
+    single = [run_model_with_features(img, model, method) for img, method in zip(xrays, methods)]
+    batched = run_model_batch(xrays, model, methods)
+
+    for expected, actual in zip(single, batched):
+      assert_same_result(expected, actual)
+
+
+class TestLazyHeatmap:
+  @pytest.mark.parametrize('method', list(CamMethod))
+  def test_cam_from_features_matches_eager(self, model, xrays, method):
+    features = {}
+    lazy = run_model_batch(xrays, model, [method] * len(xrays), max_size=100,
+                           heatmaps=[HeatmapMode.LAZY] * len(xrays), features=features)
+    eager = run_model_batch(xrays, model, [method] * len(xrays), max_size=100)
+
+    for i, ((pred, _, cam), (_, _, expected)) in enumerate(zip(lazy, eager)):
+      assert cam is None
+      actual = cam_from_features(model, features[i], pred, method, expected.shape)
+      np.testing.assert_allclose(actual, expected, atol=1e-4)
+
+  def test_any_class(self, model, xrays):
+    features = {}
+    run_model_batch(xrays[:1], model, heatmaps=[HeatmapMode.LAZY], features=features)
+
+    cams = [cam_from_features(model, features[0], diagnosis, target_size=(50, 60)) for diagnosis in CLASS_NAMES]
+
+    assert all(cam.shape == (50, 60) for cam in cams)
+    assert not np.allclose(cams[0], cams[1])
+
+  def test_none_keeps_nothing(self, model, xrays):
+    features = {}
+    results = run_model_batch(xrays, model, heatmaps=[HeatmapMode.NONE] * len(xrays), features=features)
+
+    assert features == {}
+    assert all(cam is None for _, _, cam in results)
+
+
+class TestLoadTrainedModel:
+  @pytest.mark.parametrize('zipfile', [True, False])
+  def test_loads_state_dict(self, model, tmp_path, zipfile):
+    # старый формат torch.save не поддерживает mmap и читается целиком
+    path = tmp_path / 'model.pth'
+    torch.save(model.state_dict(), path, _use_new_zipfile_serialization=zipfile)
+
+    loaded = load_trained_model(str(path), torch.device('cpu'))
+
+    assert loaded.weights == 'densenet121-res224-chex'
+    assert not loaded.training
+    for name, tensor in model.state_dict().items():
+      assert torch.equal(loaded.state_dict()[name], tensor), name
+
+  def test_convert_to_mmap_format(self, model, tmp_path):
+    legacy, converted = tmp_path / 'legacy.pth', tmp_path / 'converted.pth'
+    torch.save(model.state_dict(), legacy, _use_new_zipfile_serialization=False)
+
+    assert convert_to_mmap_format(str(legacy), str(converted)) == str(converted)
+    # уже пригодный файл используется как есть
+    assert convert_to_mmap_format(str(converted), str(tmp_path / 'other.pth')) == str(converted)
+    state_dict = torch.load(converted, mmap=True, weights_only=True)
+    assert torch.equal(state_dict['classifier.bias'], model.classifier.bias)
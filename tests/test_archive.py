@@ -0,0 +1,104 @@
+import tarfile
+import zipfile
+from io import BytesIO
+
+from fastapi import UploadFile
+
+from archive import DamagedUpload, expand_uploads, is_archive, iter_archive
+from image import MAX_SIZE
+
+
+def make_upload(content, filename):
+  return UploadFile(BytesIO(content), size=len(content), filename=filename)
+
+
+def make_zip(files):
+  buf = BytesIO()
+  with zipfile.ZipFile(buf, 'w') as archive:
+    archive.mkdir('study')
+    for name, content in files.items():
+      archive.writestr(name, content)
+  return buf.getvalue()
+
+
+def make_tar(files, mode='w:gz'):
+  buf = BytesIO()
+  with tarfile.open(fileobj=buf, mode=mode) as archive:
+    for name, content in files.items():
+      info = tarfile.TarInfo(name)
+      info.size = len(content)
+      archive.addfile(info, BytesIO(content))
+  return buf.getvalue()
+
+
+FILES = {'study/a.png': b'first', 'study/b.dcm': b'second'}
+
+
+class TestIterArchive:
+  def test_zip(self):
+    members = list(iter_archive(make_upload(make_zip(FILES), 'study.zip')))
+
+    assert [m.filename for m in members] == list(FILES)
+    assert [m.file.read() for m in members] == list(FILES.values())
+    assert [m.size for m in members] == [len(c) for c in FILES.values()]
+
+  def test_tar_gz(self):
+    members = list(iter_archive(make_upload(make_tar(FILES), 'study.tar.gz')))
+
+    assert [m.filename for m in members] == list(FILES)
+    assert [m.file.read() for m in members] == list(FILES.values())
+
+  def test_plain_tar(self):
+    members = list(iter_archive(make_upload(make_tar(FILES, mode='w'), 'study.tar')))
+
+    assert len(members) == 2
+
+  def test_oversized_member_not_read(self):
+    buf = BytesIO()
+    with zipfile.ZipFile(buf, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+      archive.writestr('huge.png', b'\0' * (MAX_SIZE + 1))
+
+    member, = iter_archive(make_upload(buf.getvalue(), 'huge.zip'))
+
+    assert member.size == MAX_SIZE + 1
+    assert member.file.read() == b''
+
+  def test_truncated_tar_gz(self):
+    content = make_tar(FILES)
+    members = list(iter_archive(make_upload(content[:len(content) // 2], 'study.tar.gz')))
+
+    assert members[-1].filename == 'study.tar.gz'
+    assert isinstance(members[-1], DamagedUpload) and members[-1].error == 'Invalid archive'
+
+  def test_gzip_without_tar(self):
+    import gzip
+
+    member, = iter_archive(make_upload(gzip.compress(b'not a tar' * 100), 'study.tar.gz'))
+
+    assert isinstance(member, DamagedUpload) and member.filename == 'study.tar.gz'
+
+  def test_bad_member_crc(self):
+    content = make_zip(FILES)
+    # портим данные первого файла, не трогая заголовков
+    offset = content.index(b'first')
+    content = content[:offset] + b'FIRST' + content[offset + 5:]
+
+    members = list(iter_archive(make_upload(content, 'study.zip')))
+
+    assert (members[0].filename, members[0].error) == ('study/a.png', 'Invalid archive member')
+    assert members[1].file.read() == b'second'
+
+
+class TestExpandUploads:
+  def test_mixed(self):
+    uploads = [
+      make_upload(b'\x89PNG\r\n\x1a\n' + b'\0' * 32, 'single.png'),
+      make_upload(make_zip(FILES), 'study.zip'),
+    ]
+
+    assert [m.filename for m in expand_uploads(uploads)] == ['single.png', *FILES]
+
+  def test_is_archive(self):
+    assert is_archive(make_upload(make_zip(FILES), 'study.zip'))
+    assert is_archive(make_upload(make_tar(FILES), 'study.tar.gz'))
+    assert not is_archive(make_upload(b'plain text', 'a.txt'))
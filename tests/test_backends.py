@@ -0,0 +1,102 @@
+import copy
+import os
+
+import numpy as np
+import pytest
+
+from model_.arch_model import run_model_batch
+from model_.backends import attach_backend, bf16_supported, check_parity
+from schemas import CamMethod, CpuOptimization, InferenceBackend
+
+
+@pytest.fixture(scope='module')
+def with_backend(model):
+  exported = {}
+
+  def get(backend):
+    if backend in (InferenceBackend.ONNX, InferenceBackend.ONNX_INT8):
+      pytest.importorskip('onnxruntime')
+    if backend not in exported:
+      # фикстура модели общая для сессии, бэкенд подключаем к копии
+      exported[backend] = attach_backend(copy.deepcopy(model), backend)
+    return exported[backend]
+
+  return get
+
+
+class TestBackends:
+  @pytest.mark.parametrize('backend', [InferenceBackend.TORCHSCRIPT, InferenceBackend.ONNX])
+  def test_parity(self, with_backend, xrays, backend):
+    parity = check_parity(with_backend(backend), xrays)
+
+    assert parity.max_logit_diff < 1e-3
+    assert parity.max_feature_diff < 1e-3
+    assert parity.agreement == 1.0
+
+  def test_int8_parity(self, with_backend, xrays):
+    parity = check_parity(with_backend(InferenceBackend.ONNX_INT8), xrays)
+
+    # квантование огрубляет признаки, но не должно их ломать
+    assert parity.max_logit_diff < 1.0
+
+  @pytest.mark.parametrize('backend', [InferenceBackend.TORCHSCRIPT, InferenceBackend.ONNX])
+  @pytest.mark.parametrize('method', [CamMethod.CAM, CamMethod.GRADCAM])
+  def test_run_model_batch(self, model, with_backend, xrays, backend, method):
+    expected = run_model_batch(xrays, model, [method] * len(xrays))
+    actual = run_model_batch(xrays, with_backend(backend), [method] * len(xrays))
+
+    for (pred, probs, cam), (exp_pred, exp_probs, exp_cam) in zip(actual, expected):
+      assert pred == exp_pred
+      assert probs == pytest.approx(exp_probs, abs=1e-5)
+      np.testing.assert_allclose(cam, exp_cam, atol=1e-4)
+
+  def test_cache_dir(self, model, tmp_path):
+    first = attach_backend(copy.deepcopy(model), InferenceBackend.TORCHSCRIPT, str(tmp_path), 'hash')
+    exported = tmp_path / 'hash-denseblock4-torchscript.pt'
+    mtime = exported.stat().st_mtime_ns
+
+    second = attach_backend(copy.deepcopy(model), InferenceBackend.TORCHSCRIPT, str(tmp_path), 'hash')
+
+    assert exported.stat().st_mtime_ns == mtime
+    assert [p.name for p in tmp_path.iterdir()] == ['hash-denseblock4-torchscript.pt']
+    assert check_parity(second, [np.zeros((64, 64), np.uint8)]).max_logit_diff < 1e-3
+    assert first.backend is not second.backend
+
+
+class TestCpuOptimizations:
+  # допуски: channels_last и компиляция меняют только порядок вычислений,
+  # bfloat16 огрубляет признаки
+  @pytest.mark.parametrize('optimizations, probs_tol, cam_tol', [
+    ([CpuOptimization.CHANNELS_LAST], 1e-5, 1e-4),
+    ([CpuOptimization.BF16], 0.01, 0.05),
+    ([CpuOptimization.CHANNELS_LAST, CpuOptimization.BF16], 0.01, 0.05),
+    pytest.param(
+      [CpuOptimization.COMPILE, CpuOptimization.CHANNELS_LAST], 1e-5, 1e-4,
+      marks=pytest.mark.skipif(not os.environ.get('TEST_COMPILE'), reason='torch.compile takes minutes on DenseNet'),
+    ),
+  ])
+  @pytest.mark.parametrize('method', [CamMethod.CAM, CamMethod.GRADCAM])
+  def test_parity(self, model, xrays, optimizations, probs_tol, cam_tol, method):
+    if CpuOptimization.BF16 in optimizations and not bf16_supported():
+      pytest.skip('CPU does not support bfloat16')
+    optimized = attach_backend(copy.deepcopy(model), InferenceBackend.EAGER, optimizations=optimizations)
+
+    expected = run_model_batch(xrays, model, [method] * len(xrays))
+    actual = run_model_batch(xrays, optimized, [method] * len(xrays))
+
+    for (pred, probs, cam), (exp_pred, exp_probs, exp_cam) in zip(actual, expected):
+      assert pred == exp_pred
+      assert probs == pytest.approx(exp_probs, abs=probs_tol)
+      np.testing.assert_allclose(cam, exp_cam, atol=cam_tol)
+
+  def test_shared_weights_are_not_changed(self, model):
+    shared = copy.deepcopy(model)
+    before = {name: (p.data_ptr(), p.stride()) for name, p in shared.named_parameters()}
+
+    attach_backend(shared, InferenceBackend.EAGER, optimizations=[CpuOptimization.CHANNELS_LAST])
+
+    assert {name: (p.data_ptr(), p.stride()) for name, p in shared.named_parameters()} == before
+
+  def test_export_backends_reject_optimizations(self, model):
+    with pytest.raises(ValueError):
+      attach_backend(copy.deepcopy(model), InferenceBackend.TORCHSCRIPT, optimizations=[CpuOptimization.BF16])
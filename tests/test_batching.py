@@ -0,0 +1,87 @@
+import threading
+import time
+
+import pytest
+
+from batching import BatchScheduler, QueueFull
+
+
+class TestBatchScheduler:
+  def test_results_fan_out_in_order(self):
+    scheduler = BatchScheduler(lambda values: [v * 2 for v in values], max_batch_size=4)
+    futures = [scheduler.submit(i) for i in range(10)]
+
+    assert [f.result(timeout=5) for f in futures] == [i * 2 for i in range(10)]
+    scheduler.close()
+
+  def test_concurrent_requests_are_batched(self):
+    batches = []
+    release = threading.Event()
+
+    def run_batch(values):
+      batches.append(list(values))
+      release.wait(timeout=5)
+      return values
+
+    scheduler = BatchScheduler(run_batch, max_batch_size=4, max_wait_ms=1000)
+    futures = [scheduler.submit(i) for i in range(4)]
+    release.set()
+
+    assert [f.result(timeout=5) for f in futures] == [0, 1, 2, 3]
+    assert batches == [[0, 1, 2, 3]]
+
+    stats = scheduler.stats()
+    assert stats.batches == 1
+    assert stats.items == 4
+    assert stats.batch_sizes == {4: 1}
+    scheduler.close()
+
+  def test_max_wait_bounds_latency(self):
+    scheduler = BatchScheduler(lambda values: values, max_batch_size=8, max_wait_ms=20)
+
+    start = time.perf_counter()
+    assert scheduler.submit(1).result(timeout=5) == 1
+    assert time.perf_counter() - start < 1
+
+    stats = scheduler.stats()
+    assert stats.batch_sizes == {1: 1}
+    assert stats.max_queue_wait >= 0.015
+    scheduler.close()
+
+  def test_exception_propagates_to_batch(self):
+    def run_batch(values):
+      raise RuntimeError('boom')
+
+    scheduler = BatchScheduler(run_batch, max_batch_size=2)
+    future = scheduler.submit(1)
+
+    with pytest.raises(RuntimeError, match='boom'):
+      future.result(timeout=5)
+    scheduler.close()
+
+  def test_invalid_batch_size(self):
+    with pytest.raises(ValueError):
+      BatchScheduler(lambda values: values, max_batch_size=0)
+
+  def test_queue_depth_limit(self):
+    release = threading.Event()
+
+    def run_batch(values):
+      release.wait(timeout=5)
+      return values
+
+    scheduler = BatchScheduler(run_batch, max_batch_size=2, max_wait_ms=0, max_queue_depth=3)
+    futures = [scheduler.submit(i) for i in range(3)]
+
+    assert scheduler.full()
+    with pytest.raises(QueueFull):
+      scheduler.submit(3)
+    # части уже принятого запроса проходят сверх лимита
+    futures.append(scheduler.submit(4, admit=False))
+    release.set()
+
+    assert [f.result(timeout=5) for f in futures] == [0, 1, 2, 4]
+    scheduler.close()
+    stats = scheduler.stats()
+    assert stats.queue_depth == 0 and not scheduler.full()
+    assert stats.rejected == 1
@@ -0,0 +1,148 @@
+import hashlib
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from unittest.mock import Mock
+
+from fastapi import UploadFile
+
+from cache import DiskCache, LRUCache, ResultCache, generate_image_hash, hash_file, make_cache_key
+
+
+class TestLRUCache:
+  def test_get_put(self):
+    cache = LRUCache(max_entries=2)
+    cache.put('a', 'x')
+
+    assert cache.get('a') == 'x'
+    assert cache.get('b') is None
+
+  def test_evicts_least_recently_used(self):
+    cache = LRUCache(max_entries=2)
+    cache.put('a', 'x')
+    cache.put('b', 'y')
+    cache.get('a')
+    cache.put('c', 'z')
+
+    assert cache.get('a') == 'x'
+    assert cache.get('b') is None
+    assert cache.get('c') == 'z'
+    assert len(cache) == 2
+
+  def test_evicts_by_size(self):
+    cache = LRUCache(max_entries=10, max_bytes=10, sizeof=len)
+    cache.put('a', 'xxxx')
+    cache.put('b', 'yyyy')
+    cache.put('c', 'zzzz')
+
+    assert cache.get('a') is None
+    assert cache.nbytes == 8
+
+  def test_skips_too_large(self):
+    cache = LRUCache(max_entries=10, max_bytes=3, sizeof=len)
+    cache.put('a', 'xxxx')
+
+    assert cache.get('a') is None
+    assert cache.nbytes == 0
+
+  def test_ttl(self):
+    cache = LRUCache(max_entries=10, ttl=0.01)
+    cache.put('a', 'x')
+    time.sleep(0.02)
+
+    assert cache.get('a') is None
+    assert len(cache) == 0
+
+  def test_pop(self):
+    cache = LRUCache(max_entries=10, sizeof=len)
+    cache.put('a', 'xx')
+
+    assert cache.pop('a') == 'xx'
+    assert cache.pop('a') is None
+    assert cache.nbytes == 0
+
+
+class TestDiskCache:
+  def test_survives_reopen(self, tmp_path):
+    path = str(tmp_path / 'cache.sqlite')
+    cache = DiskCache(path, max_entries=10)
+    cache.put('a', 'x')
+    cache.close()
+
+    assert DiskCache(path, max_entries=10).get('a') == 'x'
+
+  def test_evicts_oldest(self, tmp_path):
+    cache = DiskCache(str(tmp_path / 'cache.sqlite'), max_entries=2)
+    for key in 'abc':
+      cache.put(key, key)
+      time.sleep(0.01)
+
+    assert cache.get('a') is None
+    assert cache.get('c') == 'c'
+
+  def test_ttl(self, tmp_path):
+    cache = DiskCache(str(tmp_path / 'cache.sqlite'), max_entries=10, ttl=0.01)
+    cache.put('a', 'x')
+    time.sleep(0.02)
+
+    assert cache.get('a') is None
+
+
+class TestResultCache:
+  def test_counters(self):
+    cache = ResultCache(LRUCache(max_entries=10))
+    cache.get('a')
+    cache.put('a', 'x')
+    cache.get('a')
+
+    stats = cache.stats()
+    assert stats.hits == 1
+    assert stats.misses == 1
+    assert stats.entries == 1
+
+  def test_counters_from_threads(self):
+    cache = ResultCache(LRUCache(max_entries=10))
+    cache.put('a', 'x')
+
+    def lookup(_):
+      for _ in range(2000):
+        cache.get('a')
+        cache.get('b')
+
+    with ThreadPoolExecutor(8) as executor:
+      list(executor.map(lookup, range(8)))
+
+    assert (cache.stats().hits, cache.stats().misses) == (16000, 16000)
+
+  def test_disk_tier_promotes_to_memory(self, tmp_path):
+    disk = DiskCache(str(tmp_path / 'cache.sqlite'), max_entries=10)
+    disk.put('a', 'x')
+    cache = ResultCache(LRUCache(max_entries=10), disk)
+
+    assert cache.get('a') == 'x'
+    assert cache.get('a') == 'x'
+    assert cache.stats().disk_hits == 1
+    assert cache.stats().hits == 1
+
+
+class TestHashing:
+  def test_hash_file_restores_position(self):
+    content = b'x' * 3_000_000
+    file = BytesIO(content)
+    file.seek(10)
+
+    digest = hash_file(file)
+
+    assert digest == hashlib.blake2b(content, digest_size=16).hexdigest()
+    assert file.tell() == 10
+
+  def test_generate_image_hash(self):
+    mock_file = Mock(spec=UploadFile)
+    mock_file.file = BytesIO(b'image data')
+
+    assert generate_image_hash(mock_file) == hash_file(BytesIO(b'image data'))
+
+  def test_cache_key_depends_on_all_parts(self):
+    assert make_cache_key('image', 'model', 'cam') == make_cache_key('image', 'model', 'cam')
+    assert make_cache_key('image', 'model', 'cam') != make_cache_key('image', 'model', 'gradcam')
+    assert make_cache_key('ab', 'c') != make_cache_key('a', 'bc')
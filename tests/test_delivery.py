@@ -0,0 +1,71 @@
+import base64
+from email import message_from_bytes
+
+from delivery import HeatmapStore, link_image, multipart_response
+from schemas import AnalysisResult, Diagnosis, HeatmapImage
+
+
+def make_result(data=b'image data'):
+  return AnalysisResult(
+    diagnosis=Diagnosis.NORMAL,
+    probabilities={Diagnosis.NORMAL: 1.0},
+    heatmap_image=HeatmapImage(base64=base64.b64encode(data).decode(), mime='image/webp', dimensions=(2, 1)),
+    heatmap_points=None,
+    base_model_name='test',
+    processing_time=0.1,
+    processing_device='cpu',
+  )
+
+
+class TestHeatmapStore:
+  def test_link_image(self):
+    store = HeatmapStore(max_bytes=1024)
+
+    result = link_image(make_result(), store)
+
+    assert result.heatmap_image.base64 is None
+    image_id = result.heatmap_image.url.removeprefix('/api/heatmaps/')
+    assert store.get(image_id) == (b'image data', 'image/webp')
+
+  def test_same_image_same_id(self):
+    store = HeatmapStore(max_bytes=1024)
+
+    first = link_image(make_result(), store)
+    second = link_image(make_result(), store)
+
+    assert first.heatmap_image.url == second.heatmap_image.url
+    assert len(store.images) == 1
+
+  def test_evicts_by_size(self):
+    store = HeatmapStore(max_bytes=16)
+
+    first = store.put(b'a' * 10, 'image/png')
+    store.put(b'b' * 10, 'image/png')
+
+    assert store.get(first) is None
+
+
+def parse_multipart(response):
+  head = b'Content-Type: ' + response.headers['content-type'].encode() + b'\r\n\r\n'
+  return message_from_bytes(head + response.body).get_payload()
+
+
+class TestMultipartResponse:
+  def test_parts(self):
+    json_part, image_part = parse_multipart(multipart_response(make_result()))
+
+    result = AnalysisResult.model_validate_json(json_part.get_payload())
+    assert result.heatmap_image.base64 is None
+    assert result.heatmap_image.url == 'cid:heatmap_image'
+    assert image_part['Content-ID'] == '<heatmap_image>'
+    assert image_part.get_content_type() == 'image/webp'
+    assert image_part.get_payload(decode=True) == b'image data'
+
+  def test_without_heatmap(self):
+    result = make_result()
+    result.heatmap_image = None
+
+    parts = parse_multipart(multipart_response(result))
+
+    assert len(parts) == 1
+    assert AnalysisResult.model_validate_json(parts[0].get_payload()).heatmap_image is None
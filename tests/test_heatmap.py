@@ -0,0 +1,144 @@
+import base64
+
+import numpy as np
+import pytest
+
+from heatmap import (
+  apply_threshold, dense_to_sparse, downsample_heatmap, encode_heatmap, extract_regions,
+  make_example_heatmap, render_heatmap, render_layer, run_length_encode,
+)
+from schemas import HeatmapPoint, PointsFormat
+
+
+@pytest.fixture
+def heatmap():
+  return apply_threshold(make_example_heatmap(120, 80, 60, 40, 15))
+
+
+def decode(array, dtype):
+  return np.frombuffer(base64.b64decode(array.data), dtype=dtype)
+
+
+class TestDenseToSparse:
+  def test_points(self):
+    heatmap = np.zeros((3, 4), dtype=np.float32)
+    heatmap[1, 2] = 0.5
+    heatmap[2, 0] = 1.0
+
+    assert dense_to_sparse(heatmap) == [HeatmapPoint(2, 1, 0.5), HeatmapPoint(0, 2, 1.0)]
+
+  def test_source_dimensions(self):
+    heatmap = np.zeros((3, 4), dtype=np.float32)
+    heatmap[0, 0] = 0.5
+    heatmap[2, 3] = 1.0
+
+    # карта уменьшена вдвое: точки - центры клеток 2x2 в пикселях снимка 8x6
+    assert dense_to_sparse(heatmap, (8, 6)) == [HeatmapPoint(1, 1, 0.5), HeatmapPoint(7, 5, 1.0)]
+
+
+class TestRenderLayer:
+  def test_size_and_alpha(self, heatmap):
+    layer = render_layer(heatmap, max_size=60)
+
+    assert layer.mode == 'RGBA'
+    assert layer.size == (60, 40)
+    assert np.all(np.array(layer)[..., 3] == 128)
+
+  def test_composite_matches_blend(self, heatmap):
+    image = np.full(heatmap.shape, 100, dtype=np.uint8)
+    layer = np.array(render_layer(heatmap, max_size=120)).astype(np.float32)
+
+    # так же накладывает карту canvas на клиенте
+    opacity = layer[..., 3:] / 255
+    composite = layer[..., :3] * opacity + image[..., None] * (1 - opacity)
+
+    blended = np.array(render_heatmap(image, heatmap))
+    # карта квантуется с округлением, а не отбрасыванием дробной части
+    np.testing.assert_allclose(composite, blended, atol=3)
+
+
+class TestExtractRegions:
+  @pytest.fixture
+  def two_spots(self):
+    left = make_example_heatmap(120, 80, 30, 40, 6)
+    right = 0.6 * make_example_heatmap(120, 80, 90, 30, 5)
+    return apply_threshold(np.maximum(left, right))
+
+  def test_regions(self, two_spots):
+    first, second = extract_regions(two_spots)
+
+    assert first.peak == pytest.approx(1.0, abs=1e-3) and second.peak == pytest.approx(0.6, abs=1e-3)
+    assert first.centroid == pytest.approx((30, 40), abs=0.5)
+    assert second.centroid == pytest.approx((90, 30), abs=0.5)
+    for region, mask in [(first, two_spots[:, :60] > 0), (second, two_spots[:, 60:] > 0)]:
+      assert region.area == mask.sum()
+      assert 0 < region.mean < region.peak
+      x, y, w, h = region.bbox
+      assert all(x <= px <= x + w and y <= py <= y + h for px, py in region.polygon)
+      assert 3 <= len(region.polygon) < 40
+
+  def test_scaled_to_dimensions(self, two_spots):
+    regions = extract_regions(two_spots)
+    scaled = extract_regions(two_spots, dimensions=(240, 160))
+
+    for region, big in zip(regions, scaled):
+      assert big.bbox == tuple(2 * v for v in region.bbox)
+      assert big.area == 4 * region.area
+      assert big.centroid == pytest.approx(tuple(2 * v for v in region.centroid), abs=0.1)
+      assert big.peak == region.peak
+
+  def test_empty(self):
+    assert extract_regions(np.zeros((10, 10), dtype=np.float32)) == []
+
+
+class TestEncodeHeatmap:
+  def test_uint8(self, heatmap):
+    array = encode_heatmap(heatmap, PointsFormat.UINT8)
+
+    assert array.shape == (80, 120)
+    assert array.dimensions == (120, 80)
+    values = decode(array, '<u1').reshape(array.shape)
+    np.testing.assert_allclose(values / 255, heatmap, atol=1 / 255)
+
+  def test_float16(self, heatmap):
+    array = encode_heatmap(heatmap, PointsFormat.FLOAT16)
+
+    assert array.dtype == 'float16'
+    values = decode(array, '<f2').reshape(array.shape)
+    np.testing.assert_allclose(values, heatmap, atol=1e-3)
+
+  def test_grid(self, heatmap):
+    array = encode_heatmap(heatmap, PointsFormat.GRID, grid_size=30)
+
+    assert array.shape == (20, 30)
+    assert array.dimensions == (120, 80)
+    assert len(decode(array, '<u1')) == 20 * 30
+
+  def test_source_dimensions(self, heatmap):
+    array = encode_heatmap(heatmap, PointsFormat.UINT8, dimensions=(1200, 800))
+
+    assert array.shape == (80, 120)
+    assert array.dimensions == (1200, 800)
+
+  def test_rle(self, heatmap):
+    array = encode_heatmap(heatmap, PointsFormat.RLE)
+
+    values = decode(array, '<u1')
+    lengths = np.frombuffer(base64.b64decode(array.runs), dtype='<u4')
+    restored = np.repeat(values, lengths).reshape(array.shape)
+    np.testing.assert_array_equal(restored, np.rint(heatmap * 255).astype(np.uint8))
+
+  def test_list_is_not_an_array_format(self, heatmap):
+    with pytest.raises(ValueError):
+      encode_heatmap(heatmap, PointsFormat.LIST)
+
+
+class TestHelpers:
+  def test_run_length_encode(self):
+    values, lengths = run_length_encode(np.array([0, 0, 5, 5, 5, 0, 255], dtype=np.uint8))
+
+    assert values.tolist() == [0, 5, 0, 255]
+    assert lengths.tolist() == [2, 3, 1, 1]
+
+  def test_downsample_keeps_small(self, heatmap):
+    assert downsample_heatmap(heatmap, 1000) is heatmap
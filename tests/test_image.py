@@ -8,8 +8,47 @@ import os
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from image import process_image, encode_image
+from image import (
+  process_image, prepare_image, image_size, encode_image, save_image, fit_shape, downscale_image, read_dicom,
+  IMAGE_MIME_TYPES,
+)
 from PIL import Image, UnidentifiedImageError
+import numpy as np
+from pydicom.dataset import Dataset, FileMetaDataset
+from pydicom.sequence import Sequence
+from pydicom.uid import ExplicitVRLittleEndian, generate_uid
+
+from schemas import ImageFormat
+
+
+def make_dicom(pixels, **attrs):
+  meta = FileMetaDataset()
+  meta.MediaStorageSOPClassUID = '1.2.840.10008.5.1.4.1.1.1'
+  meta.MediaStorageSOPInstanceUID = generate_uid()
+  meta.TransferSyntaxUID = ExplicitVRLittleEndian
+
+  ds = Dataset()
+  ds.file_meta = meta
+  ds.SOPClassUID = meta.MediaStorageSOPClassUID
+  ds.SOPInstanceUID = meta.MediaStorageSOPInstanceUID
+  ds.Modality = 'DX'
+  ds.Rows, ds.Columns = pixels.shape[-2:]
+  if pixels.ndim == 3:
+    ds.NumberOfFrames = pixels.shape[0]
+  ds.SamplesPerPixel = 1
+  ds.PhotometricInterpretation = 'MONOCHROME2'
+  ds.BitsAllocated = pixels.dtype.itemsize * 8
+  ds.BitsStored = ds.BitsAllocated
+  ds.HighBit = ds.BitsStored - 1
+  ds.PixelRepresentation = 1 if pixels.dtype.kind == 'i' else 0
+  for name, value in attrs.items():
+    setattr(ds, name, value)
+  ds.PixelData = pixels.tobytes()
+
+  buf = BytesIO()
+  ds.save_as(buf, enforce_file_format=True)
+  buf.seek(0)
+  return buf
 
 
 class TestProcessImage:
@@ -102,6 +141,115 @@ class TestProcessImage:
         pass
 
 
+class TestPrepareImage:
+  def make_image(self, size, format, mode='RGB'):
+    img = Image.new(mode, size, color='gray')
+    img_bytes = BytesIO()
+    img.save(img_bytes, format=format)
+    img_bytes.seek(0)
+    return Image.open(img_bytes)
+
+  def test_full_size(self):
+    im = self.make_image((300, 200), 'PNG')
+
+    img = prepare_image(im)
+
+    assert img.shape == (200, 300)
+    assert img.dtype == np.uint8
+
+  def test_jpeg_draft(self):
+    im = self.make_image((3000, 2000), 'JPEG')
+    size = image_size(im)
+
+    img = prepare_image(im, 1024)
+
+    assert size == (3000, 2000)
+    assert img.shape == fit_shape((2000, 3000), 1024)
+
+  def test_png_reduce(self):
+    im = self.make_image((3000, 2000), 'PNG', mode='L')
+
+    assert prepare_image(im, 1024).shape == fit_shape((2000, 3000), 1024)
+
+  def test_palette_image(self):
+    im = self.make_image((3000, 2000), 'GIF', mode='P')
+
+    assert prepare_image(im, 1024).shape == fit_shape((2000, 3000), 1024)
+
+  def test_array(self):
+    img = np.zeros((2000, 1000), dtype=np.uint8)
+
+    assert image_size(img) == (1000, 2000)
+    assert prepare_image(img, 500).shape == (500, 250)
+
+
+class TestReadDicom:
+  def test_12_bit_min_max(self):
+    pixels = np.array([[0, 1024], [2048, 4095]], dtype=np.uint16)
+
+    result = read_dicom(make_dicom(pixels, BitsStored=12, HighBit=11))
+
+    assert result.dtype == np.uint8
+    assert result.tolist() == [[0, 63], [127, 255]]
+
+  def test_rescale_and_window(self):
+    pixels = np.array([[0, 100], [200, 300]], dtype=np.uint16)
+
+    # после rescale значения -1000, -800, -600, -400; окно [-900, -500]
+    result = read_dicom(make_dicom(
+      pixels, RescaleSlope=2, RescaleIntercept=-1000, WindowCenter=-700, WindowWidth=400,
+    ))
+
+    assert result.tolist() == [[0, 63], [191, 255]]
+
+  def test_monochrome1_inverted(self):
+    pixels = np.array([[0, 255]], dtype=np.uint16)
+
+    result = read_dicom(make_dicom(pixels, PhotometricInterpretation='MONOCHROME1'))
+
+    assert result.tolist() == [[255, 0]]
+
+  def test_signed_16_bit(self):
+    pixels = np.array([[-32768, 32767]], dtype=np.int16)
+
+    assert read_dicom(make_dicom(pixels)).tolist() == [[0, 255]]
+
+  def test_voi_lut(self):
+    pixels = np.array([[0, 1, 2, 3]], dtype=np.uint16)
+    item = Dataset()
+    item.LUTDescriptor = [4, 0, 16]
+    item.LUTData = np.array([0, 10, 30, 40], dtype=np.uint16).tobytes()
+
+    result = read_dicom(make_dicom(pixels, VOILUTSequence=Sequence([item])))
+
+    assert result.tolist() == [[0, 63, 191, 255]]
+
+  def test_multi_frame_reads_first(self):
+    pixels = np.stack([np.array([[0, 10]], dtype=np.uint16), np.array([[10, 0]], dtype=np.uint16)])
+
+    assert read_dicom(make_dicom(pixels)).tolist() == [[0, 255]]
+
+  def test_invalid_dicom(self):
+    with pytest.raises(HTTPException) as exc_info:
+      read_dicom(BytesIO(b'dicom data'))
+
+    assert exc_info.value.status_code == 400
+
+  def test_process_dicom(self):
+    pixels = np.arange(64 * 48, dtype=np.uint16).reshape(48, 64)
+    buf = make_dicom(pixels)
+
+    mock_file = Mock(spec=UploadFile)
+    mock_file.size = len(buf.getvalue())
+    mock_file.file = buf
+    mock_file.filename = "test.dcm"
+
+    img = prepare_image(process_image(mock_file))
+
+    assert img.shape == (48, 64)
+    assert img.dtype == np.uint8
+
+
 class TestEncodeImage:
 
   def test_encode_image_valid(self):
@@ -135,6 +283,36 @@ class TestEncodeImage:
     decoded = base64.b64decode(result)
     assert decoded.startswith(b'\x89PNG')
 
+  @pytest.mark.parametrize('format', list(ImageFormat))
+  def test_save_image_formats(self, format):
+    img = Image.new('RGB', (100, 100), color='red')
+
+    data = save_image(img, format, quality=50, compress_level=1)
+
+    assert Image.open(BytesIO(data)).format == format.upper()
+    assert IMAGE_MIME_TYPES[format] == f'image/{format}'
+
+
+class TestDownscaleImage:
+  def test_fit_shape(self):
+    assert fit_shape((3000, 2500), 1024) == (1024, 853)
+    assert fit_shape((500, 400), 1024) == (500, 400)
+    assert fit_shape((3000, 2500), None) == (3000, 2500)
+    assert fit_shape((3000, 2500), 0) == (3000, 2500)
+
+  def test_downscale_large(self):
+    img = np.zeros((2000, 1000), dtype=np.uint8)
+
+    result = downscale_image(img, 500)
+
+    assert result.shape == (500, 250)
+    assert result.dtype == np.uint8
+
+  def test_downscale_keeps_small(self):
+    img = np.zeros((200, 100), dtype=np.uint8)
+
+    assert downscale_image(img, 500) is img
+
 
 class TestIntegration:
   def test_process_and_encode_integration(self):
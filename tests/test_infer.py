@@ -0,0 +1,116 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from PIL import Image
+
+import infer
+from infer import Checkpoint, JsonlWriter, ParquetWriter, find_images, iter_decoded, run_inference
+from model_.arch_model import run_model_batch
+from schemas import CamMethod, HeatmapMode
+
+
+@pytest.fixture
+def image_dir(tmp_path, xrays):
+  root = tmp_path / 'images'
+  (root / 'sub').mkdir(parents=True)
+  for i, img in enumerate(xrays):
+    Image.fromarray(img).save(root / ('sub' if i == 2 else '') / f'{i}.png')
+  (root / 'notes.txt').write_text('not an image')
+  return root
+
+
+def run(paths, model, output, heatmap_dir=None, writer_cls=JsonlWriter):
+  writer = writer_cls(str(output))
+  checkpoint = Checkpoint(str(output) + '.done')
+  try:
+    with ThreadPoolExecutor(2) as executor:
+      return run_inference(paths, model, writer, checkpoint, executor, cam=CamMethod.CAM,
+                           batch_size=2, prefetch=2, max_size=128, heatmap_dir=heatmap_dir)
+  finally:
+    writer.close()
+    checkpoint.close()
+
+
+class TestFindImages:
+  def test_directory_and_list(self, image_dir, tmp_path):
+    listing = tmp_path / 'list.txt'
+    listing.write_text(f'{image_dir / "0.png"}\n\n')
+
+    assert [p.removeprefix(str(image_dir) + '/') for p in find_images([str(image_dir)], '*.png')] \
+      == ['0.png', '1.png', 'sub/2.png']
+    assert list(find_images([f'@{listing}'])) == [str(image_dir / '0.png')]
+
+
+class TestIterDecoded:
+  def test_order_and_errors(self, image_dir, xrays):
+    paths = [str(image_dir / '0.png'), str(image_dir / 'notes.txt'), str(image_dir / 'missing.png')]
+    with ThreadPoolExecutor(2) as executor:
+      items = list(iter_decoded(paths, executor, None, prefetch=1))
+
+    assert [item.path for item in items] == paths
+    assert (items[0].img == xrays[0]).all() and items[0].dimensions == (250, 300)
+    assert items[1].error == 'Invalid file type'
+    assert items[2].error is not None and items[2].img is None
+
+  def test_decompression_bomb(self, image_dir, monkeypatch):
+    monkeypatch.setattr(Image, 'MAX_IMAGE_PIXELS', 1000)
+    paths = [str(image_dir / '0.png')]
+    with ThreadPoolExecutor(1) as executor:
+      item, = iter_decoded(paths, executor, None, prefetch=1)
+
+    assert item.img is None and 'decompression bomb' in item.error
+
+
+class TestRunInference:
+  def test_jsonl_with_heatmaps(self, model, image_dir, tmp_path):
+    output = tmp_path / 'results.jsonl'
+    paths = list(find_images([str(image_dir)]))
+
+    assert run(paths, model, output, heatmap_dir=str(tmp_path / 'heatmaps')) == 4
+
+    records = [json.loads(line) for line in output.read_text().splitlines()]
+    assert [r['path'] for r in records] == paths
+    for r in records:
+      if r['path'].endswith('.txt'):
+        assert r['error'] == 'Invalid file type' and r['diagnosis'] is None
+      else:
+        assert r['error'] is None and abs(sum(r['probabilities'].values()) - 1) < 1e-5
+        with Image.open(r['heatmap']) as im:
+          assert max(im.size) == 128
+
+  def test_resume(self, model, image_dir, tmp_path):
+    output = tmp_path / 'results.jsonl'
+    paths = list(find_images([str(image_dir)], '*.png'))
+
+    assert run(paths[:2], model, output) == 2
+    assert run(paths, model, output) == 1
+
+    records = [json.loads(line) for line in output.read_text().splitlines()]
+    assert [r['path'] for r in records] == paths
+
+  def test_no_heatmaps_without_heatmap_dir(self, model, image_dir, tmp_path, monkeypatch):
+    calls = []
+
+    def spy(*args, **kwargs):
+      calls.append(kwargs['heatmaps'])
+      outputs = run_model_batch(*args, **kwargs)
+      assert all(cam is None for _, _, cam in outputs)
+      return outputs
+
+    monkeypatch.setattr(infer, 'run_model_batch', spy)
+    run(list(find_images([str(image_dir)], '*.png')), model, tmp_path / 'results.jsonl')
+
+    assert calls and all(mode == HeatmapMode.NONE for heatmaps in calls for mode in heatmaps)
+
+  def test_parquet(self, model, image_dir, tmp_path):
+    pq = pytest.importorskip('pyarrow.parquet')
+    output = tmp_path / 'results.parquet'
+    paths = list(find_images([str(image_dir)], '*.png'))
+
+    run(paths[:1], model, output, writer_cls=ParquetWriter)
+    run(paths, model, output, writer_cls=ParquetWriter)
+
+    first, second = pq.read_table(output), pq.read_table(tmp_path / 'results.1.parquet')
+    assert first['path'].to_pylist() + second['path'].to_pylist() == paths
+    assert 'probability_normal' in first.column_names
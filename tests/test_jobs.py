@@ -0,0 +1,134 @@
+import json
+import threading
+import time
+
+import pytest
+
+from batching import QueueFull
+from jobs import JobQueue
+from schemas import JobState
+
+
+@pytest.fixture
+def queue(tmp_path):
+  queue = JobQueue(str(tmp_path / 'jobs.sqlite3'))
+  yield queue
+  queue.close()
+
+
+class TestJobQueue:
+  def test_submit_and_claim(self, queue):
+    job_id = queue.submit([('a.png', b'a'), (None, b'b')], {'cam': 'cam'})
+
+    status = queue.get(job_id)
+    assert status.state == JobState.QUEUED and status.attempts == 0
+
+    job = queue.claim()
+    assert job.id == job_id
+    assert job.params == {'cam': 'cam'}
+    assert job.files == [('a.png', b'a'), (None, b'b')]
+    assert queue.get(job_id).state == JobState.RUNNING
+    assert queue.claim() is None
+
+  def test_priority_then_age(self, queue):
+    low = queue.submit([(None, b'')], {}, priority=0)
+    high = queue.submit([(None, b'')], {}, priority=5)
+    low_later = queue.submit([(None, b'')], {}, priority=0)
+
+    assert [queue.claim().id for _ in range(3)] == [high, low, low_later]
+
+  def test_complete_and_fail(self, queue):
+    done = queue.submit([(None, b'')], {})
+    failed = queue.submit([(None, b'')], {})
+    queue.complete(queue.claim().id, json.dumps([{'index': 0, 'filename': None, 'error': 'Invalid file type'}]))
+    queue.fail(queue.claim().id, 'boom')
+
+    status = queue.get(done)
+    assert status.state == JobState.DONE
+    assert status.result[0].error == 'Invalid file type'
+    assert status.finished_at >= status.started_at >= status.created_at
+    assert (queue.get(failed).state, queue.get(failed).error) == (JobState.FAILED, 'boom')
+
+  def test_queue_full(self, tmp_path):
+    queue = JobQueue(str(tmp_path / 'jobs.sqlite3'), max_queued=1)
+    queue.submit([(None, b'')], {})
+
+    with pytest.raises(QueueFull):
+      queue.submit([(None, b'')], {})
+    queue.claim()
+    queue.submit([(None, b'')], {})
+    queue.close()
+
+  def test_interrupted_job_is_retried_after_restart(self, tmp_path):
+    path = str(tmp_path / 'jobs.sqlite3')
+    crashed = JobQueue(path, lease=0.05)
+    job_id = crashed.submit([('a.png', b'a')], {})
+    crashed.claim()
+    # процесс упал, не завершив задание и не продлевая аренду
+    time.sleep(0.1)
+
+    restarted = JobQueue(path, lease=0.05)
+    job = restarted.claim()
+    assert (job.id, job.attempts, job.files) == (job_id, 2, [('a.png', b'a')])
+    restarted.close()
+    crashed.close()
+
+  def test_attempts_are_limited(self, tmp_path):
+    queue = JobQueue(str(tmp_path / 'jobs.sqlite3'), lease=0.01, max_attempts=2)
+    job_id = queue.submit([(None, b'')], {})
+    for _ in range(2):
+      assert queue.claim().id == job_id
+      queue._running.clear()
+      time.sleep(0.02)
+      queue.maintain()
+
+    status = queue.get(job_id)
+    assert status.state == JobState.FAILED and status.attempts == 2
+    queue.close()
+
+  def test_lease_is_renewed(self, tmp_path):
+    queue = JobQueue(str(tmp_path / 'jobs.sqlite3'), lease=0.05)
+    job_id = queue.submit([(None, b'')], {})
+    queue.claim()
+    for _ in range(3):
+      time.sleep(0.02)
+      queue.maintain()
+
+    assert queue.get(job_id).state == JobState.RUNNING
+    queue.close()
+
+  def test_finished_jobs_expire(self, tmp_path):
+    queue = JobQueue(str(tmp_path / 'jobs.sqlite3'), ttl=0.01)
+    job_id = queue.submit([(None, b'')], {})
+    queue.complete(queue.claim().id, '[]')
+    time.sleep(0.02)
+
+    assert queue.get(job_id) is None
+    queue.maintain()
+    assert queue._db.execute('SELECT COUNT(*) FROM jobs').fetchone() == (0,)
+    queue.close()
+
+  def test_workers(self, queue):
+    started = threading.Event()
+    release = threading.Event()
+
+    def handler(job):
+      if job.params.get('fail'):
+        raise ValueError('bad job')
+      started.set()
+      release.wait(5)
+      return json.dumps([{'index': 0, 'filename': job.files[0][0]}])
+
+    queue.start(handler, workers=1, poll_interval=0.01)
+    first = queue.submit([('a.png', b'a')], {})
+    assert started.wait(5)
+    # единственный поток занят, следующие задания ждут в очереди
+    failing = queue.submit([(None, b'')], {'fail': True})
+    assert queue.get(failing).state == JobState.QUEUED
+    release.set()
+
+    deadline = time.time() + 5
+    while queue.get(failing).state != JobState.FAILED and time.time() < deadline:
+      time.sleep(0.01)
+    assert queue.get(first).result[0].filename == 'a.png'
+    assert queue.get(failing).error == 'bad job'
@@ -0,0 +1,154 @@
+import threading
+import time
+
+import pytest
+import torch
+from fastapi.testclient import TestClient
+
+import main
+from jobs import JobQueue
+from schemas import BatchItem, CamMethod, CpuOptimization, HeatmapMode, ImageFormat, InferenceBackend, JobState
+
+
+class TestProbes:
+  def test_not_ready_before_model_is_loaded(self, monkeypatch):
+    monkeypatch.setattr(main, 'pipeline', None)
+    # без with lifespan не запускается, и модель не загружается
+    client = TestClient(main.app)
+
+    assert client.get('/healthz').json() == {'status': 'ok'}
+    assert client.get('/readyz').status_code == 503
+    response = client.post('/api/analyze', files={'image': ('a.png', b'x', 'image/png')})
+    assert response.status_code == 503
+    assert response.headers['retry-after'] == '1'
+
+  def test_ready(self, monkeypatch):
+    monkeypatch.setattr(main, 'pipeline', object())
+    client = TestClient(main.app)
+
+    assert client.get('/readyz').json()['status'] == 'ready'
+
+  def test_load_error(self, monkeypatch):
+    monkeypatch.setattr(main, 'load_error', FileNotFoundError('best_model.pth'))
+    client = TestClient(main.app)
+
+    assert client.get('/healthz').status_code == 500
+
+
+class TestThreads:
+  def test_set_again_in_same_process(self):
+    main.set_thread_counts()
+    # второй запуск приложения в процессе: inter-op потоки уже заданы
+    main.set_thread_counts.cache_clear()
+    main.set_thread_counts()
+
+    assert torch.get_num_threads() == main.NUM_THREADS
+
+
+class TestBuildModel:
+  def test_hash_depends_on_backend(self, model, tmp_path, monkeypatch):
+    path = tmp_path / 'model.pth'
+    torch.save(model.state_dict(), path)
+
+    _, eager_hash = main.build_model(str(path))
+    monkeypatch.setattr(main, 'INFERENCE_BACKEND', InferenceBackend.TORCHSCRIPT)
+    _, torchscript_hash = main.build_model(str(path))
+
+    assert eager_hash != torchscript_hash
+
+  def test_hash_depends_on_cpu_optimizations(self, model, tmp_path, monkeypatch):
+    path = tmp_path / 'model.pth'
+    torch.save(model.state_dict(), path)
+
+    _, default_hash = main.build_model(str(path))
+    monkeypatch.setattr(main, 'CPU_OPTIMIZATIONS', [CpuOptimization.BF16, CpuOptimization.CHANNELS_LAST])
+    _, optimized_hash = main.build_model(str(path))
+    monkeypatch.setattr(main, 'CPU_OPTIMIZATIONS', [CpuOptimization.CHANNELS_LAST, CpuOptimization.BF16])
+
+    assert optimized_hash != default_hash
+    assert main.build_model(str(path))[1] == optimized_hash
+
+
+@pytest.fixture
+def job_queue(tmp_path, monkeypatch):
+  queue = JobQueue(str(tmp_path / 'jobs.sqlite3'))
+  monkeypatch.setattr(main, 'jobs', queue)
+  yield queue
+  queue.close()
+
+
+class TestJobs:
+  def test_rejects_invalid_sizes(self, job_queue, monkeypatch):
+    client = TestClient(main.app)
+
+    empty = client.post('/api/jobs', files={'images': ('a.png', b'', 'image/png')})
+    huge = client.post('/api/jobs', files={'images': ('a.png', b'\0' * (main.MAX_SIZE + 1), 'image/png')})
+    monkeypatch.setattr(main, 'JOB_MAX_BYTES', 10)
+    too_large = client.post('/api/jobs', files=[('images', ('a.png', b'\0' * 6, 'image/png'))] * 2)
+
+    assert (empty.status_code, huge.status_code, too_large.status_code) == (400, 400, 413)
+    assert job_queue._db.execute('SELECT COUNT(*) FROM jobs').fetchone() == (0,)
+
+  def test_queue_is_closed_on_shutdown(self, tmp_path, monkeypatch):
+    monkeypatch.setattr(main, 'JOBS_PATH', str(tmp_path / 'jobs.sqlite3'))
+    started = threading.Event()
+
+    def load_model():
+      main.jobs.start(main.run_job, 1)
+      started.set()
+
+    monkeypatch.setattr(main, 'load_model', load_model)
+
+    with TestClient(main.app):
+      assert started.wait(5)
+      threads = list(main.jobs._threads)
+
+    assert main.jobs is None
+    assert not any(thread.is_alive() for thread in threads)
+
+  @pytest.mark.parametrize('format', [ImageFormat.JPEG, None])
+  def test_job_runs_through_pipeline(self, tmp_path, monkeypatch, format):
+    calls = []
+
+    class Pipeline:
+      # заглушка вместо модели: запоминает аргументы и отвечает ошибкой на каждый файл
+      def analyze_many(self, images, cam, points, window, format, overlay, version, heatmap, regions):
+        files = [(image.filename, image.file.read()) for image in images]
+        calls.append((files, cam, format, version, heatmap, regions))
+        return [BatchItem(index=i, filename=filename, error='stub') for i, (filename, _) in enumerate(files)]
+
+    def load_model():
+      main.pipeline = Pipeline()
+      main.jobs.start(main.run_job, 1)
+
+    monkeypatch.setattr(main, 'pipeline', None)
+    monkeypatch.setattr(main, 'JOBS_PATH', str(tmp_path / 'jobs.sqlite3'))
+    monkeypatch.setattr(main, 'load_model', load_model)
+    params = {'cam': 'cam', 'heatmap': 'none', 'regions': 'true'} | ({'format': format} if format else {})
+
+    with TestClient(main.app) as client:
+      response = client.post('/api/jobs', params=params, files=[
+        ('images', ('a.png', b'first', 'image/png')),
+        ('images', ('b.png', b'second', 'image/png')),
+      ])
+      assert response.status_code == 202
+      job_id = response.json()['id']
+      deadline = time.time() + 5
+      while (status := client.get(f'/api/jobs/{job_id}').json())['state'] != JobState.DONE and time.time() < deadline:
+        time.sleep(0.01)
+
+    assert [item['filename'] for item in status['result']] == ['a.png', 'b.png']
+    (files, cam, job_format, version, heatmap, regions), = calls
+    assert files == [('a.png', b'first'), ('b.png', b'second')]
+    assert (cam, job_format, version, heatmap, regions) == (CamMethod.CAM, format, None, HeatmapMode.NONE, True)
+    assert type(cam) is CamMethod and type(heatmap) is HeatmapMode
+
+  def test_ensemble_only_where_given(self, model, tmp_path):
+    path = tmp_path / 'model.pth'
+    torch.save(model.state_dict(), path)
+
+    single, single_hash = main.build_model(str(path))
+    ensemble, ensemble_hash = main.build_model(str(path), ensemble_paths=[str(path)])
+
+    assert (len(single.ensemble), len(ensemble.ensemble)) == (0, 1)
+    assert single_hash != ensemble_hash
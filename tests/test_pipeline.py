@@ -0,0 +1,280 @@
+import asyncio
+import base64
+import copy
+import threading
+from concurrent.futures import Future
+from io import BytesIO
+
+import numpy as np
+import pytest
+import torch
+from fastapi import HTTPException, UploadFile
+from PIL import Image
+from prometheus_client import REGISTRY
+
+from archive import DamagedUpload
+from cache import LRUCache, ResultCache
+from pipeline import AnalysisPipeline
+from model_.arch_model import CLASS_NAMES, run_model_batch
+from registry import new_version
+from schemas import AnalysisResult, CamMethod, Diagnosis, HeatmapMode, ImageFormat, OverlayMode, PointsFormat
+
+
+def make_upload(img, filename='test.png'):
+  buf = BytesIO()
+  Image.fromarray(img).save(buf, format='PNG')
+  return UploadFile(BytesIO(buf.getvalue()), size=len(buf.getvalue()), filename=filename)
+
+
+@pytest.fixture
+def pipeline(model):
+  return AnalysisPipeline(model, 'model-hash', ResultCache(LRUCache(max_entries=10)), max_size=128)
+
+
+class TestAnalysisPipeline:
+  def test_analyze(self, pipeline, xrays):
+    result = pipeline.analyze(make_upload(xrays[0]), CamMethod.CAM, PointsFormat.GRID)
+
+    assert isinstance(result, AnalysisResult)
+    assert result.heatmap_image.dimensions == (250, 300)
+    assert result.heatmap_points.dimensions == (250, 300)
+
+  def test_list_points_in_source_pixels(self, pipeline, xrays):
+    # снимок 250x300 больше max_size=128, карта строится уменьшенной
+    result = pipeline.analyze(make_upload(xrays[0]), CamMethod.CAM, PointsFormat.LIST)
+
+    xs = [point.x for point in result.heatmap_points]
+    ys = [point.y for point in result.heatmap_points]
+    assert 0 <= min(xs) and max(xs) < 250 and 0 <= min(ys) and max(ys) < 300
+    assert max(xs) >= 128 or max(ys) >= 128
+
+  def test_cache_hit(self, pipeline, xrays):
+    first = pipeline.analyze(make_upload(xrays[0]), CamMethod.CAM, PointsFormat.GRID)
+    second = pipeline.analyze(make_upload(xrays[0]), CamMethod.CAM, PointsFormat.GRID)
+
+    assert second.heatmap_points == first.heatmap_points
+    assert pipeline.cache.stats().hits == 1
+
+  def test_image_format(self, pipeline, xrays):
+    png = pipeline.analyze(make_upload(xrays[0]), CamMethod.CAM, PointsFormat.GRID)
+    jpeg = pipeline.analyze(make_upload(xrays[0]), CamMethod.CAM, PointsFormat.GRID, image_format=ImageFormat.JPEG)
+
+    assert png.heatmap_image.mime == 'image/png'
+    assert jpeg.heatmap_image.mime == 'image/jpeg'
+    assert base64.b64decode(jpeg.heatmap_image.base64).startswith(b'\xff\xd8')
+    # формат входит в ключ кэша
+    assert pipeline.cache.stats().hits == 0
+
+  def test_overlay_layer(self, model, xrays):
+    pipeline = AnalysisPipeline(model, 'model-hash', ResultCache(LRUCache(max_entries=10)), max_size=128, layer_size=32)
+
+    result = pipeline.analyze(make_upload(xrays[0]), CamMethod.CAM, PointsFormat.GRID,
+                              image_format=ImageFormat.WEBP, overlay=OverlayMode.LAYER)
+
+    layer = Image.open(BytesIO(base64.b64decode(result.heatmap_image.base64)))
+    assert layer.mode == 'RGBA'
+    assert max(layer.size) == 32
+    assert result.heatmap_image.dimensions == (250, 300)
+
+    with pytest.raises(HTTPException) as e:
+      pipeline.analyze(make_upload(xrays[0]), CamMethod.CAM, PointsFormat.GRID,
+                       image_format=ImageFormat.JPEG, overlay=OverlayMode.LAYER)
+    assert e.value.status_code == 400
+
+  def test_switch_version(self, pipeline, model, xrays):
+    normal_model = copy.deepcopy(model)
+    with torch.no_grad():
+      normal_model.classifier.bias.zero_()
+      normal_model.classifier.bias[CLASS_NAMES.index(Diagnosis.NORMAL)] = 1e3
+
+    # запрос, принятый до переключения, досчитывается старой версией
+    pending = pipeline.submit(make_upload(xrays[0]), CamMethod.CAM, PointsFormat.GRID)
+    pipeline.load_version('v2', lambda: (normal_model, 'hash-2'), activate=True).result(30)
+
+    old = pipeline.finish(pending)
+    new = pipeline.analyze(make_upload(xrays[0]), CamMethod.CAM, PointsFormat.GRID)
+    canary = pipeline.analyze(make_upload(xrays[0]), CamMethod.CAM, PointsFormat.GRID, version='default')
+
+    assert old.model_version == 'default' and old.diagnosis != Diagnosis.NORMAL
+    assert (new.model_version, new.diagnosis) == ('v2', Diagnosis.NORMAL)
+    assert canary.model_version == 'default' and canary.diagnosis == old.diagnosis
+    with pytest.raises(HTTPException) as e:
+      pipeline.analyze(make_upload(xrays[0]), CamMethod.CAM, PointsFormat.GRID, version='v3')
+    assert e.value.status_code == 404
+
+  def test_mixed_versions_in_batch(self, pipeline, model, xrays):
+    other = copy.deepcopy(model)
+    with torch.no_grad():
+      other.classifier.bias[0] += 5
+    pipeline.registry.add(new_version('v2', other, 'hash-2'))
+    first, second = pipeline.registry.get('default'), pipeline.registry.get('v2')
+
+    mixed = pipeline._run_batch([
+      (xrays[0], CamMethod.CAM, first, Future(), HeatmapMode.EAGER),
+      (xrays[0], CamMethod.CAM, second, Future(), HeatmapMode.EAGER),
+    ])
+
+    assert mixed[0][0][1] == pytest.approx(run_model_batch([xrays[0]], model, [CamMethod.CAM], 128)[0][1])
+    assert mixed[1][0][1] == pytest.approx(run_model_batch([xrays[0]], other, [CamMethod.CAM], 128)[0][1])
+
+  def test_lazy_heatmap(self, pipeline, xrays):
+    eager = pipeline.analyze(make_upload(xrays[0]), CamMethod.CAM, PointsFormat.GRID)
+    lazy = pipeline.analyze(make_upload(xrays[0]), CamMethod.CAM, PointsFormat.GRID, heatmap=HeatmapMode.LAZY)
+
+    assert lazy.heatmap_image is None and lazy.heatmap_points is None
+    assert lazy.probabilities == eager.probabilities and eager.result_id is None
+
+    heatmap = pipeline.heatmap(lazy.result_id, None, CamMethod.CAM, PointsFormat.GRID)
+    assert heatmap.diagnosis == lazy.diagnosis
+    assert heatmap.heatmap_image.dimensions == (250, 300)
+    assert heatmap.heatmap_points.data == eager.heatmap_points.data
+
+    normal = pipeline.heatmap(lazy.result_id, Diagnosis.NORMAL, CamMethod.GRADCAM, PointsFormat.GRID)
+    assert normal.diagnosis == Diagnosis.NORMAL
+    assert normal.heatmap_points.data != heatmap.heatmap_points.data
+
+  def test_lazy_heatmap_expired(self, pipeline, xrays):
+    first = pipeline.analyze(make_upload(xrays[0]), CamMethod.CAM, PointsFormat.GRID, heatmap=HeatmapMode.LAZY)
+    cached = pipeline.analyze(make_upload(xrays[0]), CamMethod.CAM, PointsFormat.GRID, heatmap=HeatmapMode.LAZY)
+    assert cached.result_id == first.result_id
+    assert pipeline.cache.stats().hits == 1
+
+    pipeline.features.pop(first.result_id)
+    with pytest.raises(HTTPException) as e:
+      pipeline.heatmap(first.result_id, None, CamMethod.CAM, PointsFormat.GRID)
+    assert e.value.status_code == 404
+
+    # без признаков результат из кэша не годится, снимок анализируется заново
+    again = pipeline.analyze(make_upload(xrays[0]), CamMethod.CAM, PointsFormat.GRID, heatmap=HeatmapMode.LAZY)
+    assert pipeline.cache.stats().hits == 1
+    assert pipeline.heatmap(again.result_id, None, CamMethod.CAM, PointsFormat.GRID).heatmap_image is not None
+
+  def test_regions(self, pipeline, xrays):
+    plain = pipeline.analyze(make_upload(xrays[0]), CamMethod.CAM, PointsFormat.GRID)
+    result = pipeline.analyze(make_upload(xrays[0]), CamMethod.CAM, PointsFormat.GRID, regions=True)
+
+    assert plain.heatmap_regions is None
+    assert result.heatmap_regions
+    width, height = result.heatmap_image.dimensions
+    for region in result.heatmap_regions:
+      x, y, w, h = region.bbox
+      assert 0 <= x and x + w <= width and 0 <= y and y + h <= height
+
+    lazy = pipeline.analyze(make_upload(xrays[0]), CamMethod.CAM, PointsFormat.GRID, heatmap=HeatmapMode.LAZY)
+    heatmap = pipeline.heatmap(lazy.result_id, None, CamMethod.CAM, PointsFormat.GRID, regions=True)
+    assert heatmap.heatmap_regions == result.heatmap_regions
+
+  def test_no_heatmap(self, pipeline, xrays):
+    result = pipeline.analyze(make_upload(xrays[0]), CamMethod.CAM, PointsFormat.GRID, heatmap=HeatmapMode.NONE)
+
+    assert result.diagnosis != Diagnosis.NORMAL
+    assert result.heatmap_image is None and result.result_id is None
+    assert len(pipeline.features) == 0
+
+  def test_analyze_stream(self, pipeline, xrays):
+    async def collect():
+      events = await pipeline.analyze_stream(make_upload(xrays[0]), CamMethod.GRADCAM, PointsFormat.GRID)
+      return [event async for event in events]
+
+    events = asyncio.run(collect())
+    cached = asyncio.run(collect())
+
+    assert [event.event for event in events] == ['diagnosis', 'heatmap_image', 'heatmap_points', 'done']
+    first, image, points, done = events
+    assert first.diagnosis != Diagnosis.NORMAL and first.heatmap_image is None
+    assert 0 < first.time_to_first_result <= done.processing_time
+    assert image.heatmap_image.dimensions == (250, 300)
+    assert points.heatmap_points.encoding == 'grid'
+    # из кэша приходят те же события
+    assert [event.event for event in cached] == [event.event for event in events]
+    assert cached[0].probabilities == first.probabilities
+
+  def test_analyze_stream_rejects_before_streaming(self, pipeline):
+    upload = UploadFile(BytesIO(b'not an image'), size=12, filename='bad.txt')
+
+    with pytest.raises(HTTPException) as e:
+      asyncio.run(pipeline.analyze_stream(upload, CamMethod.CAM, PointsFormat.GRID))
+    assert e.value.status_code == 400
+
+  def test_analyze_many(self, pipeline, xrays):
+    uploads = [make_upload(img, f'{i}.png') for i, img in enumerate(xrays)]
+    uploads.insert(1, UploadFile(BytesIO(b'not an image'), size=12, filename='bad.txt'))
+
+    items = sorted(pipeline.analyze_many(uploads, CamMethod.CAM, PointsFormat.GRID, window=2),
+                   key=lambda item: item.index)
+
+    assert [item.filename for item in items] == ['0.png', 'bad.txt', '1.png', '2.png']
+    assert items[1].error == 'Invalid file type' and items[1].result is None
+    for item, img in zip([items[0], *items[2:]], xrays):
+      assert item.error is None
+      assert item.result.heatmap_image.dimensions == (img.shape[1], img.shape[0])
+      single = pipeline.analyze(make_upload(img), CamMethod.CAM, PointsFormat.GRID)
+      assert item.result.diagnosis == single.diagnosis
+
+  def test_analyze_many_truncated_image(self, pipeline, xrays):
+    buf = BytesIO()
+    Image.fromarray(xrays[0]).save(buf, 'JPEG')
+    truncated = buf.getvalue()[:len(buf.getvalue()) // 2]
+    uploads = [UploadFile(BytesIO(truncated), size=len(truncated), filename='truncated.jpg'), make_upload(xrays[1])]
+
+    items = sorted(pipeline.analyze_many(uploads, CamMethod.CAM, PointsFormat.GRID), key=lambda item: item.index)
+
+    assert items[0].result is None and 'truncated' in items[0].error
+    assert items[1].error is None
+
+  def test_analyze_many_damaged_upload(self, pipeline, xrays):
+    uploads = [DamagedUpload('study.zip', 'Invalid archive'), make_upload(xrays[1])]
+
+    items = sorted(pipeline.analyze_many(uploads, CamMethod.CAM, PointsFormat.GRID), key=lambda item: item.index)
+
+    assert (items[0].filename, items[0].error) == ('study.zip', 'Invalid archive')
+    assert items[1].error is None
+
+  def test_analyze_async(self, pipeline, xrays):
+    result = asyncio.run(pipeline.analyze_async(make_upload(xrays[1]), CamMethod.GRADCAM, PointsFormat.RLE))
+
+    assert result.heatmap_points.encoding == 'rle'
+    assert result.heatmap_image.dimensions == (256, 256)
+
+  def test_overloaded(self, model, xrays):
+    release = threading.Event()
+    pipeline = AnalysisPipeline(model, 'model-hash', ResultCache(LRUCache(max_entries=10)),
+                                max_wait_ms=0, max_size=128, max_queue_depth=1)
+    run_batch = pipeline._run_batch
+    pipeline.scheduler.run_batch = lambda items: release.wait(5) and run_batch(items)
+
+    pending = pipeline.submit(make_upload(xrays[0]), CamMethod.CAM, PointsFormat.GRID)
+    with pytest.raises(HTTPException) as e:
+      asyncio.run(pipeline.analyze_async(make_upload(xrays[1]), CamMethod.CAM, PointsFormat.GRID))
+    release.set()
+
+    assert e.value.status_code == 503
+    assert int(e.value.headers['Retry-After']) >= 1
+    assert pipeline.finish(pending).heatmap_points is not None
+
+  def test_stage_times(self, pipeline, xrays):
+    def count(stage):
+      labels = {'stage': stage, 'diagnosis': result.diagnosis, 'device': 'cpu'}
+      return REGISTRY.get_sample_value('xray_stage_seconds_count', labels)
+
+    result = pipeline.analyze(make_upload(xrays[2]), CamMethod.GRADCAM, PointsFormat.LIST)
+    assert set(result.stage_times) == {
+      'decode', 'cache', 'prepare', 'queue', 'transform', 'forward', 'backward', 'cam',
+      'render', 'encode', 'points',
+    }
+    assert all(seconds >= 0 for seconds in result.stage_times.values())
+    forward = count('forward')
+
+    cached = pipeline.analyze(make_upload(xrays[2]), CamMethod.GRADCAM, PointsFormat.LIST)
+    assert set(cached.stage_times) == {'decode', 'cache'}
+    assert count('forward') == forward >= 1
+
+  def test_analyze_profiled(self, model, xrays, tmp_path):
+    pipeline = AnalysisPipeline(model, 'model-hash', ResultCache(LRUCache(max_entries=10)),
+                                max_size=128, profile_dir=str(tmp_path))
+
+    result = pipeline.analyze_profiled(make_upload(xrays[0]), CamMethod.CAM, PointsFormat.GRID)
+
+    assert result.heatmap_points is not None
+    assert sorted(p.suffix for p in tmp_path.iterdir()) == ['.json', '.prof']
+    assert pipeline.scheduler.stats().batches == 0
@@ -0,0 +1,59 @@
+import threading
+
+import pytest
+
+from registry import ModelRegistry, new_version
+
+
+@pytest.fixture
+def registry():
+  return ModelRegistry(new_version('v1', 'model-1', 'hash-1'))
+
+
+class TestModelRegistry:
+  def test_get(self, registry):
+    assert registry.get().name == 'v1'
+    assert registry.get('v1').model == 'model-1'
+    with pytest.raises(KeyError):
+      registry.get('v2')
+
+  def test_load_and_activate(self, registry):
+    release = threading.Event()
+
+    def build():
+      release.wait(5)
+      return new_version('v2', 'model-2', 'hash-2')
+
+    future = registry.load('v2', build, activate=True)
+    # пока версия загружается, запросы идут в активную
+    assert registry.status()['versions']['v2'] == {'state': 'loading'}
+    assert registry.active.name == 'v1'
+    with pytest.raises(ValueError):
+      registry.load('v2', build)
+
+    release.set()
+    assert future.result(5).name == 'v2'
+    assert registry.active.model == 'model-2'
+    assert registry.status()['versions']['v2']['state'] == 'ready'
+
+  def test_failed_load(self, registry):
+    def build():
+      raise FileNotFoundError('v2.pth')
+
+    with pytest.raises(FileNotFoundError):
+      registry.load('v2', build, activate=True).result(5)
+
+    assert registry.active.name == 'v1'
+    assert registry.status()['versions']['v2'] == {'state': 'failed', 'error': 'v2.pth'}
+    # неудачную загрузку можно повторить
+    registry.load('v2', lambda: new_version('v2', 'model-2', 'hash-2')).result(5)
+    assert registry.status()['versions']['v2']['state'] == 'ready'
+
+  def test_remove(self, registry):
+    registry.add(new_version('v2', 'model-2', 'hash-2'))
+
+    with pytest.raises(ValueError):
+      registry.remove('v1')
+    registry.remove('v2')
+
+    assert list(registry.status()['versions']) == ['v1']
@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+import torch
+
+from model_.arch_model import CLASS_NAMES, run_model_batch
+from model_.tta import VIEWS, make_views, merge_cams
+from schemas import CamMethod
+
+
+def view_cams(cam, count):
+  # карты, которые дали бы виды, если бы модель видела cam как снимок
+  return make_views(cam[:, None], count)[:, 0]
+
+
+class TestViews:
+  def test_shapes(self):
+    tensor = torch.rand(2, 1, 32, 32)
+
+    views = make_views(tensor, 4)
+
+    assert views.shape == (8, 1, 32, 32)
+    torch.testing.assert_close(views[0], tensor[0])
+    torch.testing.assert_close(views[1], tensor[0].flip(-1))
+    torch.testing.assert_close(views[4], tensor[1])
+
+  def test_count_is_checked(self):
+    with pytest.raises(ValueError):
+      make_views(torch.rand(1, 1, 8, 8), len(VIEWS) + 1)
+
+  def test_merge_inverts_flip(self):
+    cam = torch.rand(3, 16, 16)
+
+    merged = merge_cams(view_cams(cam, 2), 2, (16, 16))
+
+    torch.testing.assert_close(merged, cam / cam.amax(dim=(1, 2), keepdim=True))
+
+  def test_merge_inverts_crops(self):
+    y, x = torch.meshgrid(torch.arange(64.0), torch.arange(64.0), indexing='ij')
+    cam = torch.exp(-((x - 30) ** 2 + (y - 36) ** 2) / 200)[None]
+
+    merged = merge_cams(view_cams(cam, len(VIEWS)), len(VIEWS), (64, 64))
+
+    # пересэмплирование вырезок немного размывает карту
+    assert merged.shape == (1, 64, 64)
+    assert (merged[0] - cam[0]).abs().max() < 0.1
+
+
+class TestRunModelBatchViews:
+  def test_views_average_flipped_images(self, model, xrays):
+    img = xrays[1]
+
+    (pred, probs, cam), = run_model_batch([img], model, views=2)
+    single = [run_model_batch([view], model)[0][1] for view in [img, np.ascontiguousarray(img[:, ::-1])]]
+
+    for name in CLASS_NAMES:
+      assert probs[name] == pytest.approx((single[0][name] + single[1][name]) / 2, abs=1e-4)
+    assert cam.shape == img.shape
+
+  @pytest.mark.parametrize('method', list(CamMethod))
+  def test_cam_shape(self, model, xrays, method):
+    for img, (pred, probs, cam) in zip(xrays, run_model_batch(xrays, model, [method] * 3, views=len(VIEWS))):
+      assert cam.shape == img.shape
+      assert cam.min() >= 0 and cam.max() == pytest.approx(1, abs=1e-3)
+      assert sum(probs.values()) == pytest.approx(1)
+
+  def test_ensemble_of_copies_matches_single(self, model, xrays, monkeypatch):
+    expected = run_model_batch(xrays, model)
+    monkeypatch.setattr(model, 'ensemble', [model], raising=False)
+
+    for (pred, probs, cam), (e_pred, e_probs, e_cam) in zip(run_model_batch(xrays, model), expected):
+      assert pred == e_pred
+      assert probs == pytest.approx(e_probs)
+      np.testing.assert_allclose(cam, e_cam, atol=1e-5)
@@ -82,61 +82,103 @@ document.addEventListener('DOMContentLoaded', () => {
         analyzeBtn.style.display = 'none';
         document.getElementById('loading').style.display = 'block';
 
-        const data = new FormData();
-        data.append('image', fileInput.files[0]);
-        fetch('/api/analyze', {
-            method: 'POST',
-            body: data,
-        })
-            .then((res) => res.json())
-            .then((res) => {
-                document.getElementById('loading').style.display = 'none';
-                analyzeBtn.disabled = false;
-                analyzeBtn.textContent = 'Начать диагностику';
-
-                // Открываем модальное окно
-                const modal = document.getElementById('result-modal');
-                const modalText = document.getElementById('modal-result-text');
-                const heatmapImg = document.getElementById('heatmap-image');
-
-                switch (res.diagnosis) {
-                    case 'normal':
-                        modalText.innerHTML = `
-                        <h3>Всё в норме!</h3>
-                        <p><strong>Вердикт:</strong> Признаков пневмонии не обнаружено.</p>
-                        <p><strong>Рекомендация:</strong> Лёгкие выглядят чистыми. Дополнительное обследование не требуется. 
-                        Продолжайте вести здоровый образ жизни, при появлении симптомов (кашель, температура, одышка) — обращайтесь к врачу.</p>
-                    `;
-                        break;
-                    case 'viral_pneumonia':
-                        modalText.innerHTML = `
-                        <h3>Вирусная пневмония</h3>
-                        <p><strong>Вердикт:</strong> Обнаружена вирусная пневмония.</p>
-                        <p><strong>Рекомендация:</strong> Срочно обратитесь к врачу. 
-                        Вирусная пневмония часто требует противовирусной терапии, симптоматического лечения и наблюдения. 
-                        Не занимайтесь самолечением — важно начать правильную терапию как можно раньше.</p>
-                    `;
-                        break;
-                    case 'bacterial_pneumonia':
-                        modalText.innerHTML = `
-                        <h3>Бактериальная пневмония</h3>
-                        <p><strong>Вердикт:</strong> Обнаружена бактериальная пневмония.</p>
-                        <p><strong>Рекомендация:</strong> Это состояние требует немедленного обращения к врачу! 
-                        Обычно назначаются антибиотики, иногда — госпитализация. 
-                        Не откладывайте визит — бактериальная пневмония может быстро прогрессировать.</p>
-                    `;
-                        break;
-                }
+        const modal = document.getElementById('result-modal');
+        const modalText = document.getElementById('modal-result-text');
+        const heatmapImg = document.getElementById('heatmap-image');
+
+        const showError = (message) => {
+            document.getElementById('loading').style.display = 'none';
+            analyzeBtn.style.display = 'block';
+            errorMessage.textContent = message || 'Не удалось выполнить диагностику.';
+            errorMessage.classList.add('show');
+        };
+
+        // Диагноз приходит сразу после forward-прохода, модалка открывается с ним
+        const showDiagnosis = (res) => {
+            document.getElementById('loading').style.display = 'none';
+            analyzeBtn.disabled = false;
+            analyzeBtn.textContent = 'Начать диагностику';
+
+            switch (res.diagnosis) {
+                case 'normal':
+                    modalText.innerHTML = `
+                    <h3>Всё в норме!</h3>
+                    <p><strong>Вердикт:</strong> Признаков пневмонии не обнаружено.</p>
+                    <p><strong>Рекомендация:</strong> Лёгкие выглядят чистыми. Дополнительное обследование не требуется. 
+                    Продолжайте вести здоровый образ жизни, при появлении симптомов (кашель, температура, одышка) — обращайтесь к врачу.</p>
+                `;
+                    break;
+                case 'viral_pneumonia':
+                    modalText.innerHTML = `
+                    <h3>Вирусная пневмония</h3>
+                    <p><strong>Вердикт:</strong> Обнаружена вирусная пневмония.</p>
+                    <p><strong>Рекомендация:</strong> Срочно обратитесь к врачу. 
+                    Вирусная пневмония часто требует противовирусной терапии, симптоматического лечения и наблюдения. 
+                    Не занимайтесь самолечением — важно начать правильную терапию как можно раньше.</p>
+                `;
+                    break;
+                case 'bacterial_pneumonia':
+                    modalText.innerHTML = `
+                    <h3>Бактериальная пневмония</h3>
+                    <p><strong>Вердикт:</strong> Обнаружена бактериальная пневмония.</p>
+                    <p><strong>Рекомендация:</strong> Это состояние требует немедленного обращения к врачу! 
+                    Обычно назначаются антибиотики, иногда — госпитализация. 
+                    Не откладывайте визит — бактериальная пневмония может быстро прогрессировать.</p>
+                `;
+                    break;
+            }
 
-                if (res.heatmap_image) {
+            heatmapImg.style.display = 'none';
+            modal.style.display = 'block';
+        };
+
+        const file = fileInput.files[0];
+        const imageSrc = document.querySelector('.preview-img').src;
+
+        // Карта досылается следом; слой накладывается на снимок здесь, а если
+        // браузер не смог его показать, просим у сервера готовое наложение
+        const showHeatmap = (image, overlayMode) => {
+            const src = `data:${image.mime};base64,${image.base64}`;
+            const composed = overlayMode === 'layer'
+                ? compositeHeatmap(imageSrc, src).catch(() => fetchBlendedHeatmap(file))
+                : Promise.resolve(src);
+            composed
+                .then((src) => {
+                    heatmapImg.src = src;
                     heatmapImg.style.display = 'flex';
-                    heatmapImg.src = `data:${res.heatmap_image.mime};base64,${res.heatmap_image.base64}`;
-                } else {
+                })
+                .catch(() => {
                     heatmapImg.style.display = 'none';
-                }
+                });
+        };
 
-                modal.style.display = 'block';
-            });
+        // Браузер декодирует не все форматы, которые принимает сервер (DICOM, TIFF):
+        // для них наложение строит сервер
+        loadImage(imageSrc)
+            .then(() => 'layer', () => 'blend')
+            .then((overlayMode) => fetch(`/api/analyze?stream=true&overlay=${overlayMode}&format=webp`, {
+                method: 'POST',
+                body: formData(file),
+            }).then((response) => ({ response, overlayMode })))
+            .then(({ response, overlayMode }) => {
+                if (!response.ok) {
+                    return response.json().then((res) => showError(res.detail));
+                }
+                return readEvents(response, (event) => {
+                    switch (event.event) {
+                        case 'diagnosis':
+                            showDiagnosis(event);
+                            break;
+                        case 'heatmap_image':
+                            showHeatmap(event.heatmap_image, overlayMode);
+                            break;
+                        case 'error':
+                            showError(event.detail);
+                            break;
+                    }
+                });
+            })
+            .catch(() => showError());
 
         // Закрытие модалки
         document.querySelector('.close-modal').addEventListener('click', () => {
@@ -165,6 +207,68 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     }
 
+    // Потоковый ответ: по одному JSON-событию на строку
+    async function readEvents(response, onEvent) {
+        const reader = response.body.pipeThrough(new TextDecoderStream()).getReader();
+        let buffer = '';
+        for (;;) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += value;
+            const lines = buffer.split('\n');
+            buffer = lines.pop();
+            lines.filter((line) => line.trim()).forEach((line) => onEvent(JSON.parse(line)));
+        }
+        if (buffer.trim()) onEvent(JSON.parse(buffer));
+    }
+
+    // Наложение тепловой карты на снимок
+    const MAX_HEATMAP_SIZE = 1024;
+
+    function loadImage(src) {
+        return new Promise((resolve, reject) => {
+            const img = new Image();
+            img.onload = () => resolve(img);
+            img.onerror = reject;
+            img.src = src;
+        });
+    }
+
+    function formData(file) {
+        const data = new FormData();
+        data.append('image', file);
+        return data;
+    }
+
+    function fetchBlendedHeatmap(file) {
+        return fetch('/api/analyze?overlay=blend&format=webp', { method: 'POST', body: formData(file) })
+            .then((response) => (response.ok ? response.json() : Promise.reject(response)))
+            .then((res) => {
+                if (!res.heatmap_image) return Promise.reject(res);
+                return `data:${res.heatmap_image.mime};base64,${res.heatmap_image.base64}`;
+            });
+    }
+
+    function compositeHeatmap(imageSrc, layerSrc) {
+        return Promise.all([loadImage(imageSrc), loadImage(layerSrc)]).then(([image, layer]) => {
+            const scale = Math.min(1, MAX_HEATMAP_SIZE / Math.max(image.naturalWidth, image.naturalHeight));
+            const canvas = document.createElement('canvas');
+            canvas.width = Math.round(image.naturalWidth * scale);
+            canvas.height = Math.round(image.naturalHeight * scale);
+
+            const ctx = canvas.getContext('2d');
+            // модель видит снимок в оттенках серого
+            ctx.filter = 'grayscale(1)';
+            ctx.drawImage(image, 0, 0, canvas.width, canvas.height);
+            ctx.filter = 'none';
+            // карта маленькая, растягиваем её со сглаживанием; прозрачность задана в самой карте
+            ctx.imageSmoothingEnabled = true;
+            ctx.imageSmoothingQuality = 'high';
+            ctx.drawImage(layer, 0, 0, canvas.width, canvas.height);
+            return canvas.toDataURL('image/jpeg', 0.92);
+        });
+    }
+
     // Превью
     function showPreview(file) {
         const preview = document.querySelector('.image-preview');